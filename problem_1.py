@@ -1,10 +1,29 @@
+from bisect import bisect_left
 from collections import OrderedDict
+from concurrent.futures import Future
+from functools import wraps
+from heapq import heapify, heappop, heappush
+from itertools import count
+from multiprocessing import resource_tracker, shared_memory
+from zlib import crc32
+import asyncio
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
 
 
 class ZeroLengthCache(Exception):
     pass
 
 
+# Pass as the default to a cache's `get`, to tell a missing key apart from any cached value (including -1).
+MISSING = object()
+
+
 class LeastRecentlyUsedStack(object):
     def __init__(self):
         self.items = OrderedDict()
@@ -25,7 +44,13 @@ class LeastRecentlyUsedStack(object):
         return self
 
 
-class LeastRecentlyUsedCache(object):
+class StackedLeastRecentlyUsedCache(object):
+    """
+    The original LRU cache: a map of key / value pairs, plus a separate LRU stack.
+
+    Kept as a baseline for `benchmark`.
+    """
+
     def __init__(self, capacity):
         if capacity < 1:
             raise ZeroLengthCache()
@@ -61,6 +86,1438 @@ class LeastRecentlyUsedCache(object):
         self.cache[key] = value
 
 
+class CacheStats(object):
+    """
+    Counters and latency histograms for a cache.
+    """
+
+    # Upper bounds of the latency histogram buckets, in seconds: 0.25 microseconds to 8 milliseconds, doubling.
+    BUCKETS = tuple(2 ** exponent / 1000000 for exponent in range(-2, 14))
+
+    def __init__(self, latency=True):
+        """
+        :param latency: Whether to record latency histograms, which costs two clock reads per operation.
+        """
+        self.latency = latency
+        self.hits = 0
+        self.misses = 0
+        self.inserts = 0
+        self.updates = 0
+        self.removals = {cause: 0 for cause in CacheInstrumentation.REMOVAL_CAUSES}
+
+        # One count per bucket, plus a final count for anything slower than the last bucket.
+        self.get_latency = [0] * (len(self.BUCKETS) + 1)
+        self.set_latency = [0] * (len(self.BUCKETS) + 1)
+
+    def record_get(self, hit, elapsed=None):
+        """Record the outcome of a "get", and optionally how long it took"""
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        if elapsed is not None:
+            self.get_latency[bisect_left(self.BUCKETS, elapsed)] += 1
+
+    def record_set(self, outcome, elapsed=None):
+        """
+        Record the outcome of a "set", and optionally how long it took.
+
+        A rejected item is counted by `record_removal`, rather than as an insert or update.
+        """
+        if outcome is CacheInstrumentation.INSERTED:
+            self.inserts += 1
+        elif outcome is CacheInstrumentation.UPDATED:
+            self.updates += 1
+        if elapsed is not None:
+            self.set_latency[bisect_left(self.BUCKETS, elapsed)] += 1
+
+    def record_removal(self, cause):
+        """Record the removal of an item"""
+        self.removals[cause] += 1
+
+    def add(self, other):
+        """Add the counts recorded by another CacheStats instance to this one"""
+        self.hits += other.hits
+        self.misses += other.misses
+        self.inserts += other.inserts
+        self.updates += other.updates
+        for cause, removals in other.removals.items():
+            self.removals[cause] += removals
+        self.get_latency = [total + count for total, count in zip(self.get_latency, other.get_latency)]
+        self.set_latency = [total + count for total, count in zip(self.set_latency, other.set_latency)]
+
+    def snapshot(self):
+        """
+        Return a copy of the current counters.
+
+        Latency histograms are keyed by the upper bound of each bucket, in seconds; the final bucket is unbounded.
+
+        :return: dict
+        """
+        requests = self.hits + self.misses
+        bounds = self.BUCKETS + (float('inf'),)
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / requests if requests else 0.0,
+            'inserts': self.inserts,
+            'updates': self.updates,
+            'rejections': self.removals[CacheInstrumentation.REJECTED],
+            'evictions': self.removals[CacheInstrumentation.EVICTED],
+            'removals': dict(self.removals),
+            'get_latency': dict(zip(bounds, self.get_latency)),
+            'set_latency': dict(zip(bounds, self.set_latency)),
+        }
+
+
+class CacheInstrumentation(object):
+    """
+    Stats and removal listener hooks, shared by the caches.
+
+    A cache using this mixin has `stats` (a CacheStats instance, or None) and `listener` (a function which accepts
+    the key, value, and cause of each removed item, or None) attributes, and implements:
+
+    * `_lookup(key)`, which returns the item's value, or MISSING.
+    * `_store(key, value, ...)`, which returns INSERTED, UPDATED, or REJECTED.
+    * `_usage()`, which returns a dict of the cache's current size (and weight, where it has one).
+
+    Its `get` and `set` check `stats` once, and only take the instrumented path when it is set; its removals are
+    only reported when `stats` or `listener` is set.
+    """
+
+    __slots__ = ()
+
+    # The outcomes of a "set".
+    INSERTED = 'inserted'
+    UPDATED = 'updated'
+
+    # The reasons an item may be removed.
+    EVICTED = 'evicted'     # To stay within the capacity or weight budget.
+    EXPIRED = 'expired'     # Its time-to-live passed.
+    REPLACED = 'replaced'   # A new value was set for its key.
+    REJECTED = 'rejected'   # It was heavier than the whole weight budget, so was never stored.
+    REMOVAL_CAUSES = (EVICTED, EXPIRED, REPLACED, REJECTED)
+
+    def _removed(self, key, value, cause):
+        """Report the removal of an item to the stats and listener"""
+        if self.stats is not None:
+            self.stats.record_removal(cause)
+        if self.listener is not None:
+            self.listener(key, value, cause)
+
+    def _recorded_get(self, key, default):
+        """Retrieve an item with the given key from the cache, recording the outcome in the stats"""
+        stats = self.stats
+        if stats.latency:
+            start = time.perf_counter()
+            value = self._lookup(key)
+            stats.record_get(value is not MISSING, time.perf_counter() - start)
+        else:
+            value = self._lookup(key)
+            stats.record_get(value is not MISSING)
+        return default if value is MISSING else value
+
+    def _recorded_set(self, *args):
+        """Add an item to the cache, recording the outcome in the stats, if any"""
+        stats = self.stats
+        if stats is None:
+            self._store(*args)
+        elif stats.latency:
+            start = time.perf_counter()
+            outcome = self._store(*args)
+            stats.record_set(outcome, time.perf_counter() - start)
+        else:
+            stats.record_set(self._store(*args))
+
+    def snapshot(self):
+        """
+        Return the current size of the cache, along with its stats, if any.
+
+        :return: dict
+        """
+        snapshot = self._usage()
+        if self.stats is not None:
+            snapshot.update(self.stats.snapshot())
+        return snapshot
+
+
+class LeastRecentlyUsedCache(CacheInstrumentation):
+    """
+    An LRU cache backed by a single OrderedDict, ordered from least to most recently used.
+
+    Optionally, a CacheStats instance records the cache's activity, and a listener is called whenever an item is
+    removed. Both cost a single check per operation when disabled.
+    """
+
+    __slots__ = ('capacity', 'cache', 'stats', 'listener')
+
+    def __init__(self, capacity, stats=None, listener=None):
+        """
+        :param capacity: The maximum number of items.
+        :param stats: A CacheStats instance which records the cache's activity, or None.
+        :param listener: A function which accepts the key, value, and cause of each removed item, or None.
+        """
+        if capacity < 1:
+            raise ZeroLengthCache()
+
+        self.capacity = capacity
+        self.cache = OrderedDict()
+        self.stats = stats
+        self.listener = listener
+
+    def contains(self, key):
+        """Return a boolean indicating whether an item with the given key exists in the cache"""
+        return key in self.cache
+
+    def is_full(self):
+        """Return a boolean indicating whether the cache is full"""
+        return len(self.cache) >= self.capacity
+
+    def _lookup(self, key):
+        """Retrieve an item with the given key from the cache, or MISSING"""
+        try:
+            self.cache.move_to_end(key)
+        except KeyError:
+            return MISSING
+        return self.cache[key]
+
+    def get(self, key, default=-1):
+        """Retrieve an item with the given key from the cache, or the default if it is missing"""
+        if self.stats is not None:
+            return self._recorded_get(key, default)
+        try:
+            self.cache.move_to_end(key)
+        except KeyError:
+            return default
+        return self.cache[key]
+
+    def __getitem__(self, key):
+        """Retrieve an item with the given key from the cache, raising KeyError if it is missing"""
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def _store(self, key, value):
+        """
+        Add the given key / value pair to the cache, reporting any removals.
+
+        :return: INSERTED or UPDATED.
+        """
+        cache = self.cache
+        if key in cache:
+            cache.move_to_end(key)
+            replaced = cache[key]
+            cache[key] = value
+            self._removed(key, replaced, self.REPLACED)
+            return self.UPDATED
+        if len(cache) >= self.capacity:
+            self._removed(*cache.popitem(last=False), self.EVICTED)
+        cache[key] = value
+        return self.INSERTED
+
+    def set(self, key, value):
+        """Add the given key / value pair to the cache"""
+        if self.stats is not None or self.listener is not None:
+            self._recorded_set(key, value)
+            return
+        cache = self.cache
+        if key in cache:
+            cache.move_to_end(key)
+        elif len(cache) >= self.capacity:
+            cache.popitem(last=False)
+        cache[key] = value
+
+    def get_many(self, keys):
+        """
+        Retrieve the items with the given keys from the cache, in a single call.
+
+        :param keys: An iterable of keys.
+        :return: A dict of the keys found in the cache, and their values. Missing keys are left out.
+        """
+        found = dict()
+        if self.stats is not None:
+            get = self.get
+            for key in keys:
+                value = get(key, MISSING)
+                if value is not MISSING:
+                    found[key] = value
+            return found
+
+        cache = self.cache
+        move_to_end = cache.move_to_end
+        for key in keys:
+            if key in cache:
+                move_to_end(key)
+                found[key] = cache[key]
+        return found
+
+    def set_many(self, items):
+        """
+        Add the given key / value pairs to the cache, in a single call.
+
+        :param items: A dict, or an iterable of key / value pairs.
+        """
+        if hasattr(items, 'items'):
+            items = items.items()
+        if self.stats is not None or self.listener is not None:
+            set = self.set
+            for key, value in items:
+                set(key, value)
+            return
+
+        cache = self.cache
+        capacity = self.capacity
+        for key, value in items:
+            if key in cache:
+                cache.move_to_end(key)
+            elif len(cache) >= capacity:
+                cache.popitem(last=False)
+            cache[key] = value
+
+    def _usage(self):
+        """Return the current size of the cache"""
+        return {'size': len(self.cache)}
+
+
+class BoundedLeastRecentlyUsedCache(LeastRecentlyUsedCache):
+    """
+    An LRU cache bounded by total weight as well as item count, with optional time-to-live expiry.
+
+    Each item's weight is calculated by the `weigher` function (e.g. its size in bytes); items heavier than the whole
+    budget are not cached. Expired items are removed lazily, when they are read, and incrementally: each `set` reclaims
+    up to `RECLAIM_BATCH` expired items from a heap ordered by expiry time. Neither requires a scan of the cache.
+    """
+
+    __slots__ = ('max_weight', 'weigher', 'ttl', 'clock', 'weight', 'expiries', 'sequence')
+
+    # Number of expired items reclaimed by each `set`.
+    RECLAIM_BATCH = 4
+
+    def __init__(self, capacity, max_weight=None, weigher=None, ttl=None, clock=time.monotonic, stats=None,
+                 listener=None):
+        """
+        :param capacity: The maximum number of items.
+        :param max_weight: The maximum total weight of the items, or None for no limit.
+        :param weigher: A function which accepts a key and value, and returns the item's weight. Defaults to 1.
+        :param ttl: The default number of seconds before an item expires, or None for no expiry.
+        :param clock: A function which returns the current time, in seconds.
+        :param stats: A CacheStats instance which records the cache's activity, or None.
+        :param listener: A function which accepts the key, value, and cause of each removed item, or None.
+        """
+        super().__init__(capacity, stats, listener)
+        self.max_weight = max_weight
+        self.weigher = weigher
+        self.ttl = ttl
+        self.clock = clock
+        self.weight = 0
+
+        # A heap of (expiry time, sequence, key). Items which have since been removed or replaced are skipped.
+        self.expiries = []
+        self.sequence = count()
+
+    def _remove(self, key, cause):
+        """Remove the item with the given key"""
+        value, weight, _ = self.cache.pop(key)
+        self.weight -= weight
+        if self.stats is not None or self.listener is not None:
+            self._removed(key, value, cause)
+
+    def _is_expired(self, entry, now):
+        """Return a boolean indicating whether the given cache entry has expired"""
+        return entry[2] is not None and entry[2] <= now
+
+    def _reclaim(self, now):
+        """Remove up to `RECLAIM_BATCH` expired items"""
+        expiries = self.expiries
+        for _ in range(self.RECLAIM_BATCH):
+            if not expiries or expiries[0][0] > now:
+                return
+            expires_at, _, key = heappop(expiries)
+            entry = self.cache.get(key)
+            if entry is not None and entry[2] == expires_at:
+                self._remove(key, self.EXPIRED)
+
+    def _compact_expiries(self):
+        """Rebuild the expiry heap from the live items, once it is mostly made up of skipped items"""
+        if len(self.expiries) <= 2 * len(self.cache) + self.RECLAIM_BATCH:
+            return
+        self.expiries = [(entry[2], next(self.sequence), key)
+                         for key, entry in self.cache.items() if entry[2] is not None]
+        heapify(self.expiries)
+
+    def contains(self, key):
+        """Return a boolean indicating whether an unexpired item with the given key exists in the cache"""
+        entry = self.cache.get(key)
+        return entry is not None and not self._is_expired(entry, self.clock())
+
+    def _lookup(self, key):
+        """Retrieve an item with the given key from the cache, or MISSING"""
+        entry = self.cache.get(key)
+        if entry is None:
+            return MISSING
+        if self._is_expired(entry, self.clock()):
+            self._remove(key, self.EXPIRED)
+            return MISSING
+        self.cache.move_to_end(key)
+        return entry[0]
+
+    def get(self, key, default=-1):
+        """Retrieve an item with the given key from the cache, or the default if it is missing"""
+        if self.stats is not None:
+            return self._recorded_get(key, default)
+        # The uninstrumented path, inlined to avoid a further call.
+        entry = self.cache.get(key)
+        if entry is None:
+            return default
+        if self._is_expired(entry, self.clock()):
+            self._remove(key, self.EXPIRED)
+            return default
+        self.cache.move_to_end(key)
+        return entry[0]
+
+    def get_many(self, keys):
+        """
+        Retrieve the unexpired items with the given keys from the cache.
+
+        :param keys: An iterable of keys.
+        :return: A dict of the keys found in the cache, and their values. Missing keys are left out.
+        """
+        get = self.get
+        found = dict()
+        for key in keys:
+            value = get(key, MISSING)
+            if value is not MISSING:
+                found[key] = value
+        return found
+
+    def _store(self, key, value, ttl):
+        """
+        Add the given key / value pair to the cache.
+
+        :return: INSERTED or UPDATED, or REJECTED if the item was heavier than the whole weight budget.
+        """
+        now = self.clock()
+        self._reclaim(now)
+
+        is_new = key not in self.cache
+        if not is_new:
+            self._remove(key, self.REPLACED)
+
+        weight = 1 if self.weigher is None else self.weigher(key, value)
+        if self.max_weight is not None and weight > self.max_weight:
+            if self.stats is not None or self.listener is not None:
+                self._removed(key, value, self.REJECTED)
+            return self.REJECTED
+
+        cache = self.cache
+        while cache and (len(cache) >= self.capacity or
+                         (self.max_weight is not None and self.weight + weight > self.max_weight)):
+            self._remove(next(iter(cache)), self.EVICTED)
+
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = None if ttl is None else now + ttl
+
+        cache[key] = (value, weight, expires_at)
+        self.weight += weight
+
+        if expires_at is not None:
+            heappush(self.expiries, (expires_at, next(self.sequence), key))
+            self._compact_expiries()
+
+        return self.INSERTED if is_new else self.UPDATED
+
+    def set(self, key, value, ttl=None):
+        """
+        Add the given key / value pair to the cache.
+
+        :param key: The key.
+        :param value: The value.
+        :param ttl: The number of seconds before the item expires. Defaults to the cache's ttl.
+        """
+        if self.stats is None:
+            self._store(key, value, ttl)
+        else:
+            self._recorded_set(key, value, ttl)
+
+    def set_many(self, items, ttl=None):
+        """
+        Add the given key / value pairs to the cache.
+
+        :param items: A dict, or an iterable of key / value pairs.
+        :param ttl: The number of seconds before the items expire. Defaults to the cache's ttl.
+        """
+        if hasattr(items, 'items'):
+            items = items.items()
+        set = self.set
+        for key, value in items:
+            set(key, value, ttl)
+
+    def _usage(self):
+        """Return the current size and weight of the cache"""
+        return {'size': len(self.cache), 'weight': self.weight}
+
+
+class ConcurrentLeastRecentlyUsedCache(object):
+    """
+    A thread-safe LRU cache.
+
+    Keys are sharded by hash across several LeastRecentlyUsedCaches, each guarded by its own lock, so threads working
+    on different shards do not contend. Each shard evicts its own least recently used item, so eviction order is
+    approximately, rather than strictly, LRU.
+    """
+
+    def __init__(self, capacity, shards=16, stats=False, listener=None, latency=True):
+        """
+        :param capacity: The maximum number of items.
+        :param shards: The number of shards.
+        :param stats: Whether to record stats. Each shard records into its own CacheStats, under its own lock, so
+                      no single instance is updated; the `stats` property combines them.
+        :param listener: A function which accepts the key, value, and cause of each removed item, or None. It is
+                         called under the lock of the shard which held the item.
+        :param latency: Whether the shards' stats record latency histograms.
+        """
+        if capacity < 1:
+            raise ZeroLengthCache()
+        if isinstance(stats, CacheStats):
+            raise TypeError('Each shard records its own stats; pass stats=True, and read the stats property')
+
+        shards = min(shards, capacity)
+        self.capacity = capacity
+        self.shards = [LeastRecentlyUsedCache(capacity // shards + (1 if i < capacity % shards else 0),
+                                              CacheStats(latency) if stats else None, listener)
+                       for i in range(shards)]
+        self.locks = [threading.Lock() for _ in range(shards)]
+
+        # In-flight loads, by key, for each shard
+        self.loading = [dict() for _ in range(shards)]
+
+    def _shard(self, key):
+        """Return the index of the shard which holds the given key"""
+        return hash(key) % len(self.shards)
+
+    def contains(self, key):
+        """Return a boolean indicating whether an item with the given key exists in the cache"""
+        index = self._shard(key)
+        with self.locks[index]:
+            return self.shards[index].contains(key)
+
+    def get(self, key, default=-1):
+        """Retrieve an item with the given key from the cache, or the default if it is missing"""
+        index = self._shard(key)
+        with self.locks[index]:
+            return self.shards[index].get(key, default)
+
+    def set(self, key, value):
+        """Add the given key / value pair to the cache"""
+        index = self._shard(key)
+        with self.locks[index]:
+            self.shards[index].set(key, value)
+
+    def _by_shard(self, items, key=lambda item: item):
+        """Group the given items by the index of the shard which holds their key"""
+        groups = dict()
+        shard = self._shard
+        for item in items:
+            groups.setdefault(shard(key(item)), []).append(item)
+        return groups.items()
+
+    def get_many(self, keys):
+        """
+        Retrieve the items with the given keys from the cache, taking each shard's lock once.
+
+        :param keys: An iterable of keys.
+        :return: A dict of the keys found in the cache, and their values. Missing keys are left out.
+        """
+        found = dict()
+        for index, shard_keys in self._by_shard(keys):
+            with self.locks[index]:
+                found.update(self.shards[index].get_many(shard_keys))
+        return found
+
+    def set_many(self, items):
+        """
+        Add the given key / value pairs to the cache, taking each shard's lock once.
+
+        :param items: A dict, or an iterable of key / value pairs.
+        """
+        if hasattr(items, 'items'):
+            items = items.items()
+        for index, shard_items in self._by_shard(items, key=lambda item: item[0]):
+            with self.locks[index]:
+                self.shards[index].set_many(shard_items)
+
+    def get_or_load(self, key, loader):
+        """
+        Retrieve an item with the given key from the cache, loading it on a miss.
+
+        Concurrent misses for the same key are coalesced: the first caller runs the loader, and the others wait for
+        its result. If the loader raises an exception, every waiting caller receives it, and nothing is cached.
+
+        :param key: The key.
+        :param loader: A function which accepts the key, and returns its value.
+        :return: The value.
+        """
+        index = self._shard(key)
+        shard, lock, loading = self.shards[index], self.locks[index], self.loading[index]
+
+        with lock:
+            value = shard.get(key, MISSING)
+            if value is not MISSING:
+                return value
+            future = loading.get(key)
+            is_loader = future is None
+            if is_loader:
+                future = loading[key] = Future()
+
+        if not is_loader:
+            return future.result()
+
+        try:
+            value = loader(key)
+        except BaseException as error:
+            with lock:
+                del loading[key]
+            future.set_exception(error)
+            raise
+
+        with lock:
+            shard.set(key, value)
+            del loading[key]
+        future.set_result(value)
+
+        return value
+
+    @property
+    def stats(self):
+        """The combined stats of every shard, or None"""
+        if self.shards[0].stats is None:
+            return None
+        combined = CacheStats(self.shards[0].stats.latency)
+        for shard, lock in zip(self.shards, self.locks):
+            with lock:
+                combined.add(shard.stats)
+        return combined
+
+    def snapshot(self):
+        """
+        Return the current size of the cache, along with the combined stats of its shards, if any.
+
+        Each shard is locked in turn, so the counts are consistent within a shard, but not across shards.
+
+        :return: dict
+        """
+        snapshot = {'size': 0}
+        for shard, lock in zip(self.shards, self.locks):
+            with lock:
+                snapshot['size'] += len(shard.cache)
+        stats = self.stats
+        if stats is not None:
+            snapshot.update(stats.snapshot())
+        return snapshot
+
+
+class AsyncLeastRecentlyUsedCache(object):
+    """
+    An LRU cache for use by the tasks of a single asyncio event loop.
+
+    Operations do not await, so they are atomic with respect to other tasks.
+    """
+
+    def __init__(self, capacity, stats=None, listener=None):
+        """
+        :param capacity: The maximum number of items.
+        :param stats: A CacheStats instance which records the cache's activity, or None.
+        :param listener: A function which accepts the key, value, and cause of each removed item, or None.
+        """
+        self.cache = LeastRecentlyUsedCache(capacity, stats, listener)
+        self.loading = dict()
+
+    def contains(self, key):
+        """Return a boolean indicating whether an item with the given key exists in the cache"""
+        return self.cache.contains(key)
+
+    def get(self, key, default=-1):
+        """Retrieve an item with the given key from the cache, or the default if it is missing"""
+        return self.cache.get(key, default)
+
+    def set(self, key, value):
+        """Add the given key / value pair to the cache"""
+        self.cache.set(key, value)
+
+    def snapshot(self):
+        """
+        Return the current size of the cache, along with its stats, if any.
+
+        :return: dict
+        """
+        return self.cache.snapshot()
+
+    async def get_or_load(self, key, loader):
+        """
+        Retrieve an item with the given key from the cache, loading it on a miss.
+
+        Concurrent misses for the same key are coalesced: the first task awaits the loader, and the others wait for
+        its result. If the loader raises an exception, every waiting task receives it, and nothing is cached. If the
+        loading task is cancelled, the waiting tasks are not: the first of them to resume starts the load again.
+
+        :param key: The key.
+        :param loader: A coroutine function which accepts the key, and returns its value.
+        :return: The value.
+        """
+        while True:
+            value = self.cache.get(key, MISSING)
+            if value is not MISSING:
+                return value
+
+            future = self.loading.get(key)
+            if future is None:
+                break
+            # Shield the shared future, so a cancelled waiter does not cancel the load for everyone else.
+            value = await asyncio.shield(future)
+            if value is not MISSING:
+                return value
+
+        future = self.loading[key] = asyncio.get_running_loop().create_future()
+
+        try:
+            value = await loader(key)
+        except asyncio.CancelledError:
+            # Only this task was cancelled; MISSING tells the waiting tasks to load the value again.
+            del self.loading[key]
+            future.set_result(MISSING)
+            raise
+        except BaseException as error:
+            del self.loading[key]
+            future.set_exception(error)
+            future.exception()  # Mark the exception as retrieved, in case nothing else is waiting.
+            raise
+
+        self.cache.set(key, value)
+        del self.loading[key]
+        future.set_result(value)
+
+        return value
+
+
+class SharedLeastRecentlyUsedCache(object):
+    """
+    An LRU cache of bytes keys and values, held in shared memory so that several processes can use the same cache.
+
+    The shared memory holds a fixed number of slots, each with room for a key of up to `key_size` bytes and a value of
+    up to `value_size` bytes, and an open-addressing hash table (linear probing, with backward-shift deletion) which
+    maps each key's hash to its slot. The slots form a doubly linked list, ordered from least to most recently used;
+    unused slots form a free list. Every array is a memoryview over the shared memory, so nothing is pickled.
+
+    Operations are guarded by a `multiprocessing.Lock`. Create the cache before forking worker processes, or pass its
+    `name` and `lock` to other processes, which call `attach`.
+    """
+
+    MAGIC = b'LRUSHM01'
+
+    # Fields of the header, which follow the magic bytes.
+    SLOTS, KEY_SIZE, VALUE_SIZE, BUCKETS, COUNT, HEAD, TAIL, FREE = range(8)
+    HEADER_FIELDS = 8
+
+    # Marks an empty bucket, or the end of a list.
+    EMPTY = -1
+
+    def __init__(self, capacity, key_size=64, value_size=1024, name=None, lock=None):
+        """
+        :param capacity: The maximum number of items.
+        :param key_size: The maximum length of a key, in bytes.
+        :param value_size: The maximum length of a value, in bytes.
+        :param name: The name of the shared memory block to create, or None for a generated name.
+        :param lock: A lock shared by every process using the cache. Defaults to a new multiprocessing.Lock.
+        """
+        if capacity < 1:
+            raise ZeroLengthCache()
+
+        buckets = 1 << (2 * capacity - 1).bit_length()
+        size = self._size(capacity, key_size, value_size, buckets)
+        self.memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.lock = multiprocessing.Lock() if lock is None else lock
+
+        self.memory.buf[:len(self.MAGIC)] = self.MAGIC
+        self._map(capacity, key_size, value_size, buckets)
+        self.header[self.SLOTS] = capacity
+        self.header[self.KEY_SIZE] = key_size
+        self.header[self.VALUE_SIZE] = value_size
+        self.header[self.BUCKETS] = buckets
+        self.header[self.COUNT] = 0
+        self.header[self.HEAD] = self.header[self.TAIL] = self.EMPTY
+
+        for bucket in range(buckets):
+            self.index[bucket] = self.EMPTY
+        for slot in range(capacity):
+            self.next[slot] = slot + 1 if slot + 1 < capacity else self.EMPTY
+        self.header[self.FREE] = 0
+
+    @classmethod
+    def attach(cls, name, lock):
+        """
+        Open a cache created by another process.
+
+        Only the process which created the cache should `unlink` it. Opening a shared memory block registers it with
+        this process's resource tracker, which would otherwise unlink it when this process exits, so the block is
+        unregistered again.
+
+        :param name: The `name` of the cache's shared memory block.
+        :param lock: The cache's `lock`.
+        :return: SharedLeastRecentlyUsedCache
+        """
+        cache = cls.__new__(cls)
+        cache.memory = shared_memory.SharedMemory(name=name)
+        cache.lock = lock
+        if os.name == 'posix':
+            resource_tracker.unregister(cache.memory._name, 'shared_memory')
+
+        if bytes(cache.memory.buf[:len(cls.MAGIC)]) != cls.MAGIC:
+            cache.memory.close()
+            raise ValueError('Shared memory block {} does not hold a cache'.format(name))
+        header = cache.memory.buf[len(cls.MAGIC):len(cls.MAGIC) + 4 * cls.HEADER_FIELDS].cast('i')
+        capacity, key_size, value_size, buckets = header[cls.SLOTS], header[cls.KEY_SIZE], header[cls.VALUE_SIZE], \
+            header[cls.BUCKETS]
+        header.release()
+
+        cache._map(capacity, key_size, value_size, buckets)
+        return cache
+
+    @classmethod
+    def _size(cls, capacity, key_size, value_size, buckets):
+        """Return the number of bytes of shared memory needed by a cache"""
+        return len(cls.MAGIC) + 4 * (cls.HEADER_FIELDS + buckets + 5 * capacity) + capacity * (key_size + value_size)
+
+    def _map(self, capacity, key_size, value_size, buckets):
+        """Lay out the header, hash table, slot arrays, and data over the shared memory"""
+        buffer = self.memory.buf
+        offset = len(self.MAGIC)
+        views = []
+        for length in (self.HEADER_FIELDS, buckets, capacity, capacity, capacity, capacity):
+            views.append(buffer[offset:offset + 4 * length].cast('i'))
+            offset += 4 * length
+        # Hashes are unsigned, so need no masking.
+        views.append(buffer[offset:offset + 4 * capacity].cast('I'))
+        offset += 4 * capacity
+
+        self.header, self.index, self.previous, self.next, self.key_lengths, self.value_lengths, self.hashes = views
+        self.data = buffer[offset:offset + capacity * (key_size + value_size)]
+        self.capacity = capacity
+        self.key_size = key_size
+        self.value_size = value_size
+        self.mask = buckets - 1
+
+    @property
+    def name(self):
+        """The name of the shared memory block, used to `attach` to the cache"""
+        return self.memory.name
+
+    def close(self):
+        """Release this process's view of the cache"""
+        for view in (self.header, self.index, self.previous, self.next, self.key_lengths, self.value_lengths,
+                     self.hashes, self.data):
+            view.release()
+        self.memory.close()
+
+    def unlink(self):
+        """Destroy the shared memory block, once every process has closed the cache"""
+        if os.name == 'posix':
+            # An `attach` which shares this process's resource tracker has already unregistered the block, and the
+            # tracker complains if it is unregistered twice, so register it again first (which is otherwise a no-op).
+            resource_tracker.register(self.memory._name, 'shared_memory')
+        self.memory.unlink()
+
+    def _find(self, key, hashed):
+        """
+        Find the bucket of the hash table for the given key.
+
+        :return: The bucket, and the key's slot, or EMPTY if the key is not in the cache (in which case the bucket is
+                 where it would be inserted).
+        """
+        index, hashes, key_lengths, data = self.index, self.hashes, self.key_lengths, self.data
+        stride = self.key_size + self.value_size
+        length = len(key)
+        bucket = hashed & self.mask
+        while True:
+            slot = index[bucket]
+            if slot == self.EMPTY:
+                return bucket, slot
+            if hashes[slot] == hashed and key_lengths[slot] == length and \
+                    data[slot * stride:slot * stride + length] == key:
+                return bucket, slot
+            bucket = (bucket + 1) & self.mask
+
+    def _unlink(self, slot):
+        """Remove a slot from the LRU list"""
+        previous, next_ = self.previous[slot], self.next[slot]
+        if previous == self.EMPTY:
+            self.header[self.HEAD] = next_
+        else:
+            self.next[previous] = next_
+        if next_ == self.EMPTY:
+            self.header[self.TAIL] = previous
+        else:
+            self.previous[next_] = previous
+
+    def _append(self, slot):
+        """Add a slot to the most recently used end of the LRU list"""
+        tail = self.header[self.TAIL]
+        self.previous[slot] = tail
+        self.next[slot] = self.EMPTY
+        if tail == self.EMPTY:
+            self.header[self.HEAD] = slot
+        else:
+            self.next[tail] = slot
+        self.header[self.TAIL] = slot
+
+    def _evict(self):
+        """Remove the least recently used item, and return its slot to the free list"""
+        slot = self.header[self.HEAD]
+        self._unlink(slot)
+
+        index, mask = self.index, self.mask
+        bucket = self.hashes[slot] & mask
+        while index[bucket] != slot:
+            bucket = (bucket + 1) & mask
+
+        # Shift later entries of the probe sequence back into the gap, so that no lookup stops short of its key.
+        gap = bucket
+        bucket = (bucket + 1) & mask
+        while index[bucket] != self.EMPTY:
+            home = self.hashes[index[bucket]] & mask
+            if (bucket - home) & mask >= (bucket - gap) & mask:
+                index[gap] = index[bucket]
+                gap = bucket
+            bucket = (bucket + 1) & mask
+        index[gap] = self.EMPTY
+
+        self.next[slot] = self.header[self.FREE]
+        self.header[self.FREE] = slot
+        self.header[self.COUNT] -= 1
+
+    def contains(self, key):
+        """Return a boolean indicating whether an item with the given key exists in the cache"""
+        with self.lock:
+            return self._find(key, crc32(key))[1] != self.EMPTY
+
+    def is_full(self):
+        """Return a boolean indicating whether the cache is full"""
+        with self.lock:
+            return self.header[self.COUNT] >= self.capacity
+
+    def get(self, key, default=-1):
+        """Retrieve an item with the given key from the cache, or the default if it is missing"""
+        with self.lock:
+            _, slot = self._find(key, crc32(key))
+            if slot == self.EMPTY:
+                return default
+            if slot != self.header[self.TAIL]:
+                self._unlink(slot)
+                self._append(slot)
+            start = slot * (self.key_size + self.value_size) + self.key_size
+            return bytes(self.data[start:start + self.value_lengths[slot]])
+
+    def set(self, key, value):
+        """
+        Add the given key / value pair to the cache.
+
+        :param key: The key, as bytes of up to `key_size`.
+        :param value: The value, as bytes of up to `value_size`.
+        """
+        if len(key) > self.key_size or len(value) > self.value_size:
+            raise ValueError('Keys are limited to {} bytes, and values to {} bytes'.format(
+                self.key_size, self.value_size))
+
+        hashed = crc32(key)
+        stride = self.key_size + self.value_size
+        with self.lock:
+            bucket, slot = self._find(key, hashed)
+            if slot == self.EMPTY:
+                if self.header[self.COUNT] >= self.capacity:
+                    self._evict()
+                    bucket, _ = self._find(key, hashed)
+
+                slot = self.header[self.FREE]
+                self.header[self.FREE] = self.next[slot]
+                self.header[self.COUNT] += 1
+                self.index[bucket] = slot
+                self.hashes[slot] = hashed
+                self.key_lengths[slot] = len(key)
+                self.data[slot * stride:slot * stride + len(key)] = key
+            else:
+                self._unlink(slot)
+            self._append(slot)
+
+            start = slot * stride + self.key_size
+            self.data[start:start + len(value)] = value
+            self.value_lengths[slot] = len(value)
+
+
+def make_key(args, kwargs, typed=False):
+    """
+    Build a cache key from a function's arguments.
+
+    :param args: The positional arguments.
+    :param kwargs: The keyword arguments.
+    :param typed: Whether arguments of different types are cached separately (e.g. 1 and 1.0).
+    :return: A hashable key.
+    """
+    if not kwargs and not typed and len(args) == 1 and type(args[0]) in (int, str):
+        # A lone int or string is its own key, which saves building a tuple on every call.
+        return args[0]
+
+    key = args
+    if kwargs:
+        key += (MISSING,) + tuple(sorted(kwargs.items()))
+    if typed:
+        key += tuple(type(arg) for arg in args) + tuple(type(value) for value in kwargs.values())
+    return key
+
+
+def lru_memoize(cache=None, capacity=128, key=None, typed=False):
+    """
+    Memoize a function in an LRU cache.
+
+    :param cache: The cache to store results in: any cache whose `get` accepts a default. Defaults to a new
+                  LeastRecentlyUsedCache.
+    :param capacity: The capacity of the default cache.
+    :param key: A function which accepts the memoized function's arguments, and returns a hashable key. Defaults to
+                `make_key`, paired with the memoized function when the cache is given, so that functions sharing a
+                cache do not share results.
+    :param typed: Whether arguments of different types are cached separately, when using the default key.
+    :return: A decorator. The decorated function's cache is available as its `cache` attribute.
+    """
+    shared = cache is not None
+    if cache is None:
+        cache = LeastRecentlyUsedCache(capacity)
+
+    def decorator(function):
+        get, set = cache.get, cache.set
+
+        @wraps(function)
+        def memoized(*args, **kwargs):
+            if key is not None:
+                cache_key = key(*args, **kwargs)
+            elif shared:
+                cache_key = (function, make_key(args, kwargs, typed))
+            else:
+                cache_key = make_key(args, kwargs, typed)
+            value = get(cache_key, MISSING)
+            if value is MISSING:
+                value = function(*args, **kwargs)
+                set(cache_key, value)
+            return value
+
+        memoized.cache = cache
+        return memoized
+
+    return decorator
+
+
+class AdaptiveReplacementCache(CacheInstrumentation):
+    """
+    An Adaptive Replacement Cache (ARC).
+
+    Items seen once are held in a recency list (T1), and items seen at least twice in a frequency list (T2). Ghost lists
+    (B1 and B2) remember the keys recently evicted from each, and adapt the target size of T1 (`target`) to the
+    workload. A one-off scan only passes through T1, so it cannot flush the frequently used items in T2.
+    """
+
+    __slots__ = ('capacity', 'target', 't1', 't2', 'b1', 'b2', 'stats', 'listener')
+
+    def __init__(self, capacity, stats=None, listener=None):
+        """
+        :param capacity: The maximum number of items.
+        :param stats: A CacheStats instance which records the cache's activity, or None.
+        :param listener: A function which accepts the key, value, and cause of each removed item, or None.
+        """
+        if capacity < 1:
+            raise ZeroLengthCache()
+
+        self.capacity = capacity
+        self.target = 0
+        self.t1 = OrderedDict()
+        self.t2 = OrderedDict()
+        self.b1 = OrderedDict()
+        self.b2 = OrderedDict()
+        self.stats = stats
+        self.listener = listener
+
+    def contains(self, key):
+        """Return a boolean indicating whether an item with the given key exists in the cache"""
+        return key in self.t1 or key in self.t2
+
+    def is_full(self):
+        """Return a boolean indicating whether the cache is full"""
+        return len(self.t1) + len(self.t2) >= self.capacity
+
+    def _replace(self, in_b2):
+        """Evict the least recently used item from T1 or T2, according to the target size of T1"""
+        if self.t1 and (len(self.t1) > self.target or (in_b2 and len(self.t1) == self.target) or not self.t2):
+            key, value = self.t1.popitem(last=False)
+            self.b1[key] = None
+        else:
+            key, value = self.t2.popitem(last=False)
+            self.b2[key] = None
+        if self.stats is not None or self.listener is not None:
+            self._removed(key, value, self.EVICTED)
+
+    def _lookup(self, key):
+        """Retrieve an item with the given key from the cache, or MISSING"""
+        if key in self.t1:
+            value = self.t2[key] = self.t1.pop(key)
+            return value
+        if key in self.t2:
+            self.t2.move_to_end(key)
+            return self.t2[key]
+        return MISSING
+
+    def get(self, key, default=-1):
+        """Retrieve an item with the given key from the cache, or the default if it is missing"""
+        if self.stats is not None:
+            return self._recorded_get(key, default)
+        if key in self.t1:
+            value = self.t2[key] = self.t1.pop(key)
+            return value
+        if key in self.t2:
+            self.t2.move_to_end(key)
+            return self.t2[key]
+        return default
+
+    def _store(self, key, value):
+        """
+        Add the given key / value pair to the cache.
+
+        :return: INSERTED or UPDATED.
+        """
+        t1, t2, b1, b2 = self.t1, self.t2, self.b1, self.b2
+
+        if key in t1:
+            replaced = t1.pop(key)
+            t2[key] = value
+        elif key in t2:
+            replaced = t2[key]
+            t2[key] = value
+            t2.move_to_end(key)
+        else:
+            replaced = MISSING
+        if replaced is not MISSING:
+            if self.stats is not None or self.listener is not None:
+                self._removed(key, replaced, self.REPLACED)
+            return self.UPDATED
+
+        if key in b1:
+            self.target = min(self.capacity, self.target + max(len(b2) / len(b1), 1))
+            self._replace(False)
+            del b1[key]
+            t2[key] = value
+            return self.INSERTED
+        if key in b2:
+            self.target = max(0, self.target - max(len(b1) / len(b2), 1))
+            self._replace(True)
+            del b2[key]
+            t2[key] = value
+            return self.INSERTED
+
+        if len(t1) + len(b1) >= self.capacity:
+            if len(t1) < self.capacity:
+                b1.popitem(last=False)
+                self._replace(False)
+            else:
+                evicted, evicted_value = t1.popitem(last=False)
+                if self.stats is not None or self.listener is not None:
+                    self._removed(evicted, evicted_value, self.EVICTED)
+        else:
+            total = len(t1) + len(t2) + len(b1) + len(b2)
+            if total >= self.capacity:
+                if total >= 2 * self.capacity:
+                    b2.popitem(last=False)
+                self._replace(False)
+
+        t1[key] = value
+        return self.INSERTED
+
+    def set(self, key, value):
+        """Add the given key / value pair to the cache"""
+        if self.stats is None:
+            self._store(key, value)
+        else:
+            self._recorded_set(key, value)
+
+    def _usage(self):
+        """Return the current size of the cache"""
+        return {'size': len(self.t1) + len(self.t2)}
+
+
+class CountMinSketch(object):
+    """
+    An approximate count of how often each key has been seen, in a fixed amount of memory.
+
+    Each key maps to one counter in each of several rows; its estimate is the smallest of those counters. Counters
+    saturate at `MAX_COUNT`, and are all halved once `sample_size` keys have been counted, so the estimates favour
+    recent activity.
+    """
+
+    # Odd multipliers, used to derive an independent counter index for each row from the key's hash.
+    SEEDS = (0x9e3779b97f4a7c15, 0xc2b2ae3d27d4eb4f, 0x165667b19e3779f9, 0x27d4eb2f165667c5)
+    MAX_COUNT = 15
+
+    def __init__(self, width, sample_size):
+        width = 1 << max(width - 1, 1).bit_length()
+        self.mask = width - 1
+        self.rows = [bytearray(width) for _ in self.SEEDS]
+        self.sample_size = sample_size
+        self.additions = 0
+
+    def increment(self, key):
+        """Count an occurrence of the given key"""
+        hashed = hash(key)
+        mask = self.mask
+        for row, seed in zip(self.rows, self.SEEDS):
+            index = ((hashed * seed) >> 32) & mask
+            if row[index] < self.MAX_COUNT:
+                row[index] += 1
+
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.reset()
+
+    def estimate(self, key):
+        """Return the estimated number of occurrences of the given key"""
+        hashed = hash(key)
+        return min(row[((hashed * seed) >> 32) & self.mask] for row, seed in zip(self.rows, self.SEEDS))
+
+    def reset(self):
+        """Halve every counter"""
+        self.rows = [bytearray(count >> 1 for count in row) for row in self.rows]
+        self.additions //= 2
+
+
+class WindowTinyLfuCache(CacheInstrumentation):
+    """
+    A W-TinyLFU cache.
+
+    New items enter a small LRU window. Items evicted from the window are only admitted to the main cache if the
+    frequency sketch estimates that they are used more often than the item they would replace, so a one-off scan
+    cannot flush frequently used items. The main cache is a segmented LRU: items enter a probationary segment, and
+    are promoted to a protected segment when they are used again.
+
+    Every `get` and `set` counts as a use of the key.
+    """
+
+    __slots__ = ('capacity', 'window_capacity', 'main_capacity', 'protected_capacity', 'window', 'probation',
+                 'protected', 'sketch', 'stats', 'listener')
+
+    def __init__(self, capacity, window_ratio=0.01, protected_ratio=0.8, stats=None, listener=None):
+        """
+        :param capacity: The maximum number of items.
+        :param window_ratio: The proportion of the capacity given to the window.
+        :param protected_ratio: The proportion of the main cache given to the protected segment.
+        :param stats: A CacheStats instance which records the cache's activity, or None.
+        :param listener: A function which accepts the key, value, and cause of each removed item, or None.
+        """
+        if capacity < 1:
+            raise ZeroLengthCache()
+
+        self.capacity = capacity
+        self.window_capacity = max(1, int(capacity * window_ratio))
+        self.main_capacity = capacity - self.window_capacity
+        self.protected_capacity = int(self.main_capacity * protected_ratio)
+
+        self.window = OrderedDict()
+        self.probation = OrderedDict()
+        self.protected = OrderedDict()
+        self.sketch = CountMinSketch(capacity, 10 * capacity)
+        self.stats = stats
+        self.listener = listener
+
+    def contains(self, key):
+        """Return a boolean indicating whether an item with the given key exists in the cache"""
+        return key in self.window or key in self.probation or key in self.protected
+
+    def is_full(self):
+        """Return a boolean indicating whether the cache is full"""
+        return len(self.window) + len(self.probation) + len(self.protected) >= self.capacity
+
+    def _promote(self, key, value):
+        """Move an item from the probationary segment to the protected segment"""
+        del self.probation[key]
+        self.protected[key] = value
+        if len(self.protected) > self.protected_capacity:
+            demoted, demoted_value = self.protected.popitem(last=False)
+            self.probation[demoted] = demoted_value
+
+    def _admit(self, key, value):
+        """Offer an item evicted from the window to the main cache, evicting either it or the item it would replace"""
+        if len(self.probation) + len(self.protected) < self.main_capacity:
+            self.probation[key] = value
+            return
+
+        segment = self.probation or self.protected
+        if segment:  # Otherwise, there is no main cache.
+            victim = next(iter(segment))
+            if self.sketch.estimate(key) > self.sketch.estimate(victim):
+                self.probation[key] = value
+                key, value = victim, segment.pop(victim)
+        if self.stats is not None or self.listener is not None:
+            self._removed(key, value, self.EVICTED)
+
+    def _lookup(self, key):
+        """Retrieve an item with the given key from the cache, or MISSING"""
+        if key in self.window:
+            self.window.move_to_end(key)
+            return self.window[key]
+        if key in self.protected:
+            self.protected.move_to_end(key)
+            return self.protected[key]
+        if key in self.probation:
+            value = self.probation[key]
+            self._promote(key, value)
+            return value
+        return MISSING
+
+    def get(self, key, default=-1):
+        """Retrieve an item with the given key from the cache, or the default if it is missing"""
+        self.sketch.increment(key)
+        if self.stats is not None:
+            return self._recorded_get(key, default)
+        value = self._lookup(key)
+        return default if value is MISSING else value
+
+    def _store(self, key, value):
+        """
+        Add the given key / value pair to the cache.
+
+        :return: INSERTED or UPDATED.
+        """
+        for segment in (self.window, self.protected, self.probation):
+            if key in segment:
+                replaced = segment[key]
+                if segment is self.probation:
+                    self._promote(key, value)
+                else:
+                    segment[key] = value
+                    segment.move_to_end(key)
+                if self.stats is not None or self.listener is not None:
+                    self._removed(key, replaced, self.REPLACED)
+                return self.UPDATED
+
+        self.window[key] = value
+        if len(self.window) > self.window_capacity:
+            self._admit(*self.window.popitem(last=False))
+        return self.INSERTED
+
+    def set(self, key, value):
+        """Add the given key / value pair to the cache"""
+        self.sketch.increment(key)
+        if self.stats is None:
+            self._store(key, value)
+        else:
+            self._recorded_set(key, value)
+
+    def _usage(self):
+        """Return the current size of the cache"""
+        return {'size': len(self.window) + len(self.probation) + len(self.protected)}
+
+
+def generate_trace(length, key_space, skew=3, seed=0):
+    """
+    Generate a trace of cache keys, skewed towards the low keys.
+
+    :param length: The number of keys in the trace.
+    :param key_space: The number of distinct keys.
+    :param skew: The skew exponent. 1 is uniform; higher values concentrate accesses on fewer keys.
+    :param seed: The random seed.
+    :return: A list of integer keys.
+    """
+    generator = random.Random(seed)
+    return [int(key_space * generator.random() ** skew) for _ in range(length)]
+
+
+def generate_scan_trace(length, key_space, scan_length, scan_every, skew=3, seed=0):
+    """
+    Generate a skewed trace of cache keys, interrupted by scans of keys which are used once.
+
+    :param length: The number of skewed keys in the trace.
+    :param key_space: The number of distinct skewed keys.
+    :param scan_length: The number of keys in each scan.
+    :param scan_every: The number of skewed keys between scans.
+    :param skew: The skew exponent.
+    :param seed: The random seed.
+    :return: A list of integer keys.
+    """
+    trace = []
+    next_scan_key = key_space
+    skewed = generate_trace(length, key_space, skew, seed)
+
+    for start in range(0, length, scan_every):
+        trace.extend(skewed[start:start + scan_every])
+        trace.extend(range(next_scan_key, next_scan_key + scan_length))
+        next_scan_key += scan_length
+
+    return trace
+
+
+def benchmark(cache_class, trace, capacity):
+    """
+    Replay a trace against a cache, setting each key which misses.
+
+    :param cache_class: The cache class to measure.
+    :param trace: A list of keys.
+    :param capacity: The cache capacity.
+    :return: A dict containing the hit ratio, operations per second, and bytes allocated per cached entry.
+    """
+    cache = cache_class(capacity)
+    hits = 0
+    operations = 0
+
+    start = time.perf_counter()
+    for key in trace:
+        operations += 1
+        if cache.get(key) == -1:
+            cache.set(key, key)
+            operations += 1
+        else:
+            hits += 1
+    elapsed = time.perf_counter() - start
+
+    # Measure the memory used by a full cache, excluding the keys and values themselves.
+    keys = list(range(capacity))
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    cache = cache_class(capacity)
+    for key in keys:
+        cache.set(key, None)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return {
+        'hit_ratio': hits / len(trace) if trace else 0.0,
+        'ops_per_second': operations / elapsed if elapsed else 0.0,
+        'bytes_per_entry': (after - before) / capacity,
+    }
+
+
+def compare(trace, capacity, cache_classes):
+    """
+    Replay a trace against each of several cache classes.
+
+    :param trace: A list of keys.
+    :param capacity: The cache capacity.
+    :param cache_classes: The cache classes to compare.
+    :return: A dict of benchmark results, keyed by class name.
+    """
+    return {cache_class.__name__: benchmark(cache_class, trace, capacity) for cache_class in cache_classes}
+
+
+def print_results(title, results):
+    """Print the benchmark results returned by `compare`"""
+    print(title)
+    for name, result in results.items():
+        print("  {}: hit ratio {:.3f}, {:,.0f} ops/sec, {:.0f} bytes/entry".format(
+            name, result['hit_ratio'], result['ops_per_second'], result['bytes_per_entry']))
+
+
 # -------------------
 # Tests for LRU stack
 # -------------------
@@ -119,3 +1576,538 @@ try:
     assert False, 'Attempting to create a zero-length cache should raise a ZeroLengthCache exception'
 except ZeroLengthCache:
     assert True
+
+# Updating an existing key in a full cache does not evict another item
+cache = LeastRecentlyUsedCache(2)
+cache.set('a', 1)
+cache.set('b', 2)
+cache.set('a', 3)
+assert cache.get('a') == 3
+assert cache.get('b') == 2
+
+# Values are stored once, with no per-instance __dict__
+assert not hasattr(cache, '__dict__')
+assert list(cache.cache) == ['a', 'b']
+
+# -------------------
+# Tests for benchmark
+# -------------------
+trace = generate_trace(1000, 100)
+assert trace == generate_trace(1000, 100)
+assert all(0 <= key < 100 for key in trace)
+
+for cache_class in (StackedLeastRecentlyUsedCache, LeastRecentlyUsedCache):
+    result = benchmark(cache_class, trace, 10)
+    assert 0 < result['hit_ratio'] < 1
+    assert result['ops_per_second'] > 0
+    assert result['bytes_per_entry'] > 0
+
+# Both implementations agree on every hit and miss
+stacked = benchmark(StackedLeastRecentlyUsedCache, trace, 10)
+single = benchmark(LeastRecentlyUsedCache, trace, 10)
+assert stacked['hit_ratio'] == single['hit_ratio']
+
+# ------------------------------
+# Tests for scan-resistant caches
+# ------------------------------
+for cache_class in (AdaptiveReplacementCache, WindowTinyLfuCache):
+    cache = cache_class(5)
+    assert cache.get('a') == -1
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    cache.set('a', 2)
+    assert cache.get('a') == 2
+    assert cache.contains('a')
+
+    # The cache never holds more than its capacity
+    for key in range(100):
+        cache.set(key, key)
+        cache.get(key % 7)
+    assert sum(cache.contains(key) for key in range(100)) <= 5
+
+    try:
+        cache_class(0)
+        assert False, 'Attempting to create a zero-length cache should raise a ZeroLengthCache exception'
+    except ZeroLengthCache:
+        assert True
+
+
+def hot_key_hit_ratio(cache_class):
+    """
+    Return the hit ratio for a set of frequently used keys, once their uses are interleaved with scans.
+    """
+    cache = cache_class(100)
+    hits = 0
+    next_scan_key = 1000
+
+    for round in range(30):
+        for key in range(50):
+            if cache.get(key) != -1:
+                hits += round >= 10
+            else:
+                cache.set(key, key)
+        if round < 5:
+            continue  # Establish the frequently used keys first.
+        for key in range(next_scan_key, next_scan_key + 100):
+            if cache.get(key) == -1:
+                cache.set(key, key)
+        next_scan_key += 100
+
+    return hits / (20 * 50)
+
+
+# Between two uses of a hot key, the scans push out everything in a plain LRU cache
+assert hot_key_hit_ratio(LeastRecentlyUsedCache) == 0
+assert hot_key_hit_ratio(AdaptiveReplacementCache) > 0.9
+assert hot_key_hit_ratio(WindowTinyLfuCache) > 0.9
+
+# ARC remembers evicted keys in its ghost lists, and adapts its target size
+cache = AdaptiveReplacementCache(2)
+cache.set('a', 1)
+cache.set('b', 2)
+cache.get('a')
+cache.set('c', 3)
+assert list(cache.t1) == ['c'] and list(cache.t2) == ['a'] and list(cache.b1) == ['b']
+
+cache.set('b', 2)
+assert cache.target == 1
+assert list(cache.t2) == ['b'] and list(cache.b2) == ['a']
+
+sketch = CountMinSketch(16, 1000)
+for _ in range(20):
+    sketch.increment('hot')
+sketch.increment('cold')
+assert sketch.estimate('hot') == CountMinSketch.MAX_COUNT
+assert 1 <= sketch.estimate('cold') <= 2
+sketch.reset()
+assert sketch.estimate('hot') == CountMinSketch.MAX_COUNT // 2
+
+trace = generate_scan_trace(100, 10, 5, 50)
+assert trace[:50] == generate_trace(100, 10)[:50]
+assert trace[50:55] == [10, 11, 12, 13, 14]
+assert len(trace) == 110
+
+results = compare(trace, 5, (LeastRecentlyUsedCache, AdaptiveReplacementCache, WindowTinyLfuCache))
+assert set(results) == {'LeastRecentlyUsedCache', 'AdaptiveReplacementCache', 'WindowTinyLfuCache'}
+
+# ------------------------------
+# Tests for bounded LRU caches
+# ------------------------------
+cache = BoundedLeastRecentlyUsedCache(10, max_weight=10, weigher=lambda key, value: len(value))
+cache.set('a', 'xxxx')
+cache.set('b', 'xxxx')
+assert cache.weight == 8
+
+# Adding a heavy item evicts least recently used items until it fits
+cache.get('a')
+cache.set('c', 'xxxxx')
+assert cache.get('b') == -1
+assert cache.get('a') == 'xxxx'
+assert cache.weight == 9
+
+# An item heavier than the whole budget is not cached, and replaces nothing else
+cache.set('d', 'x' * 11)
+assert cache.get('d') == -1
+assert cache.weight == 9
+
+# Replacing an item updates the weight
+cache.set('a', 'x')
+assert cache.weight == 6
+assert cache.get('a') == 'x'
+
+# The item count is still bounded
+cache = BoundedLeastRecentlyUsedCache(2, max_weight=100)
+cache.set('a', 1)
+cache.set('b', 2)
+cache.set('c', 3)
+assert cache.get('a') == -1
+assert cache.weight == 2
+
+now = [0.0]
+cache = BoundedLeastRecentlyUsedCache(10, ttl=10, clock=lambda: now[0])
+cache.set('a', 1)
+cache.set('b', 2, ttl=100)
+now[0] = 5.0
+assert cache.get('a') == 1
+assert cache.contains('a')
+
+# Expired items are removed when read
+now[0] = 10.0
+assert not cache.contains('a')
+assert cache.get('a') == -1
+assert 'a' not in cache.cache
+assert cache.get('b') == 2
+
+# Expired items are reclaimed incrementally by later writes, without being read
+for key in range(8):
+    cache.set(key, key, ttl=1)
+now[0] = 50.0
+cache.set('x', 0)
+assert len(cache.cache) == 10 - BoundedLeastRecentlyUsedCache.RECLAIM_BATCH
+cache.set('y', 0)
+assert sorted(map(str, cache.cache)) == ['b', 'x', 'y']
+
+# The expiry heap does not grow without bound when items are replaced
+for _ in range(100):
+    cache.set('b', 2, ttl=100)
+assert len(cache.expiries) <= 2 * len(cache.cache) + BoundedLeastRecentlyUsedCache.RECLAIM_BATCH + 1
+
+# ------------------------------
+# Tests for cache statistics
+# ------------------------------
+removed = []
+now = [0.0]
+cache = BoundedLeastRecentlyUsedCache(2, max_weight=10, weigher=lambda key, value: len(value), ttl=10,
+                                      clock=lambda: now[0], stats=CacheStats(),
+                                      listener=lambda key, value, cause: removed.append((key, value, cause)))
+cache.set('a', 'x')
+cache.set('b', 'xx')
+cache.set('a', 'xxx')
+assert cache.get('a') == 'xxx'
+assert cache.get('z') == -1
+
+# Every removal reaches the listener, with its cause
+cache.set('c', 'x')
+cache.set('d', 'x' * 11)
+now[0] = 20.0
+assert cache.get('a') == -1
+assert removed == [('a', 'x', 'replaced'), ('b', 'xx', 'evicted'), ('d', 'x' * 11, 'rejected'),
+                   ('a', 'xxx', 'expired')]
+
+snapshot = cache.snapshot()
+assert snapshot['size'] == 1 and snapshot['weight'] == 1
+assert (snapshot['hits'], snapshot['misses'], snapshot['hit_ratio']) == (1, 2, 1 / 3)
+assert (snapshot['inserts'], snapshot['updates'], snapshot['evictions']) == (3, 1, 1)
+assert snapshot['rejections'] == 1
+assert snapshot['removals'] == {'evicted': 1, 'expired': 1, 'replaced': 1, 'rejected': 1}
+assert sum(snapshot['get_latency'].values()) == 3
+assert sum(snapshot['set_latency'].values()) == 5
+
+# A rejected replacement removes the old value, and is counted as a rejection rather than an update
+cache.set('c', 'x')
+cache.set('c', 'x' * 11)
+assert cache.get('c', MISSING) is MISSING
+snapshot = cache.snapshot()
+assert (snapshot['inserts'], snapshot['updates'], snapshot['rejections']) == (4, 1, 2)
+assert removed[-2:] == [('c', 'x', 'replaced'), ('c', 'x' * 11, 'rejected')]
+
+# Latency histograms can be disabled, leaving only the counters
+cache = BoundedLeastRecentlyUsedCache(2, stats=CacheStats(latency=False))
+cache.set('a', 1)
+cache.get('a')
+assert cache.snapshot()['hits'] == 1
+assert sum(cache.snapshot()['get_latency'].values()) == 0
+
+# Without stats, a snapshot only reports the size and weight
+assert BoundedLeastRecentlyUsedCache(2).snapshot() == {'size': 0, 'weight': 0}
+
+# Every cache records the same stats, and reports its removals
+for cache_class in (LeastRecentlyUsedCache, AdaptiveReplacementCache, WindowTinyLfuCache,
+                    ConcurrentLeastRecentlyUsedCache, AsyncLeastRecentlyUsedCache):
+    removed = []
+    stats = True if cache_class is ConcurrentLeastRecentlyUsedCache else CacheStats()
+    cache = cache_class(2, stats=stats, listener=lambda key, value, cause: removed.append((key, value, cause)))
+    cache.set('a', 1)
+    cache.set('a', 2)
+    assert cache.get('a') == 2
+    assert cache.get('z') == -1
+    for key in range(10):
+        cache.set(key, key)
+
+    snapshot = cache.snapshot()
+    assert snapshot['size'] == 2
+    assert (snapshot['hits'], snapshot['misses'], snapshot['inserts'], snapshot['updates']) == (1, 1, 11, 1)
+    assert snapshot['evictions'] == 11 - 2 == sum(cause == 'evicted' for _, _, cause in removed)
+    assert removed[0] == ('a', 1, 'replaced')
+    assert sum(snapshot['get_latency'].values()) == 2
+
+# Bulk operations are recorded too
+cache = LeastRecentlyUsedCache(2, stats=CacheStats(latency=False))
+cache.set_many({'a': 1, 'b': 2, 'c': 3})
+assert cache.get_many('abc') == {'b': 2, 'c': 3}
+snapshot = cache.snapshot()
+assert (snapshot['hits'], snapshot['misses'], snapshot['inserts'], snapshot['evictions']) == (2, 1, 3, 1)
+
+assert LeastRecentlyUsedCache(2).snapshot() == {'size': 0}
+
+# ------------------------------
+# Tests for memoization and bulk operations
+# ------------------------------
+cache = LeastRecentlyUsedCache(3)
+
+# A cached -1 can be told apart from a missing key
+cache.set('a', -1)
+assert cache.get('a', MISSING) == -1
+assert cache.get('z', MISSING) is MISSING
+assert cache.get('z') == -1
+assert cache['a'] == -1
+try:
+    cache['z']
+    assert False, 'Indexing a missing key should raise a KeyError'
+except KeyError:
+    assert True
+
+# Bulk operations leave out missing keys, and keep the LRU order
+cache.set_many({'b': 2, 'c': 3})
+assert cache.get_many(['c', 'z', 'a']) == {'c': 3, 'a': -1}
+cache.set_many([('d', 4)])
+assert list(cache.cache) == ['c', 'a', 'd']
+
+now = [0.0]
+cache = BoundedLeastRecentlyUsedCache(3, ttl=10, clock=lambda: now[0])
+cache.set_many({'a': 1, 'b': 2})
+cache.set_many({'c': 3}, ttl=100)
+now[0] = 50.0
+assert cache.get_many('abc') == {'c': 3}
+try:
+    cache['a']
+    assert False, 'Indexing an expired key should raise a KeyError'
+except KeyError:
+    assert True
+
+cache = ConcurrentLeastRecentlyUsedCache(100, shards=4)
+cache.set_many((key, key * 2) for key in range(50))
+assert cache.get_many(range(40, 60)) == {key: key * 2 for key in range(40, 50)}
+assert cache.get(60, MISSING) is MISSING
+
+calls = []
+
+
+@lru_memoize(capacity=2)
+def square(number, offset=0):
+    calls.append(number)
+    return number * number + offset
+
+
+assert square(3) == 9
+assert square(3) == 9
+assert calls == [3]
+
+# Keyword arguments, and positional arguments of the same value, are cached separately
+assert square(3, offset=1) == 10
+assert square(3, 1) == 10
+assert calls == [3, 3, 3]
+assert square.cache.capacity == 2
+assert square.__name__ == 'square'
+
+# Arguments of different types are only cached separately when typed
+assert make_key((1, 2), {}) == make_key((1.0, 2), {})
+assert make_key((1, 2), {}, typed=True) != make_key((1.0, 2), {}, typed=True)
+assert make_key(((1, 2),), {}) != make_key((1, 2), {})
+
+# Results can share a given cache, under custom keys
+shared = BoundedLeastRecentlyUsedCache(10)
+
+
+@lru_memoize(cache=shared, key=lambda path, **options: path.lower())
+def load(path, **options):
+    calls.append(path)
+    return -1
+
+
+assert load('A') == -1
+assert load('a', mode='r') == -1
+assert calls[-1] == 'A' and calls.count('a') == 0
+assert shared.get('a', MISSING) == -1
+
+
+# Functions sharing a cache under the default key keep their results apart
+@lru_memoize(cache=shared)
+def double(number):
+    return number * 2
+
+
+@lru_memoize(cache=shared)
+def triple(number):
+    return number * 3
+
+
+assert (double(5), triple(5), double(5)) == (10, 15, 10)
+assert shared.get((double.__wrapped__, 5)) == 10
+
+# ------------------------------
+# Tests for shared memory LRU caches
+# ------------------------------
+cache = SharedLeastRecentlyUsedCache(2, key_size=8, value_size=16)
+cache.set(b'a', b'1')
+cache.set(b'b', b'2')
+assert cache.get(b'a') == b'1'
+assert cache.is_full()
+
+# Adding an item to a full cache removes the least recently used item (b'b'), and reuses its slot
+cache.set(b'c', b'3')
+assert cache.get(b'b') == -1
+assert not cache.contains(b'b')
+assert cache.get(b'c') == b'3'
+
+# Updating an existing key in a full cache does not evict another item
+cache.set(b'a', b'longer value')
+assert cache.get(b'a') == b'longer value'
+assert cache.get(b'c') == b'3'
+
+# Keys and values must fit their slots
+for key, value in ((b'x' * 9, b''), (b'x', b'x' * 17)):
+    try:
+        cache.set(key, value)
+        assert False, 'A key or value too long for its slot should raise a ValueError'
+    except ValueError:
+        assert True
+
+# Another handle on the same shared memory sees the same items
+other = SharedLeastRecentlyUsedCache.attach(cache.name, cache.lock)
+assert other.get(b'c') == b'3'
+other.set(b'd', b'4')
+assert cache.get(b'd') == b'4'
+other.close()
+cache.close()
+cache.unlink()
+
+# Evictions keep every key reachable in the hash table, including those that collided with the evicted keys
+cache = SharedLeastRecentlyUsedCache(50, key_size=4, value_size=4)
+keys = [str(number).encode() for number in range(500)]
+for key in keys:
+    cache.set(key, key)
+assert [cache.get(key) for key in keys[450:]] == keys[450:]
+assert not any(cache.contains(key) for key in keys[:450])
+cache.close()
+cache.unlink()
+
+
+def fill_shared_cache(cache, worker):
+    for number in range(10):
+        cache.set('{}-{}'.format(worker, number).encode(), bytes([worker, number]))
+
+
+# Forked worker processes share one cache
+if 'fork' in multiprocessing.get_all_start_methods():
+    cache = SharedLeastRecentlyUsedCache(100, key_size=8, value_size=2)
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=fill_shared_cache, args=(cache, worker)) for worker in range(4)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+    assert cache.get(b'3-9') == bytes([3, 9])
+    assert cache.header[SharedLeastRecentlyUsedCache.COUNT] == 40
+    cache.close()
+    cache.unlink()
+
+# ------------------------------
+# Tests for concurrent LRU caches
+# ------------------------------
+cache = ConcurrentLeastRecentlyUsedCache(10, shards=4)
+assert sum(shard.capacity for shard in cache.shards) == 10
+assert len(ConcurrentLeastRecentlyUsedCache(2, shards=4).shards) == 2
+
+cache.set('a', 1)
+assert cache.get('a') == 1
+assert cache.contains('a')
+assert cache.get('z') == -1
+
+
+def run_concurrently(count, function):
+    """Call the function from several threads at once, and return the results"""
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def run(index):
+        barrier.wait()
+        try:
+            results[index] = function()
+        except Exception as error:
+            results[index] = error
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+load_count = []
+
+
+def slow_loader(key):
+    load_count.append(key)
+    time.sleep(0.05)
+    return key.upper()
+
+
+# Simultaneous misses for the same key are loaded once
+assert run_concurrently(8, lambda: cache.get_or_load('b', slow_loader)) == ['B'] * 8
+assert load_count == ['b']
+assert cache.get_or_load('b', slow_loader) == 'B'
+assert load_count == ['b']
+
+
+def failing_loader(key):
+    time.sleep(0.05)
+    raise KeyError(key)
+
+
+# A failed load reaches every waiter, and is not cached
+assert all(isinstance(result, KeyError) for result in run_concurrently(4, lambda: cache.get_or_load('c', failing_loader)))
+assert not cache.contains('c')
+assert cache.loading == [dict() for _ in range(4)]
+
+# A concurrent cache combines the stats of its shards
+cache = ConcurrentLeastRecentlyUsedCache(100, shards=4, stats=True, latency=False)
+run_concurrently(4, lambda: [cache.get_or_load(key, str) for key in range(50)])
+assert all(shard.stats.hits + shard.stats.misses > 0 for shard in cache.shards)
+assert (cache.stats.hits + cache.stats.misses, cache.stats.inserts) == (200, cache.snapshot()['size'])
+assert not any(cache.stats.get_latency)
+assert ConcurrentLeastRecentlyUsedCache(100).stats is None
+
+# A CacheStats instance would never be updated, so it is refused
+try:
+    ConcurrentLeastRecentlyUsedCache(100, stats=CacheStats())
+    assert False, 'A concurrent cache should refuse a CacheStats instance'
+except TypeError:
+    assert True
+
+
+async def test_async_cache():
+    cache = AsyncLeastRecentlyUsedCache(3)
+    loads = []
+
+    async def loader(key):
+        loads.append(key)
+        await asyncio.sleep(0.01)
+        return key * 2
+
+    assert await asyncio.gather(*[cache.get_or_load('a', loader) for _ in range(10)]) == ['aa'] * 10
+    assert loads == ['a']
+    assert cache.get('a') == 'aa'
+
+    async def failing(key):
+        await asyncio.sleep(0.01)
+        raise KeyError(key)
+
+    results = await asyncio.gather(*[cache.get_or_load('b', failing) for _ in range(3)], return_exceptions=True)
+    assert all(isinstance(result, KeyError) for result in results)
+    assert not cache.contains('b')
+    assert cache.loading == {}
+
+    # Cancelling the loading task does not cancel the tasks waiting for it; one of them loads the value again
+    loader_task = asyncio.create_task(cache.get_or_load('c', loader))
+    await asyncio.sleep(0)
+    waiters = [asyncio.create_task(cache.get_or_load('c', loader)) for _ in range(3)]
+    await asyncio.sleep(0)
+    loader_task.cancel()
+    assert await asyncio.gather(*waiters) == ['cc'] * 3
+    assert loader_task.cancelled()
+    assert loads == ['a', 'c', 'c']
+    assert cache.loading == {}
+
+
+asyncio.run(test_async_cache())
+
+if __name__ == "__main__":
+    length = int(sys.argv[1]) if len(sys.argv) > 1 else 10000000
+
+    print_results('Skewed trace', compare(generate_trace(length, 1000000), 100000, (
+        StackedLeastRecentlyUsedCache, LeastRecentlyUsedCache)))
+
+    print_results('Skewed trace with scans', compare(generate_scan_trace(length, 1000000, 50000, 200000), 100000, (
+        LeastRecentlyUsedCache, AdaptiveReplacementCache, WindowTinyLfuCache)))
@@ -1,7 +1,146 @@
+from concurrent.futures import ThreadPoolExecutor
+import fnmatch
+import json
 import os
+import queue
+import re
+import shutil
+import sys
+import tempfile
+import time
 
 
-def find_files(suffix, path):
+class FileFilter(object):
+    """
+    Criteria for a file search, beyond the file name suffix, compiled once before the search.
+
+    Criteria are checked from cheapest to dearest: name patterns first, then the regular expression, and the file's
+    size and modification time (which need a stat call) last. Excluded directories, and directories beyond max_depth,
+    are never listed.
+    """
+
+    def __init__(self, patterns=(), regex=None, min_size=None, max_size=None, modified_after=None,
+                 modified_before=None, exclude=(), max_depth=None, follow_symlinks=True):
+        """
+        Args:
+          patterns(iterable): glob patterns, at least one of which a file name must match, e.g. 'test_*.py'
+          regex(str): a regular expression which must be found in a file's path
+          min_size(int): the minimum size of a file, in bytes
+          max_size(int): the maximum size of a file, in bytes
+          modified_after(float): the earliest modification time of a file, as a timestamp
+          modified_before(float): the latest modification time of a file, as a timestamp
+          exclude(iterable): glob patterns of directory names not to descend into, e.g. '.git' or 'node_modules'
+          max_depth(int): the number of levels of subdirectories to descend into, or None for no limit
+          follow_symlinks(bool): whether to follow symbolic links to files and directories
+        """
+
+        self.pattern = self._compile_globs(patterns)
+        self.regex = None if regex is None else re.compile(regex)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.modified_after = modified_after
+        self.modified_before = modified_before
+        self.exclude = self._compile_globs(exclude)
+        self.max_depth = float('inf') if max_depth is None else max_depth
+        self.follow_symlinks = follow_symlinks
+
+        self.needs_stat = any(criterion is not None for criterion in (min_size, max_size, modified_after,
+                                                                      modified_before))
+        self.filters_files = self.pattern is not None or self.regex is not None or self.needs_stat
+
+    @staticmethod
+    def _compile_globs(patterns):
+        """Compile glob patterns into a single regular expression, or None if there are none"""
+        patterns = list(patterns)
+        return re.compile('|'.join(map(fnmatch.translate, patterns))) if patterns else None
+
+    def matches(self, entry):
+        """Return a boolean indicating whether a file (an os.DirEntry) meets the criteria"""
+        if self.pattern is not None and self.pattern.match(entry.name) is None:
+            return False
+        if self.regex is not None and self.regex.search(entry.path) is None:
+            return False
+        if not self.needs_stat:
+            return True
+
+        try:
+            stat = entry.stat(follow_symlinks=self.follow_symlinks)
+        except OSError:
+            return False  # The file was removed, or became unreadable, during the search.
+        return not ((self.min_size is not None and stat.st_size < self.min_size) or
+                    (self.max_size is not None and stat.st_size > self.max_size) or
+                    (self.modified_after is not None and stat.st_mtime < self.modified_after) or
+                    (self.modified_before is not None and stat.st_mtime > self.modified_before))
+
+
+# Finds every file with the suffix.
+NO_FILTER = FileFilter()
+
+
+def iter_files(suffix, path, file_filter=NO_FILTER):
+    """
+    Find all files beneath path with file name suffix, yielding each one as it is found.
+
+    Directories are listed with os.scandir, whose entries carry their file type, so most files need no further stat
+    call. Directories waiting to be listed are kept on a stack rather than the call stack, so there is no limit to the
+    depth of the tree. Directories which cannot be listed are skipped.
+
+    When following symbolic links, each directory's device and inode are recorded before it is listed, so a directory
+    reached twice (e.g. through a link to one of its ancestors) is only searched once. This costs a stat call per
+    directory (not per file): an entry's own inode number is not enough, as it is the inode beneath a mount point,
+    rather than that of the mounted directory, and the device is unknown without a stat.
+
+    Args:
+      suffix(str or tuple): suffix if the file name to be found, or a tuple of suffixes, any of which may match
+      path(str): path of the file system
+      file_filter(FileFilter): further criteria for the files, and the directories to search
+
+    Yields:
+       paths
+    """
+
+    if not os.path.isdir(path):
+        return
+
+    follow_symlinks = file_filter.follow_symlinks
+    max_depth = file_filter.max_depth
+    exclude = file_filter.exclude
+    matches = file_filter.matches if file_filter.filters_files else None
+    visited = set()
+
+    if follow_symlinks:
+        stat = os.stat(path)
+        visited.add((stat.st_dev, stat.st_ino))
+
+    directories = [(path, 0)]
+
+    while directories:
+        directory, depth = directories.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError:
+            continue
+
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=follow_symlinks):
+                    if depth >= max_depth or (exclude is not None and exclude.match(entry.name) is not None):
+                        continue
+                    if follow_symlinks:
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        if (stat.st_dev, stat.st_ino) in visited:
+                            continue
+                        visited.add((stat.st_dev, stat.st_ino))
+                    directories.append((entry.path, depth + 1))
+                elif entry.name.endswith(suffix) and entry.is_file(follow_symlinks=follow_symlinks) and \
+                        (matches is None or matches(entry)):
+                    yield entry.path
+
+
+def find_files(suffix, path, file_filter=NO_FILTER):
     """
     Find all files beneath path with file name suffix.
 
@@ -11,13 +150,24 @@ def find_files(suffix, path):
     There are no limit to the depth of the subdirectories can be.
 
     Args:
-      suffix(str): suffix if the file name to be found
+      suffix(str or tuple): suffix if the file name to be found, or a tuple of suffixes, any of which may match
       path(str): path of the file system
+      file_filter(FileFilter): further criteria for the files, and the directories to search
 
     Returns:
        a list of paths
     """
 
+    return list(iter_files(suffix, path, file_filter))
+
+
+def find_files_listdir(suffix, path):
+    """
+    The original, recursive search, which lists directories with os.listdir and checks each item's type separately.
+
+    Kept as a baseline for benchmarks.
+    """
+
     path_list = []
 
     if not os.path.isdir(path):
@@ -27,7 +177,7 @@ def find_files(suffix, path):
         full_path = os.path.join(path, item)
 
         if os.path.isdir(full_path):
-            path_list.extend(find_files(suffix, full_path))
+            path_list.extend(find_files_listdir(suffix, full_path))
             continue
 
         if os.path.isfile(full_path) and full_path.endswith(suffix):
@@ -36,12 +186,354 @@ def find_files(suffix, path):
     return path_list
 
 
+def list_directory(suffix, path):
+    """
+    List a single directory.
+
+    Args:
+      suffix(str): suffix if the file name to be found
+      path(str): path of the directory
+
+    Returns:
+       a list of the matching files, and a list of the subdirectories. Both are empty if the directory cannot be listed.
+    """
+
+    files = []
+    directories = []
+
+    try:
+        entries = os.scandir(path)
+    except OSError:
+        return files, directories
+
+    with entries:
+        for entry in entries:
+            if entry.is_dir():
+                directories.append(entry.path)
+            elif entry.name.endswith(suffix) and entry.is_file():
+                files.append(entry.path)
+
+    return files, directories
+
+
+def iter_files_parallel(suffix, path, max_workers=8):
+    """
+    Find all files beneath path with file name suffix, listing up to max_workers directories at once.
+
+    Each directory listing is a task for a thread pool, which puts its result on a queue when it completes. As each
+    result is taken from the queue, its subdirectories are submitted as further tasks, and its matching files are
+    yielded. This hides the latency of each listing on slow (e.g. network) file systems. Files are yielded in no
+    particular order.
+
+    Args:
+      suffix(str): suffix if the file name to be found
+      path(str): path of the file system
+      max_workers(int): the number of threads
+
+    Yields:
+       paths
+    """
+
+    if not os.path.isdir(path):
+        return
+
+    # Completed listings, in the order they complete.
+    completed = queue.SimpleQueue()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        executor.submit(list_directory, suffix, path).add_done_callback(completed.put)
+        outstanding = 1
+
+        while outstanding:
+            files, directories = completed.get().result()
+            outstanding -= 1
+
+            for directory in directories:
+                executor.submit(list_directory, suffix, directory).add_done_callback(completed.put)
+            outstanding += len(directories)
+
+            yield from files
+
+
+def find_files_parallel(suffix, path, max_workers=8, sort=False):
+    """
+    Find all files beneath path with file name suffix, listing up to max_workers directories at once.
+
+    Args:
+      suffix(str): suffix if the file name to be found
+      path(str): path of the file system
+      max_workers(int): the number of threads
+      sort(bool): whether to sort the paths, so the result is deterministic
+
+    Returns:
+       a list of paths
+    """
+
+    path_list = list(iter_files_parallel(suffix, path, max_workers))
+
+    if sort:
+        path_list.sort()
+
+    return path_list
+
+
+def generate_tree(root, depth, width, files):
+    """
+    Generate a tree of empty files for benchmarks.
+
+    Args:
+      root(str): path of the directory to generate the tree in
+      depth(int): the number of levels of subdirectories
+      width(int): the number of subdirectories of each directory
+      files(int): the number of files in each directory, alternately named '.c' and '.h'
+
+    Returns:
+       the number of files generated
+    """
+
+    generated = 0
+    directories = [(root, 0)]
+
+    while directories:
+        directory, level = directories.pop()
+        for number in range(files):
+            open(os.path.join(directory, 'f{}.{}'.format(number, 'ch'[number % 2])), 'w').close()
+        generated += files
+
+        if level < depth:
+            for number in range(width):
+                subdirectory = os.path.join(directory, 'd{}'.format(number))
+                os.mkdir(subdirectory)
+                directories.append((subdirectory, level + 1))
+
+    return generated
+
+
+def benchmark(suffix, path, functions):
+    """
+    Time each of the given search functions over the same tree.
+
+    Args:
+      suffix(str): suffix if the file name to be found
+      path(str): path of the file system
+      functions(dict): search functions, by name
+
+    Returns:
+       a dict of the time taken by each function, in seconds, by name
+    """
+
+    results = {}
+    expected = None
+
+    for name, function in functions.items():
+        start = time.perf_counter()
+        result = function(suffix, path)
+        results[name] = time.perf_counter() - start
+
+        if expected is None:
+            expected = sorted(result)
+        assert sorted(result) == expected, name
+
+    return results
+
+
+def extension(name):
+    """
+    Return the extension of a file name: everything from its last '.', or '' if it has none.
+
+    Args:
+      name(str): the file name
+
+    Returns:
+       the extension
+    """
+
+    dot = name.rfind('.')
+    return '' if dot == -1 else name[dot:]
+
+
+class FileIndex(object):
+    """
+    A persistent index of the files beneath a path, for repeated suffix queries.
+
+    The index records each directory's modification time, files, and subdirectories. A refresh stats every indexed
+    directory, but only lists those whose modification time has changed, since a directory's modification time changes
+    whenever an entry is added to, removed from, or renamed within it. Files are also indexed by extension, so a query
+    for an extension (e.g. '.c') only examines the files which have it.
+    """
+
+    VERSION = 1
+
+    # A directory modified this recently (in nanoseconds) when it was listed may be modified again within the same
+    # timestamp tick, so it is listed again by the next refresh.
+    RACY_WINDOW = 2 * 10 ** 9
+
+    def __init__(self, path, index_path=None):
+        """
+        Args:
+          path(str): path of the file system
+          index_path(str): path of the file to persist the index to, if any. An existing index is loaded from it.
+        """
+
+        self.path = path
+        self.index_path = index_path
+
+        # Modification time (or None, to be listed again), files, and subdirectories, by directory
+        self.directories = {}
+        # Paths of the files, by extension
+        self.extensions = {}
+
+        if index_path is not None and os.path.exists(index_path):
+            self.load()
+
+    def _add_files(self, directory, names):
+        """Add the given files in a directory to the extension index"""
+        for name in names:
+            self.extensions.setdefault(extension(name), set()).add(os.path.join(directory, name))
+
+    def _remove_files(self, directory, names):
+        """Remove the given files in a directory from the extension index"""
+        for name in names:
+            paths = self.extensions[extension(name)]
+            paths.discard(os.path.join(directory, name))
+            if not paths:
+                del self.extensions[extension(name)]
+
+    def _forget(self, directory):
+        """Remove a directory, and everything beneath it, from the index"""
+        directories = [directory]
+        while directories:
+            directory = directories.pop()
+            record = self.directories.pop(directory, None)
+            if record is not None:
+                self._remove_files(directory, record[1])
+                directories.extend(os.path.join(directory, name) for name in record[2])
+
+    def _list(self, directory, mtime):
+        """List a directory, and replace its record in the index"""
+        files = []
+        subdirectories = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subdirectories.append(entry.name)
+                elif entry.is_file():
+                    files.append(entry.name)
+
+        old = self.directories.get(directory)
+        if old is not None:
+            self._remove_files(directory, old[1])
+            for name in set(old[2]).difference(subdirectories):
+                self._forget(os.path.join(directory, name))
+
+        if time.time_ns() - mtime < self.RACY_WINDOW:
+            mtime = None
+        self.directories[directory] = (mtime, files, subdirectories)
+        self._add_files(directory, files)
+
+    def refresh(self):
+        """
+        Bring the index up to date with the file system.
+
+        Returns:
+           the number of directories listed
+        """
+
+        listed = 0
+
+        if not os.path.isdir(self.path):
+            self._forget(self.path)
+            return listed
+
+        directories = [self.path]
+        while directories:
+            directory = directories.pop()
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+                record = self.directories.get(directory)
+                if record is None or record[0] != mtime:
+                    self._list(directory, mtime)
+                    listed += 1
+            except OSError:
+                self._forget(directory)
+                continue
+
+            directories.extend(os.path.join(directory, name) for name in self.directories[directory][2])
+
+        return listed
+
+    def find(self, suffix):
+        """
+        Find all indexed files with file name suffix.
+
+        Args:
+          suffix(str): suffix if the file name to be found
+
+        Returns:
+           a list of paths
+        """
+
+        if suffix.startswith('.') and suffix.count('.') == 1:
+            # A file name ends with such a suffix if, and only if, it is the file's extension.
+            return list(self.extensions.get(suffix, ()))
+
+        return [path for paths in self.extensions.values() for path in paths if path.endswith(suffix)]
+
+    def save(self):
+        """Persist the index to its index_path, replacing the previous version atomically"""
+        if self.index_path is None:
+            raise ValueError('FileIndex of {!r} has no index_path to save to'.format(self.path))
+
+        temporary_path = self.index_path + '.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump({'version': self.VERSION, 'path': self.path, 'directories': self.directories}, file)
+        os.replace(temporary_path, self.index_path)
+
+    def load(self):
+        """Load the index from its index_path. An index of another version, or of another path, is discarded."""
+        if self.index_path is None:
+            raise ValueError('FileIndex of {!r} has no index_path to load from'.format(self.path))
+
+        with open(self.index_path) as file:
+            saved = json.load(file)
+
+        if saved.get('version') != self.VERSION or saved.get('path') != self.path:
+            return
+
+        self.directories = {directory: tuple(record) for directory, record in saved['directories'].items()}
+        self.extensions = {}
+        for directory, (_, files, _) in self.directories.items():
+            self._add_files(directory, files)
+
+
+def find_files_indexed(suffix, path, index_path):
+    """
+    Find all files beneath path with file name suffix, using (and updating) a persistent index.
+
+    Args:
+      suffix(str): suffix if the file name to be found
+      path(str): path of the file system
+      index_path(str): path of the index file
+
+    Returns:
+       a list of paths
+    """
+
+    index = FileIndex(path, index_path)
+    if index.refresh():
+        index.save()
+
+    return index.find(suffix)
+
+
 def run_test(suffix, path, expected):
     result = find_files(suffix, path)
     result.sort()
     expected.sort()
 
     assert expected == result
+    assert sorted(find_files_listdir(suffix, path)) == result
+    assert find_files_parallel(suffix, path, max_workers=2, sort=True) == result
 
 
 run_test('.c', './testdir/subdir1', ['./testdir/subdir1/a.c'])
@@ -62,3 +554,184 @@ run_test('.c', './testdir', [
 ])
 
 run_test('', './nope', [])      # Invalid path returns an empty array
+
+# Results are yielded as they are found, before the rest of the tree is searched
+files = iter_files('.c', './testdir')
+assert next(files).endswith('.c')
+assert len(list(files)) == 3
+
+# A tree deeper than the recursion limit (which is also too deep for shutil.rmtree, so is removed by hand)
+root = deepest = tempfile.mkdtemp()
+for _ in range(1200):
+    deepest = os.path.join(deepest, 'd')
+    os.mkdir(deepest)
+open(os.path.join(deepest, 'deep.c'), 'w').close()
+
+assert find_files('.c', root) == [os.path.join(deepest, 'deep.c')]
+
+os.remove(os.path.join(deepest, 'deep.c'))
+while deepest != root:
+    os.rmdir(deepest)
+    deepest = os.path.dirname(deepest)
+os.rmdir(root)
+
+# Several suffixes at once
+assert sorted(find_files(('.c', '.gitkeep'), './testdir/subdir2')) == ['./testdir/subdir2/.gitkeep']
+assert len(find_files(('.c', '.h'), './testdir')) == 8
+
+# Glob patterns are matched against file names, and regular expressions searched for in paths
+assert sorted(find_files('', './testdir', FileFilter(patterns=['t*.c', 'b.*']))) == [
+    './testdir/subdir3/subsubdir1/b.c',
+    './testdir/subdir3/subsubdir1/b.h',
+    './testdir/t1.c'
+]
+assert find_files('.h', './testdir', FileFilter(regex=r'subdir[15]/a')) != []
+assert all('subdir1' in path or 'subdir5' in path
+           for path in find_files('.h', './testdir', FileFilter(regex=r'subdir[15]/a')))
+
+# Excluded directories, and directories beyond max_depth, are not searched
+assert sorted(find_files('.c', './testdir', FileFilter(exclude=['subdir[13]']))) == [
+    './testdir/subdir5/a.c',
+    './testdir/t1.c'
+]
+assert find_files('.c', './testdir', FileFilter(max_depth=0)) == ['./testdir/t1.c']
+assert len(find_files('.c', './testdir', FileFilter(max_depth=1))) == 3
+
+root = tempfile.mkdtemp()
+with open(os.path.join(root, 'small.c'), 'w') as file:
+    file.write('x')
+with open(os.path.join(root, 'large.c'), 'w') as file:
+    file.write('x' * 100)
+os.utime(os.path.join(root, 'small.c'), (0, 1000))
+
+# Size and modification time filters
+assert find_files('.c', root, FileFilter(min_size=10)) == [os.path.join(root, 'large.c')]
+assert find_files('.c', root, FileFilter(max_size=10)) == [os.path.join(root, 'small.c')]
+assert find_files('.c', root, FileFilter(modified_after=2000)) == [os.path.join(root, 'large.c')]
+assert find_files('.c', root, FileFilter(modified_before=2000)) == [os.path.join(root, 'small.c')]
+
+# A symbolic link to an ancestor directory is not followed round in a loop
+if hasattr(os, 'symlink'):
+    os.mkdir(os.path.join(root, 'sub'))
+    os.symlink(root, os.path.join(root, 'sub', 'loop'))
+    assert sorted(find_files('.c', root)) == [os.path.join(root, 'large.c'), os.path.join(root, 'small.c')]
+    assert len(find_files('.c', os.path.join(root, 'sub'))) == 2
+    assert find_files('.c', os.path.join(root, 'sub'), FileFilter(follow_symlinks=False)) == []
+
+    # Two routes to the same directory are searched once
+    open(os.path.join(root, 'sub', 'inner.c'), 'w').close()
+    os.symlink(os.path.join(root, 'sub'), os.path.join(root, 'again'))
+    assert len(find_files('.c', root)) == 3
+
+# Directories either side of a mount point are told apart, even when their inode numbers coincide (e.g. / and
+# /sys/fs). Without following links, no identities are recorded, so both searches should find the same files.
+if os.path.ismount('/sys') and os.path.isdir('/sys/fs'):
+    skip = [name for name in os.listdir('/') if name != 'sys'] + [name for name in os.listdir('/sys') if name != 'fs']
+    followed = FileFilter(exclude=skip, max_depth=6)
+    unfollowed = FileFilter(exclude=skip, max_depth=6, follow_symlinks=False)
+    assert sorted(find_files('', '/', followed)) == sorted(find_files('', '/', unfollowed))
+
+# A file removed during the search does not match, rather than ending the search
+with os.scandir(root) as entries:
+    entry = next(entry for entry in entries if entry.name == 'small.c')
+os.remove(entry.path)
+assert not FileFilter(min_size=0).matches(entry)
+shutil.rmtree(root)
+
+# A generated tree gives the same results, serially and in parallel
+root = tempfile.mkdtemp()
+assert generate_tree(root, depth=3, width=3, files=4) == 4 * (1 + 3 + 9 + 27)
+assert find_files_parallel('.c', root, max_workers=4, sort=True) == sorted(find_files('.c', root))
+assert len(find_files('.c', root)) == 80
+
+# The benchmark checks that every function finds the same files
+assert sorted(benchmark('.h', root, {'serial': find_files, 'parallel': find_files_parallel})) == ['parallel', 'serial']
+shutil.rmtree(root)
+
+# An index answers queries from memory, and refreshes by listing only the directories which have changed
+root = tempfile.mkdtemp()
+generate_tree(root, depth=2, width=3, files=4)
+index_directory = tempfile.mkdtemp()
+index_path = os.path.join(index_directory, 'index.json')
+index = FileIndex(root, index_path)
+assert index.refresh() == 13
+for suffix in ('.c', '0.c', '', '.x'):
+    assert sorted(index.find(suffix)) == sorted(find_files(suffix, root))
+
+
+def age(directory):
+    """Set the modification time of a directory outside FileIndex.RACY_WINDOW"""
+    os.utime(directory, ns=(0, time.time_ns() - 10 * FileIndex.RACY_WINDOW))
+
+
+for directory, _ in index.directories.items():
+    age(directory)
+index.refresh()
+assert index.refresh() == 0
+
+open(os.path.join(root, 'd1', 'new.c'), 'w').close()
+age(os.path.join(root, 'd1'))
+assert index.refresh() == 1
+assert os.path.join(root, 'd1', 'new.c') in index.find('.c')
+
+# Removed directories, and everything beneath them, are dropped from the index
+shutil.rmtree(os.path.join(root, 'd2'))
+age(root)
+assert index.refresh() == 1
+assert not any(directory.startswith(os.path.join(root, 'd2')) for directory in index.directories)
+assert sorted(index.find('.c')) == sorted(find_files('.c', root))
+
+# A saved index is loaded again, without listing anything
+index.save()
+assert FileIndex(root, index_path).refresh() == 0
+assert sorted(find_files_indexed('.h', root, index_path)) == sorted(find_files('.h', root))
+
+# An index without an index_path cannot be saved
+try:
+    FileIndex(root).save()
+    assert False, 'An index without an index_path should not be saved'
+except ValueError:
+    assert True
+
+# Recently modified directories are listed again by the next refresh, in case they change within the same tick
+open(os.path.join(root, 'd0', 'newer.c'), 'w').close()
+assert index.refresh() == 1
+assert index.refresh() == 1
+shutil.rmtree(root)
+shutil.rmtree(index_directory)
+
+if __name__ == "__main__":
+    depth, width, files = (int(argument) for argument in sys.argv[1:4]) if len(sys.argv) > 3 else (4, 8, 20)
+
+    root = tempfile.mkdtemp()
+    try:
+        print('Generated {} files'.format(generate_tree(root, depth, width, files)))
+        results = benchmark('.c', root, {
+            'find_files_listdir': find_files_listdir,
+            'find_files': find_files,
+            'find_files_parallel': find_files_parallel,
+            'find_files_parallel (sorted)': lambda suffix, path: find_files_parallel(suffix, path, sort=True),
+        })
+
+        # The index is timed separately, since refreshing it returns no paths.
+        index = FileIndex(root)
+        start = time.perf_counter()
+        index.refresh()
+        results['FileIndex.refresh (new)'] = time.perf_counter() - start
+
+        # The tree was only just generated, so every directory is within RACY_WINDOW, and would be listed again. Age
+        # them, and record their new modification times, so that the next refresh sees an unchanged tree.
+        for directory in index.directories:
+            age(directory)
+        index.refresh()
+
+        for name, operation in (('FileIndex.refresh (unchanged)', index.refresh),
+                                ('FileIndex.find', lambda: index.find('.c'))):
+            start = time.perf_counter()
+            operation()
+            results[name] = time.perf_counter() - start
+
+        for name, seconds in results.items():
+            print('{:<30} {:>8.3f}s'.format(name, seconds))
+    finally:
+        shutil.rmtree(root)
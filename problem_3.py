@@ -1,4 +1,9 @@
-from collections import deque
+from array import array
+from bisect import bisect_left
+from collections import Counter, deque
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import io
 import sys
 
 
@@ -9,26 +14,127 @@ class Node(object):
         self.left_child = None
         self.right_child = None
 
+    def is_leaf(self):
+        """Return a boolean indicating whether the Node is a leaf"""
+        return self.left_child is None and self.right_child is None
+
+
+class BitWriter(object):
+    def __init__(self):
+        self.pending = ''
+        self.bit_length = 0
+
+    def write(self, bits):
+        """
+        Append a string of '0' / '1' characters to the output.
+
+        :param bits: A string of binary digits.
+        :return: The bytes completed by this write. Incomplete bytes are held back.
+        """
+        bits = self.pending + bits
+        self.bit_length += len(bits) - len(self.pending)
+        whole = len(bits) - len(bits) % 8
+        self.pending = bits[whole:]
+
+        if not whole:
+            return b''
+        return int(bits[:whole], 2).to_bytes(whole // 8, 'big')
+
+    def flush(self):
+        """
+        Pad any incomplete byte with zeros, and return it.
+
+        :return: The final byte, or an empty bytes object if there are no pending bits.
+        """
+        if not self.pending:
+            return b''
+        padded, self.pending = self.pending.ljust(8, '0'), ''
+        return int(padded, 2).to_bytes(1, 'big')
+
+
+class Alphabet(object):
+    """
+    The kinds of symbol sequence which may be encoded: strings, bytes, and sequences of non-negative integers (e.g.
+    tokens).
+
+    Trees and headers store symbols in their integer form: the code point of a character, the value of a byte, or the
+    integer itself.
+    """
+
+    TEXT = 0
+    BYTES = 1
+    INTEGERS = 2
+
+    # The integer form of an escape symbol (the empty string, in text).
+    ESCAPE = -1
+
+    @staticmethod
+    def of(data):
+        """Return the kind of the given symbol sequence"""
+        if isinstance(data, str):
+            return Alphabet.TEXT
+        if isinstance(data, (bytes, bytearray)):
+            return Alphabet.BYTES
+        return Alphabet.INTEGERS
+
+    @staticmethod
+    def to_integer(symbol, kind):
+        """Return the integer form of a symbol"""
+        if kind != Alphabet.TEXT:
+            return symbol
+        return ord(symbol) if symbol else Alphabet.ESCAPE
+
+    @staticmethod
+    def from_integer(value, kind):
+        """Return the symbol with the given integer form"""
+        if kind != Alphabet.TEXT:
+            return value
+        return chr(value) if value >= 0 else ''
+
+    @staticmethod
+    def join(symbols, kind):
+        """
+        Join a list of symbols into a sequence of the given kind.
+
+        :param symbols: A list of symbols.
+        :param kind: The kind of sequence.
+        :return: A string, bytes, or list.
+        """
+        if kind == Alphabet.TEXT:
+            return ''.join(symbols)
+        if kind == Alphabet.BYTES:
+            return bytes(symbols)
+        return list(symbols)
+
+    @staticmethod
+    def concatenate(parts, kind=TEXT):
+        """
+        Concatenate a list of strings, bytes, or lists.
+
+        :param parts: A list of sequences, all of the same kind.
+        :param kind: The kind of sequence to return if there are no parts.
+        :return: A single sequence, or an empty sequence of the given kind if there are no parts.
+        """
+        if not parts:
+            return Alphabet.join([], kind)
+        if isinstance(parts[0], list):
+            return list(chain.from_iterable(parts))
+        return parts[0][:0].join(parts)
+
 
 class HuffmanEncoder(object):
+    # Number of characters joined into a bit string before being packed into bytes.
+    CHUNK_SIZE = 65536
+
     @staticmethod
     def _build_frequency_map(string):
         """
-        Build a character -> frequency map for a string.
+        Build a character -> frequency map for a string, in a single pass.
 
         :param string: The subject string.
         :return: dict
         """
-
-        def recurse(letters, map):
-            if len(letters) == 0:
-                return map
-
-            letter, *tail = letters
-            map[letter] = map[letter] + 1 if letter in map else 1
-            return recurse(tail, map)
-
-        return recurse(list(string), {})
+        return dict(Counter(string))
 
     @staticmethod
     def _convert_map_to_nodes(map):
@@ -74,18 +180,17 @@ class HuffmanEncoder(object):
         :return Node: The root node of a Huffman tree.
         """
 
-        def recurse(leaves, combined):
-            if len(leaves) + len(combined) == 1:
-                if len(combined) == 0:
-                    # Single-item tree. This seems very inelegant.
-                    node = leaves.popleft()
-                    root = Node(None, node.frequency)
-                    root.left_child = node
-                    combined.append(root)
-                    return recurse(leaves, combined)
-                else:
-                    return combined.popleft()
+        leaves = deque(nodes, len(nodes))
+        combined = deque([], len(nodes))
 
+        if len(leaves) == 1:
+            # Single-item tree. This seems very inelegant.
+            node = leaves.popleft()
+            root = Node(None, node.frequency)
+            root.left_child = node
+            return root
+
+        while len(leaves) + len(combined) > 1:
             # Retrieve the two lowest-frequency nodes.
             leaves, combined, node_a = HuffmanEncoder._dequeue_lowest_frequency_node(leaves, combined)
             leaves, combined, node_b = HuffmanEncoder._dequeue_lowest_frequency_node(leaves, combined)
@@ -98,9 +203,7 @@ class HuffmanEncoder(object):
             # Add the new parent node to the "combined" deque
             combined.append(parent)
 
-            return recurse(leaves, combined)
-
-        return recurse(deque(nodes, len(nodes)), deque([], len(nodes)))
+        return combined.popleft()
 
     @staticmethod
     def _build_character_encoding_map(huffman_tree):
@@ -112,7 +215,7 @@ class HuffmanEncoder(object):
         """
 
         def recurse(node, encoding_map, code):
-            if node.character:
+            if node.is_leaf():
                 encoding_map[node.character] = code
             if node.left_child:
                 encoding_map = recurse(node.left_child, encoding_map, code + '0')
@@ -122,6 +225,32 @@ class HuffmanEncoder(object):
 
         return recurse(huffman_tree, {}, '')
 
+    @staticmethod
+    def _build_tree_for(string):
+        """
+        Build the Huffman tree for the given string.
+
+        :param string: The subject string.
+        :return Node: The root node of a Huffman tree.
+        """
+        frequency_map = HuffmanEncoder._build_frequency_map(string)
+        leaves = HuffmanEncoder._sort_nodes(HuffmanEncoder._convert_map_to_nodes(frequency_map))
+        return HuffmanEncoder._build_tree(leaves)
+
+    @staticmethod
+    def _pack(string, encoding_map, writer):
+        """
+        Pack the encoded form of a string into bytes, one chunk at a time.
+
+        :param string: The string to encode.
+        :param encoding_map: A character -> encoding map.
+        :param writer: The BitWriter which receives the encoded bits.
+        :return: A generator of bytes objects.
+        """
+        lookup = encoding_map.__getitem__
+        for start in range(0, len(string), HuffmanEncoder.CHUNK_SIZE):
+            yield writer.write(''.join(map(lookup, string[start:start + HuffmanEncoder.CHUNK_SIZE])))
+
     @staticmethod
     def encode(string):
         """
@@ -134,20 +263,61 @@ class HuffmanEncoder(object):
         if not len(string):
             return None, None
 
-        def recurse(string, encoding_map):
-            if not string:
-                return ''
-            character, *tail = string
-            return encoding_map[character] + recurse(tail, encoding_map)
+        huffman_tree = HuffmanEncoder._build_tree_for(string)
+        encoding_map = HuffmanEncoder._build_character_encoding_map(huffman_tree)
 
-        frequency_map = HuffmanEncoder._build_frequency_map(string)
-        leaves = HuffmanEncoder._sort_nodes(HuffmanEncoder._convert_map_to_nodes(frequency_map))
-        huffman_tree = HuffmanEncoder._build_tree(leaves)
+        return ''.join(map(encoding_map.__getitem__, string)), huffman_tree
+
+    @staticmethod
+    def encode_packed(string):
+        """
+        Encode the given string as packed bytes.
 
-        return (
-            recurse(string, HuffmanEncoder._build_character_encoding_map(huffman_tree)),
-            huffman_tree
-        )
+        The final byte is padded with zeros; the bit length identifies where the encoded data ends.
+
+        :param string: The string to encode.
+        :return: A tuple containing the encoded bytes, the number of encoded bits, and the Huffman tree.
+        """
+
+        if not len(string):
+            return b'', 0, None
+
+        huffman_tree = HuffmanEncoder._build_tree_for(string)
+        encoding_map = HuffmanEncoder._build_character_encoding_map(huffman_tree)
+
+        writer = BitWriter()
+        encoded = bytearray()
+        for packed in HuffmanEncoder._pack(string, encoding_map, writer):
+            encoded += packed
+        encoded += writer.flush()
+
+        return bytes(encoded), writer.bit_length, huffman_tree
+
+    @staticmethod
+    def encode_canonical(string):
+        """
+        Encode the given string, bytes, or sequence of integer symbols as a self-describing blob.
+
+        The blob starts with a header containing the kind of sequence and the canonical code lengths, followed by the
+        number of encoded bits, and the packed encoded data.
+
+        :param string: The sequence to encode.
+        :return: bytes
+        """
+        kind = Alphabet.of(string)
+
+        if not len(string):
+            return CanonicalCode({}, kind).serialize() + Varint.encode(0)
+
+        code = CanonicalCode.from_frequencies(HuffmanEncoder._build_frequency_map(string), kind)
+
+        writer = BitWriter()
+        encoded = bytearray(code.serialize())
+        packed = b''.join(HuffmanEncoder._pack(string, code.encoding_map, writer)) + writer.flush()
+        encoded += Varint.encode(writer.bit_length)
+        encoded += packed
+
+        return bytes(encoded)
 
 
 class HuffmanDecoder(object):
@@ -162,7 +332,7 @@ class HuffmanDecoder(object):
         """
 
         def recurse(binary_path, node):
-            if node.character:
+            if node.is_leaf():
                 return node.character, binary_path
             if not binary_path:
                 return '', binary_path  # This should never happen
@@ -175,22 +345,1136 @@ class HuffmanDecoder(object):
         return recurse(encoded, huffman_tree)
 
     @staticmethod
-    def decode(encoded, huffman_tree):
+    def decode(encoded, huffman_tree, kind=Alphabet.TEXT):
         """
         Decode an encoded string.
 
         :param encoded: An encoded string.
         :param huffman_tree: A Huffman tree.
+        :param kind: The kind of sequence which was encoded (see `Alphabet`).
         :return: The decoded string.
         """
 
-        def recurse(binary_path):
-            if not binary_path:
-                return ''
-            character, binary_path = HuffmanDecoder.decode_character(binary_path, huffman_tree)
-            return character + HuffmanDecoder.decode(binary_path, huffman_tree)
+        decoded = []
+        node = huffman_tree
+
+        for branch in encoded:
+            node = node.left_child if branch == '0' else node.right_child
+            if node.is_leaf():
+                decoded.append(node.character)
+                node = huffman_tree
+
+        return Alphabet.join(decoded, kind)
+
+    @staticmethod
+    def decode_packed(encoded, bit_length, huffman_tree, bits=12, kind=Alphabet.TEXT):
+        """
+        Decode packed bytes.
+
+        :param encoded: The encoded bytes.
+        :param bit_length: The number of encoded bits.
+        :param huffman_tree: A Huffman tree, either linked Nodes or an ArrayHuffmanTree.
+        :param bits: The number of bits resolved by each lookup table hit.
+        :param kind: The kind of sequence which was encoded (see `Alphabet`). Ignored for an ArrayHuffmanTree.
+        :return: The decoded string.
+        """
+        if huffman_tree is None:
+            return Alphabet.join([], kind)
+        return HuffmanTableDecoder(huffman_tree, bits, kind=kind).decode(encoded, bit_length)
+
+    @staticmethod
+    def decode_canonical(encoded, bits=12):
+        """
+        Decode a self-describing blob, created by `HuffmanEncoder.encode_canonical`.
+
+        :param encoded: The encoded bytes.
+        :param bits: The number of bits resolved by each lookup table hit.
+        :return: The decoded string.
+        """
+        code, offset = CanonicalCode.deserialize(encoded)
+        bit_length, offset = Varint.decode(encoded, offset)
+        return HuffmanDecoder.decode_packed(encoded[offset:], bit_length, code.to_array_tree(), bits, code.kind)
+
+
+class ArrayHuffmanTree(object):
+    """
+    A Huffman tree stored as flat arrays indexed by node, rather than as linked Nodes.
+
+    Leaves have a left child of -1. Symbols are stored in their integer form (see `Alphabet`), as signed 64-bit
+    integers, so an integer symbol may be at most MAX_SYMBOL.
+    """
+
+    MAX_SYMBOL = 2 ** 63 - 1
+
+    def __init__(self, symbols, left, right, parent, root, kind):
+        self.symbols = symbols
+        self.left = left
+        self.right = right
+        self.parent = parent
+        self.root = root
+        self.kind = kind
+
+    @staticmethod
+    def _allocate(size):
+        """Return symbol, left, right, and parent arrays for the given number of nodes"""
+        return array('q', [0]) * size, array('l', [-1]) * size, array('l', [-1]) * size, array('l', [-1]) * size
+
+    @staticmethod
+    def _integer(symbol, kind):
+        """Return the integer form of a symbol, checking that it fits the symbol array"""
+        integer = Alphabet.to_integer(symbol, kind)
+        if integer > ArrayHuffmanTree.MAX_SYMBOL:
+            raise ValueError('Symbol {} exceeds the maximum of {}'.format(integer, ArrayHuffmanTree.MAX_SYMBOL))
+        return integer
+
+    @staticmethod
+    def from_frequencies(frequency_map, kind=Alphabet.TEXT):
+        """
+        Build a Huffman tree from a symbol -> frequency map.
+
+        Leaves are numbered first, in order of frequency, followed by the internal nodes in the order they are created.
+        The internal nodes are therefore also ordered by frequency, and serve as the "combined" queue.
+
+        :param frequency_map: A symbol -> frequency map.
+        :param kind: The kind of sequence the symbols belong to (see `Alphabet`).
+        :return ArrayHuffmanTree: The tree, or None if the map is empty.
+        """
+        if not frequency_map:
+            return None
+
+        leaves = sorted(frequency_map, key=frequency_map.__getitem__)
+        leaf_count = len(leaves)
+        size = max(2 * leaf_count - 1, 2)
+
+        symbols, left, right, parent = ArrayHuffmanTree._allocate(size)
+        for index, symbol in enumerate(leaves):
+            symbols[index] = ArrayHuffmanTree._integer(symbol, kind)
+
+        if leaf_count == 1:
+            # Single-item tree.
+            left[1] = 0
+            parent[0] = 1
+            return ArrayHuffmanTree(symbols, left, right, parent, 1, kind)
+
+        frequencies = [frequency_map[symbol] for symbol in leaves]
+        next_leaf = 0
+        next_combined = leaf_count
+
+        for node in range(leaf_count, size):
+            children = []
+            for _ in range(2):
+                # The combined queue is empty once it catches up with the node being created.
+                if next_leaf < leaf_count and (
+                        next_combined == node or frequencies[next_leaf] <= frequencies[next_combined]):
+                    children.append(next_leaf)
+                    next_leaf += 1
+                else:
+                    children.append(next_combined)
+                    next_combined += 1
+
+            left[node], right[node] = children
+            parent[children[0]] = parent[children[1]] = node
+            frequencies.append(frequencies[children[0]] + frequencies[children[1]])
+
+        return ArrayHuffmanTree(symbols, left, right, parent, size - 1, kind)
+
+    @staticmethod
+    def from_code(code):
+        """
+        Build a Huffman tree from a CanonicalCode.
+
+        :param code: A CanonicalCode.
+        :return: ArrayHuffmanTree
+        """
+        symbols, left, right, parent = ArrayHuffmanTree._allocate(1)
+
+        for symbol, bits in code.encoding_map.items():
+            node = 0
+            for branch in bits:
+                children = left if branch == '0' else right
+                if children[node] < 0:
+                    children[node] = len(symbols)
+                    symbols.append(0)
+                    left.append(-1)
+                    right.append(-1)
+                    parent.append(node)
+                node = children[node]
+            symbols[node] = ArrayHuffmanTree._integer(symbol, code.kind)
+
+        return ArrayHuffmanTree(symbols, left, right, parent, 0, code.kind)
+
+    @staticmethod
+    def from_node(huffman_tree, kind=Alphabet.TEXT):
+        """
+        Convert a tree of linked Nodes to flat arrays.
+
+        :param huffman_tree: The root Node of a Huffman tree.
+        :param kind: The kind of sequence the symbols belong to (see `Alphabet`).
+        :return: ArrayHuffmanTree
+        """
+        symbols, left, right, parent = ArrayHuffmanTree._allocate(1)
+        stack = [(huffman_tree, 0)]
+
+        while stack:
+            node, index = stack.pop()
+            if node.is_leaf():
+                symbols[index] = ArrayHuffmanTree._integer(node.character, kind)
+                continue
+            for child, children in ((node.left_child, left), (node.right_child, right)):
+                if child is None:
+                    continue
+                children[index] = len(symbols)
+                stack.append((child, len(symbols)))
+                symbols.append(0)
+                left.append(-1)
+                right.append(-1)
+                parent.append(index)
+
+        return ArrayHuffmanTree(symbols, left, right, parent, 0, kind)
+
+    def code_lengths(self):
+        """
+        Build a symbol -> code length map.
+
+        :return: dict
+        """
+        code_lengths = {}
+        stack = [(self.root, 0)]
+
+        while stack:
+            node, depth = stack.pop()
+            if self.left[node] < 0:
+                code_lengths[Alphabet.from_integer(self.symbols[node], self.kind)] = depth
+                continue
+            stack.append((self.left[node], depth + 1))
+            if self.right[node] >= 0:
+                stack.append((self.right[node], depth + 1))
+
+        return code_lengths
+
+
+class HuffmanTableDecoder(object):
+    # Number of bytes read into the bit accumulator at a time.
+    REFILL_SIZE = 8
+
+    def __init__(self, huffman_tree, bits=12, escape=None, literal_bits=21, kind=Alphabet.TEXT):
+        """
+        :param huffman_tree: A Huffman tree, either linked Nodes or an ArrayHuffmanTree.
+        :param bits: The number of bits resolved by each lookup table hit.
+        :param escape: A symbol which is followed by a literal, or None.
+        :param literal_bits: The number of bits in each literal.
+        :param kind: The kind of sequence which was encoded (see `Alphabet`). Ignored for an ArrayHuffmanTree.
+        """
+        if isinstance(huffman_tree, Node):
+            huffman_tree = ArrayHuffmanTree.from_node(huffman_tree, kind)
+
+        self.tree = huffman_tree
+        self.kind = huffman_tree.kind
+        self.bits = bits
+        self.escape = None if escape is None else Alphabet.to_integer(escape, self.kind)
+        self.literal_bits = literal_bits
+
+        # The decoded symbol for each node, so the slow paths need not convert the integer form.
+        self.node_symbols = [Alphabet.from_integer(symbol, self.kind) for symbol in huffman_tree.symbols]
+        self.table = self._build_table()
+
+    def _is_escape(self, node):
+        """Return a boolean indicating whether the given leaf is the escape symbol"""
+        return self.escape is not None and self.tree.symbols[node] == self.escape
+
+    def _build_table(self):
+        """
+        Build a lookup table, indexed by every possible `bits`-wide window of encoded data.
+
+        Each entry is a tuple containing the symbols fully decoded within the window, and the number of bits they
+        occupy. The third item is the node reached at the end of the window if no symbol could be decoded (the code is
+        longer than the window), the escape leaf if decoding stopped at an escape, or None.
+
+        :return: list
+        """
+        left, right, root = self.tree.left, self.tree.right, self.tree.root
+        table = []
+
+        for window in range(1 << self.bits):
+            symbols = []
+            used = 0
+            node = root
+            stop = None
+
+            for position in range(self.bits):
+                bit = (window >> (self.bits - 1 - position)) & 1
+                node = right[node] if bit else left[node]
+                if node < 0:
+                    break  # Not a valid code. Only reachable via padding.
+                if left[node] < 0:
+                    used = position + 1
+                    if self._is_escape(node):
+                        stop = node
+                        break
+                    symbols.append(self.node_symbols[node])
+                    node = root
+
+            if not used:
+                stop = node
+            table.append((tuple(symbols), used, stop))
+
+        return table
+
+    def decode(self, encoded, bit_length):
+        """
+        Decode packed bytes.
+
+        An escape which is not followed by a complete literal ends the data; this allows the final byte to be padded
+        with the start of an escape.
+
+        :param encoded: The encoded bytes.
+        :param bit_length: The number of encoded bits.
+        :return: The decoded string, bytes, or list.
+        """
+        table = self.table
+        width = self.bits
+        mask = (1 << width) - 1
+        literal_bits = self.literal_bits
+        literal_mask = (1 << literal_bits) - 1
+        left, right, root = self.tree.left, self.tree.right, self.tree.root
+        node_symbols = self.node_symbols
+        kind = self.kind
+
+        decoded = []
+        extend = decoded.extend
+
+        # The accumulator holds `available` unread bits, in its least significant positions.
+        accumulator = 0
+        available = 0
+        offset = 0
+        remaining = bit_length
+
+        def refill(accumulator, available, offset):
+            chunk = encoded[offset:offset + self.REFILL_SIZE]
+            accumulator = ((accumulator & ((1 << available) - 1)) << (len(chunk) * 8)) | int.from_bytes(chunk, 'big')
+            return accumulator, available + len(chunk) * 8, offset + len(chunk)
+
+        # Fast path: every window lies entirely within the encoded data.
+        while remaining >= width:
+            if available < width:
+                accumulator, available, offset = refill(accumulator, available, offset)
+
+            symbols, used, node = table[(accumulator >> (available - width)) & mask]
+
+            if used:
+                extend(symbols)
+                available -= used
+                remaining -= used
+                if node is None:
+                    continue
+            else:
+                # The code is longer than the window. Walk the rest of it one bit at a time.
+                available -= width
+                remaining -= width
+                while left[node] >= 0 and remaining > 0:
+                    if not available:
+                        accumulator, available, offset = refill(accumulator, available, offset)
+                    available -= 1
+                    remaining -= 1
+                    node = right[node] if (accumulator >> available) & 1 else left[node]
+                    if node < 0:
+                        raise ValueError('Invalid code')
+                if left[node] >= 0:
+                    break
+                if not self._is_escape(node):
+                    decoded.append(node_symbols[node])
+                    continue
+
+            # An escape: read the literal which follows it.
+            if remaining < literal_bits:
+                remaining = 0
+                break
+            if available < literal_bits:
+                accumulator, available, offset = refill(accumulator, available, offset)
+            available -= literal_bits
+            remaining -= literal_bits
+            decoded.append(Alphabet.from_integer((accumulator >> available) & literal_mask, kind))
+
+        # Slow path: decode the tail one bit at a time.
+        node = root
+        while remaining > 0:
+            if not available:
+                accumulator, available, offset = refill(accumulator, available, offset)
+            available -= 1
+            remaining -= 1
+            node = right[node] if (accumulator >> available) & 1 else left[node]
+            if node < 0:
+                raise ValueError('Invalid code')
+            if left[node] >= 0:
+                continue
+            if self._is_escape(node):
+                if remaining < literal_bits:
+                    break
+                if available < literal_bits:
+                    accumulator, available, offset = refill(accumulator, available, offset)
+                available -= literal_bits
+                remaining -= literal_bits
+                decoded.append(Alphabet.from_integer((accumulator >> available) & literal_mask, kind))
+            else:
+                decoded.append(node_symbols[node])
+            node = root
+
+        return Alphabet.join(decoded, kind)
+
+
+class Varint(object):
+    @staticmethod
+    def encode(value):
+        """
+        Encode a non-negative integer as a variable-length sequence of bytes, 7 bits per byte.
+
+        :param value: The integer to encode.
+        :return: bytes
+        """
+        encoded = bytearray()
+        while value > 0x7f:
+            encoded.append((value & 0x7f) | 0x80)
+            value >>= 7
+        encoded.append(value)
+        return bytes(encoded)
+
+    @staticmethod
+    def decode(data, offset=0):
+        """
+        Decode a variable-length integer.
+
+        :param data: The encoded bytes.
+        :param offset: The position of the integer within the data.
+        :return: A tuple containing the decoded integer, and the offset of the following byte.
+        """
+        value = 0
+        shift = 0
+        while True:
+            if offset >= len(data):
+                raise ValueError('Truncated varint')
+            byte = data[offset]
+            offset += 1
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return value, offset
+            shift += 7
+
+
+class CanonicalCode(object):
+    def __init__(self, code_lengths, kind=Alphabet.TEXT):
+        """
+        :param code_lengths: A symbol -> code length map.
+        :param kind: The kind of sequence the symbols belong to (see `Alphabet`).
+        """
+        self.code_lengths = code_lengths
+        self.kind = kind
+        self.encoding_map = self._assign_codes(code_lengths)
+
+    @staticmethod
+    def from_tree(huffman_tree, kind=Alphabet.TEXT):
+        """
+        Create a canonical code with the same code lengths as the given Huffman tree.
+
+        :param huffman_tree: A Huffman tree.
+        :param kind: The kind of sequence the symbols belong to (see `Alphabet`).
+        :return: CanonicalCode
+        """
+        encoding_map = HuffmanEncoder._build_character_encoding_map(huffman_tree)
+        return CanonicalCode({character: len(code) for character, code in encoding_map.items()}, kind)
+
+    @staticmethod
+    def from_frequencies(frequency_map, kind=Alphabet.TEXT):
+        """
+        Create a canonical code from a symbol -> frequency map, via an ArrayHuffmanTree.
+
+        :param frequency_map: A symbol -> frequency map.
+        :param kind: The kind of sequence the symbols belong to (see `Alphabet`).
+        :return: CanonicalCode
+        """
+        huffman_tree = ArrayHuffmanTree.from_frequencies(frequency_map, kind)
+        return CanonicalCode(huffman_tree.code_lengths() if huffman_tree else {}, kind)
+
+    @staticmethod
+    def _assign_codes(code_lengths):
+        """
+        Assign consecutive codes to the characters, ordered by code length and then by character.
+
+        :param code_lengths: A character -> code length map.
+        :return: A character -> encoding map.
+        """
+        encoding_map = {}
+        code = 0
+        previous_length = 0
+
+        for character, length in sorted(code_lengths.items(), key=lambda t: (t[1], t[0])):
+            code <<= length - previous_length
+            encoding_map[character] = format(code, '0{}b'.format(length))
+            code += 1
+            previous_length = length
+
+        return encoding_map
+
+    def to_tree(self):
+        """
+        Rebuild a Huffman tree from the canonical codes.
+
+        :return Node: The root node of a Huffman tree, or None if the code is empty.
+        """
+        if not self.encoding_map:
+            return None
+
+        root = Node(None, 0)
+        for character, code in self.encoding_map.items():
+            node = root
+            for branch in code:
+                if branch == '0':
+                    node.left_child = node.left_child or Node(None, 0)
+                    node = node.left_child
+                else:
+                    node.right_child = node.right_child or Node(None, 0)
+                    node = node.right_child
+            node.character = character
+
+        return root
+
+    def to_array_tree(self):
+        """
+        Rebuild a Huffman tree from the canonical codes, as flat arrays.
+
+        :return ArrayHuffmanTree: The tree, or None if the code is empty.
+        """
+        if not self.encoding_map:
+            return None
+        return ArrayHuffmanTree.from_code(self)
+
+    def serialize(self):
+        """
+        Serialize the code lengths into a compact header.
+
+        The header contains the kind of sequence and the number of symbols, followed by each symbol (as the difference
+        from the previous symbol's integer form) and its code length.
+
+        :return: bytes
+        """
+        header = bytearray([self.kind])
+        header += Varint.encode(len(self.code_lengths))
+        previous = 0
+
+        for symbol in sorted(self.code_lengths):
+            length = self.code_lengths[symbol]
+            integer = Alphabet.to_integer(symbol, self.kind)
+            if length > 0xff:
+                raise ValueError('Code length {} exceeds the maximum of 255'.format(length))
+            if integer < 0:
+                raise ValueError('Symbols must be non-negative')
+            header += Varint.encode(integer - previous)
+            header.append(length)
+            previous = integer
+
+        return bytes(header)
+
+    @staticmethod
+    def deserialize(header, offset=0):
+        """
+        Rebuild a canonical code from a serialized header.
+
+        :param header: The serialized header.
+        :param offset: The position of the header within the given bytes.
+        :return: A tuple containing the CanonicalCode, and the offset of the byte following the header.
+        """
+        if offset >= len(header):
+            raise ValueError('Truncated header')
+        kind = header[offset]
+        count, offset = Varint.decode(header, offset + 1)
+        code_lengths = {}
+        previous = 0
+
+        for _ in range(count):
+            delta, offset = Varint.decode(header, offset)
+            if offset >= len(header):
+                raise ValueError('Truncated header')
+            previous += delta
+            code_lengths[Alphabet.from_integer(previous, kind)] = header[offset]
+            offset += 1
+
+        return CanonicalCode(code_lengths, kind), offset
+
+
+class EscapingEncodingMap(dict):
+    def __init__(self, encoding_map, escape_code, literal_bits):
+        super().__init__(encoding_map)
+        self.escape_code = escape_code
+        self.literal_format = '0{}b'.format(literal_bits)
+
+    def __missing__(self, character):
+        """Encode an unknown character as the escape code, followed by its code point"""
+        return self.escape_code + format(ord(character), self.literal_format)
+
+
+class HuffmanModel(object):
+    """
+    A Huffman code trained once on a sample corpus, and reused to encode many messages.
+
+    Characters missing from the corpus are encoded as the escape code, followed by their code point.
+    """
+
+    # The escape character. The empty string never occurs within a string, and sorts ahead of every character.
+    ESCAPE = ''
+
+    def __init__(self, code, literal_bits=21, bits=12):
+        """
+        :param code: A CanonicalCode, which includes the escape character.
+        :param literal_bits: The number of bits in each literal code point.
+        :param bits: The number of bits resolved by each decoder lookup table hit.
+        """
+        self.code = code
+        self.literal_bits = literal_bits
+        self.escape_code = code.encoding_map[self.ESCAPE]
+        self.encoding_map = EscapingEncodingMap(code.encoding_map, self.escape_code, literal_bits)
+        self.decoder = HuffmanTableDecoder(code.to_array_tree(), bits, self.ESCAPE, literal_bits)
+
+    @staticmethod
+    def train(corpus, literal_bits=21, escape_frequency=1, bits=12):
+        """
+        Train a model on a sample corpus.
+
+        :param corpus: An iterable of sample messages.
+        :param literal_bits: The number of bits in each literal code point.
+        :param escape_frequency: The weight given to characters missing from the corpus.
+        :param bits: The number of bits resolved by each decoder lookup table hit.
+        :return: HuffmanModel
+        """
+        frequency_map = Counter()
+        for message in corpus:
+            frequency_map.update(message)
+        frequency_map[HuffmanModel.ESCAPE] = escape_frequency
+
+        leaves = HuffmanEncoder._sort_nodes(HuffmanEncoder._convert_map_to_nodes(frequency_map))
+        code = CanonicalCode.from_tree(HuffmanEncoder._build_tree(leaves))
+
+        return HuffmanModel(code, literal_bits, bits)
+
+    def encode(self, message):
+        """
+        Encode a message.
+
+        The final byte is padded with the start of an escape, which the decoder ignores, so no bit length is needed.
+
+        :param message: The string to encode.
+        :return: bytes
+        """
+        bits = ''.join(map(self.encoding_map.__getitem__, message))
+        bits += (self.escape_code + '0' * self.literal_bits)[:-len(bits) % 8]
+        return int(bits, 2).to_bytes(len(bits) // 8, 'big') if bits else b''
+
+    def decode(self, encoded):
+        """
+        Decode a message.
+
+        :param encoded: The encoded bytes.
+        :return: The decoded string.
+        """
+        return self.decoder.decode(encoded, len(encoded) * 8)
+
+    def serialize(self):
+        """
+        Serialize the model.
+
+        :return: bytes
+        """
+        code_lengths = dict(self.code.code_lengths)
+        escape_length = code_lengths.pop(self.ESCAPE)
+        return bytes([self.literal_bits, escape_length]) + CanonicalCode(code_lengths).serialize()
+
+    @staticmethod
+    def deserialize(data, bits=12):
+        """
+        Rebuild a serialized model.
+
+        :param data: The serialized model.
+        :param bits: The number of bits resolved by each decoder lookup table hit.
+        :return: HuffmanModel
+        """
+        code, _ = CanonicalCode.deserialize(data, 2)
+        code_lengths = dict(code.code_lengths)
+        code_lengths[HuffmanModel.ESCAPE] = data[1]
+        return HuffmanModel(CanonicalCode(code_lengths), data[0], bits)
+
+
+class HuffmanStreamCompressor(object):
+    # Number of characters encoded with each Huffman tree.
+    BLOCK_SIZE = 1 << 20
+
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+
+    @staticmethod
+    def read_chunks(read, size):
+        """
+        Read a file-like object in chunks, until it is exhausted.
+
+        :param read: The file-like object's read method.
+        :param size: The chunk size.
+        :return: A generator of strings or bytes.
+        """
+        while True:
+            chunk = read(size)
+            if not chunk:
+                return
+            yield chunk
+
+    def _blocks(self, source):
+        """
+        Split the source into blocks of `block_size` symbols.
+
+        :param source: A string or bytes, a file-like object, or an iterable of strings, bytes, or lists of integers.
+        :return: A generator of strings, bytes, or lists.
+        """
+        if isinstance(source, (str, bytes, bytearray)):
+            for start in range(0, len(source), self.block_size):
+                yield source[start:start + self.block_size]
+            return
+
+        if hasattr(source, 'read'):
+            source = self.read_chunks(source.read, self.block_size)
+
+        pending = []
+        pending_length = 0
+
+        for chunk in source:
+            pending.append(chunk)
+            pending_length += len(chunk)
+
+            if pending_length >= self.block_size:
+                buffered = Alphabet.concatenate(pending)
+                whole = len(buffered) - len(buffered) % self.block_size
+                for start in range(0, whole, self.block_size):
+                    yield buffered[start:start + self.block_size]
+                pending = [buffered[whole:]]
+                pending_length = len(pending[0])
+
+        if pending_length:
+            yield Alphabet.concatenate(pending)
+
+    def compress(self, source):
+        """
+        Compress the source, one block at a time.
+
+        Each block is encoded with its own tree, as a self-describing blob, prefixed by the blob length.
+
+        :param source: A string or bytes, a file-like object, or an iterable of strings, bytes, or lists of integers.
+        :return: A generator of bytes objects, one per block.
+        """
+        for block in self._blocks(source):
+            yield self.encode_block(block)
+
+    @staticmethod
+    def encode_block(block):
+        """
+        Encode a single block as a self-describing blob, prefixed by the blob length.
+
+        :param block: The string, bytes, or list of integers to encode.
+        :return: bytes
+        """
+        blob = HuffmanEncoder.encode_canonical(block)
+        return Varint.encode(len(blob)) + blob
+
+    def compress_to(self, source, sink):
+        """
+        Compress the source, writing each block to the sink as soon as it is encoded.
+
+        :param source: A string or bytes, a file-like object, or an iterable of strings, bytes, or lists of integers.
+        :param sink: A binary file-like object.
+        :return: The number of bytes written.
+        """
+        written = 0
+        for frame in self.compress(source):
+            sink.write(frame)
+            written += len(frame)
+        return written
+
+
+class HuffmanStreamDecompressor(object):
+    # Number of bytes read from a file-like source at a time.
+    READ_SIZE = 1 << 16
+
+    def __init__(self, read_size=READ_SIZE):
+        self.read_size = read_size
+
+    def _frames(self, source):
+        """
+        Split the source into the blobs written by `HuffmanStreamCompressor`.
+
+        :param source: A bytes object, a binary file-like object, or an iterable of bytes.
+        :return: A generator of bytes-like objects, one per block.
+        """
+        if isinstance(source, (bytes, bytearray)):
+            yield from self.split(source)
+            return
+
+        if hasattr(source, 'read'):
+            source = HuffmanStreamCompressor.read_chunks(source.read, self.read_size)
+
+        buffer = bytearray()
+
+        for chunk in source:
+            buffer += chunk
+            while buffer:
+                try:
+                    length, offset = Varint.decode(buffer)
+                except ValueError:
+                    break
+                if len(buffer) < offset + length:
+                    break
+                yield bytes(buffer[offset:offset + length])
+                del buffer[:offset + length]
+
+        if buffer:
+            raise ValueError('Truncated stream')
+
+    @staticmethod
+    def split(data):
+        """
+        Split an in-memory stream into the blobs written by `HuffmanStreamCompressor`, without copying the stream.
+
+        :param data: The compressed bytes.
+        :return: A list of memoryviews of the data, one per block.
+        """
+        frames = []
+        offset = 0
+        view = memoryview(data)
+
+        while offset < len(data):
+            length, offset = Varint.decode(data, offset)
+            if len(data) < offset + length:
+                raise ValueError('Truncated stream')
+            frames.append(view[offset:offset + length])
+            offset += length
+
+        return frames
+
+    def decompress(self, source):
+        """
+        Decompress the source, one block at a time.
+
+        :param source: A bytes object, a binary file-like object, or an iterable of bytes.
+        :return: A generator of strings, bytes, or lists, one per block.
+        """
+        for frame in self._frames(source):
+            yield HuffmanDecoder.decode_canonical(frame)
+
+    def decompress_to(self, source, sink):
+        """
+        Decompress the source, writing each block to the sink as soon as it is decoded.
+
+        :param source: A bytes object, a binary file-like object, or an iterable of bytes.
+        :param sink: A file-like object, of the same kind as the original source.
+        :return: The number of symbols written.
+        """
+        written = 0
+        for block in self.decompress(source):
+            sink.write(block)
+            written += len(block)
+        return written
+
+
+class HuffmanParallelCodec(object):
+    def __init__(self, block_size=HuffmanStreamCompressor.BLOCK_SIZE, max_workers=None, executor=None):
+        """
+        :param block_size: The number of characters encoded with each Huffman tree.
+        :param max_workers: The number of worker processes. Defaults to the number of CPUs.
+        :param executor: An existing `concurrent.futures.Executor` to use, instead of a new process pool.
+        """
+        self.block_size = block_size
+        self.max_workers = max_workers
+        self.executor = executor
+
+    def _map(self, function, items):
+        """
+        Apply the function to every item, across the worker pool.
+
+        :param function: A picklable function.
+        :param items: An iterable of arguments.
+        :return: A list of results, in the same order as the items.
+        """
+        if self.executor is not None:
+            return list(self.executor.map(function, items))
+
+        with ProcessPoolExecutor(self.max_workers) as executor:
+            return list(executor.map(function, items))
+
+    def compress(self, string):
+        """
+        Compress the string, encoding each block in parallel.
+
+        The output uses the same framing as `HuffmanStreamCompressor`, and may be read by either decompressor.
+
+        :param string: The string to compress.
+        :return: bytes
+        """
+        blocks = HuffmanStreamCompressor(self.block_size)._blocks(string)
+        return b''.join(self._map(HuffmanStreamCompressor.encode_block, blocks))
+
+    def decompress(self, data, kind=Alphabet.TEXT):
+        """
+        Decompress the data, decoding each block in parallel.
+
+        :param data: The compressed bytes.
+        :param kind: The kind of sequence to return if the data holds no blocks, as an empty source compresses to
+                     nothing, whatever its kind (see `Alphabet`).
+        :return: The decoded string, bytes, or list.
+        """
+        # Memoryviews cannot be pickled, so each block is copied once, for its worker.
+        frames = map(bytes, HuffmanStreamDecompressor.split(data))
+        return Alphabet.concatenate(self._map(HuffmanDecoder.decode_canonical, frames), kind)
+
+
+class AdaptiveNode(Node):
+    def __init__(self, character, frequency, parent, index):
+        super().__init__(character, frequency)
+        self.parent = parent
+        self.index = index
+
+
+class AdaptiveHuffmanTree(object):
+    """
+    An FGK adaptive Huffman tree, updated after every character.
+
+    Nodes are listed in order of non-increasing frequency, with siblings adjacent (the sibling property). Characters
+    which have not been seen before are encoded as the code of the "not yet transmitted" (NYT) node, followed by the
+    character's code point, using `literal_bits` bits. The largest literal is reserved for the end of a message.
+    """
+
+    def __init__(self, literal_bits=21):
+        self.literal_bits = literal_bits
+        self.sync_literal = (1 << literal_bits) - 1
+        self.root = AdaptiveNode(None, 0, None, 0)
+        self.nyt = self.root
+        self.leaves = {}
+
+        # The nodes, and their negated frequencies, in order. Negating keeps the list ascending, for bisect.
+        self.nodes = [self.root]
+        self.negated_frequencies = [0]
+
+    @staticmethod
+    def _path(node):
+        """
+        Return the code for the given node.
+
+        :param node: An AdaptiveNode.
+        :return: A string of '0' / '1' characters.
+        """
+        path = []
+        while node.parent is not None:
+            path.append('0' if node.parent.left_child is node else '1')
+            node = node.parent
+        return ''.join(reversed(path))
+
+    def nyt_code(self):
+        """Return the code for the NYT node"""
+        return self._path(self.nyt)
+
+    def code(self, character):
+        """
+        Return the code for the given character, in the current state of the tree.
+
+        :param character: The character to encode.
+        :return: A string of '0' / '1' characters.
+        """
+        leaf = self.leaves.get(character)
+        if leaf is not None:
+            return self._path(leaf)
+        if ord(character) >= self.sync_literal:
+            raise ValueError('{!r} does not fit in {} bits'.format(character, self.literal_bits))
+        return self.nyt_code() + format(ord(character), '0{}b'.format(self.literal_bits))
+
+    def sync_code(self):
+        """Return the code which ends a message: an NYT escape, followed by the reserved literal"""
+        return self.nyt_code() + format(self.sync_literal, '0{}b'.format(self.literal_bits))
+
+    def _leader(self, node):
+        """Return the first node in the list with the same frequency as the given node"""
+        return self.nodes[bisect_left(self.negated_frequencies, -node.frequency)]
+
+    def _swap(self, node_a, node_b):
+        """
+        Swap two nodes with the same frequency, along with their subtrees.
+
+        :param node_a: An AdaptiveNode.
+        :param node_b: An AdaptiveNode, which is not an ancestor of node_a.
+        """
+        index_a, index_b = node_a.index, node_b.index
+        self.nodes[index_a], self.nodes[index_b] = node_b, node_a
+        node_a.index, node_b.index = index_b, index_a
+
+        parent_a, parent_b = node_a.parent, node_b.parent
+        a_is_left = parent_a.left_child is node_a
+        b_is_left = parent_b.left_child is node_b
+
+        if a_is_left:
+            parent_a.left_child = node_b
+        else:
+            parent_a.right_child = node_b
+        if b_is_left:
+            parent_b.left_child = node_a
+        else:
+            parent_b.right_child = node_a
+
+        node_a.parent, node_b.parent = parent_b, parent_a
+
+    def _increment(self, node):
+        """Increment the frequency of the given node"""
+        node.frequency += 1
+        self.negated_frequencies[node.index] -= 1
+
+    def _add_leaf(self, character):
+        """
+        Split the NYT node into a new NYT node, and a leaf for the given character.
+
+        :param character: The new character.
+        :return: A tuple containing the former NYT node (now an internal node), and the new leaf.
+        """
+        parent = self.nyt
+        leaf = AdaptiveNode(character, 0, parent, len(self.nodes))
+        self.nyt = AdaptiveNode(None, 0, parent, len(self.nodes) + 1)
+
+        parent.left_child = self.nyt
+        parent.right_child = leaf
 
-        return recurse(encoded)
+        self.nodes += [leaf, self.nyt]
+        self.negated_frequencies += [0, 0]
+        self.leaves[character] = leaf
+
+        return parent, leaf
+
+    def update(self, character):
+        """
+        Update the tree after encoding or decoding the given character.
+
+        :param character: The character.
+        """
+        node = self.leaves.get(character)
+        new_leaf = None
+
+        if node is None:
+            # The new leaf is incremented last, so that it never sits ahead of its parent during the update.
+            node, new_leaf = self._add_leaf(character)
+
+        is_leader = False
+        while node is not None:
+            leader = node if is_leader else self._leader(node)
+            # The parent only shares a node's frequency when its other child is the NYT node. The parent is
+            # incremented next, and remains the leader of its block.
+            is_leader = leader is node.parent
+            if leader is not node and not is_leader:
+                self._swap(node, leader)
+            self._increment(node)
+            node = node.parent
+
+        if new_leaf is not None:
+            self._increment(new_leaf)
+
+
+class AdaptiveHuffmanEncoder(object):
+    def __init__(self, literal_bits=21):
+        self.tree = AdaptiveHuffmanTree(literal_bits)
+        self.writer = BitWriter()
+
+    def encode(self, string):
+        """
+        Encode the given string, without any lookahead.
+
+        :param string: The string to encode.
+        :return: The bytes completed so far. Up to 7 bits are held back until the next call.
+        :raises ValueError: If a character does not fit in `literal_bits`. Nothing is encoded, and the tree is unchanged.
+        """
+        # Checked up front, so that a rejected string leaves the tree as the decoder's is.
+        if string and ord(max(string)) >= self.tree.sync_literal:
+            raise ValueError('{!r} does not fit in {} bits'.format(max(string), self.tree.literal_bits))
+
+        codes = []
+        for character in string:
+            codes.append(self.tree.code(character))
+            self.tree.update(character)
+        return self.writer.write(''.join(codes))
+
+    def sync(self):
+        """
+        End a message, returning its incomplete byte, so the decoder can decode all of it without waiting for the next.
+
+        The message is followed by the sync code, which the decoder skips, along with the padding to the end of the
+        byte. The stream continues with the next call to `encode`. Nothing is needed when the message already ends on a
+        byte boundary.
+
+        :return: bytes
+        """
+        if not self.writer.pending:
+            return b''
+        return self.writer.write(self.tree.sync_code()) + self.writer.flush()
+
+    def flush(self):
+        """
+        End the stream, returning any incomplete byte.
+
+        The byte is padded with the start of an NYT escape, which the decoder treats as incomplete, and ignores.
+
+        :return: bytes
+        """
+        if not self.writer.pending:
+            return b''
+        padding = (self.tree.nyt_code() + '0' * self.tree.literal_bits)[:8 - len(self.writer.pending)]
+        return self.writer.write(padding)
+
+
+class AdaptiveHuffmanDecoder(object):
+    def __init__(self, literal_bits=21):
+        self.tree = AdaptiveHuffmanTree(literal_bits)
+        self.node = self.tree.root
+        # The bits of a partially-read literal, or None if a code is being read. The stream starts with a literal.
+        self.literal = ''
+
+    def decode(self, encoded):
+        """
+        Decode the given bytes, continuing from the end of the previous call.
+
+        :param encoded: The encoded bytes.
+        :return: The characters completed by these bytes.
+        """
+        decoded = []
+        tree = self.tree
+        bits = format(int.from_bytes(encoded, 'big'), '0{}b'.format(len(encoded) * 8)) if encoded else ''
+        # The number of padding bits left to skip, after a sync code.
+        skip = 0
+
+        for position, bit in enumerate(bits):
+            if skip:
+                skip -= 1
+                continue
+            if self.literal is not None:
+                self.literal += bit
+                if len(self.literal) < tree.literal_bits:
+                    continue
+                value, self.literal = int(self.literal, 2), None
+                if value == tree.sync_literal:
+                    # The end of a message. The rest of the byte is padding, and the next message starts a new code.
+                    skip = 7 - position % 8
+                    self.node = tree.root
+                    continue
+                character = chr(value)
+            else:
+                self.node = self.node.right_child if bit == '1' else self.node.left_child
+                if self.node is tree.nyt:
+                    self.literal = ''
+                    continue
+                if not self.node.is_leaf():
+                    continue
+                character = self.node.character
+
+            decoded.append(character)
+            tree.update(character)
+            self.node = tree.root
+
+        return ''.join(decoded)
 
 
 def huffman_encoding(data):
@@ -203,6 +1487,16 @@ def huffman_encoding(data):
     return HuffmanEncoder.encode(data)
 
 
+def huffman_encoding_packed(data):
+    """
+    Encode a string as packed bytes.
+
+    :param data: The string to encode.
+    :return: A tuple containing the encoded bytes, the number of encoded bits, and the associated Huffman tree.
+    """
+    return HuffmanEncoder.encode_packed(data)
+
+
 def huffman_decoding(data, tree):
     """
     Decode a string, using a Huffman tree.
@@ -214,6 +1508,61 @@ def huffman_decoding(data, tree):
     return HuffmanDecoder.decode(data, tree)
 
 
+def huffman_decoding_packed(data, bit_length, tree):
+    """
+    Decode packed bytes, using a Huffman tree.
+
+    :param data: The bytes to decode.
+    :param bit_length: The number of encoded bits.
+    :param tree: The Huffman tree used to encode the string.
+    :return: The decoded string
+    """
+    return HuffmanDecoder.decode_packed(data, bit_length, tree)
+
+
+def huffman_compress(data):
+    """
+    Encode a string as a self-describing blob.
+
+    :param data: The string to encode.
+    :return: The encoded bytes.
+    """
+    return HuffmanEncoder.encode_canonical(data)
+
+
+def huffman_decompress(data):
+    """
+    Decode a self-describing blob.
+
+    :param data: The bytes to decode.
+    :return: The decoded string
+    """
+    return HuffmanDecoder.decode_canonical(data)
+
+
+def huffman_compress_stream(source, sink, block_size=HuffmanStreamCompressor.BLOCK_SIZE):
+    """
+    Compress a text stream, one block at a time.
+
+    :param source: A string, a text file-like object, or an iterable of strings.
+    :param sink: A binary file-like object.
+    :param block_size: The number of characters encoded with each Huffman tree.
+    :return: The number of bytes written.
+    """
+    return HuffmanStreamCompressor(block_size).compress_to(source, sink)
+
+
+def huffman_decompress_stream(source, sink):
+    """
+    Decompress a stream written by `huffman_compress_stream`.
+
+    :param source: A bytes object, a binary file-like object, or an iterable of bytes.
+    :param sink: A text file-like object.
+    :return: The number of characters written.
+    """
+    return HuffmanStreamDecompressor().decompress_to(source, sink)
+
+
 # =====================================================================
 # TESTS
 # =====================================================================
@@ -341,6 +1690,311 @@ encoded, tree = HuffmanEncoder.encode('')
 assert encoded is None
 assert tree is None
 
+# ------------------------------
+# Test BitWriter
+# ------------------------------
+writer = BitWriter()
+assert writer.write('101') == b''
+assert writer.write('00001') == b'\xa1'
+assert writer.write('1111111100') == b'\xff'
+assert writer.flush() == b'\x00'
+assert writer.flush() == b''
+assert writer.bit_length == 18
+
+# ------------------------------
+# Test encode_packed
+# ------------------------------
+encoded, bit_length, tree = HuffmanEncoder.encode_packed('cabc')
+assert encoded == b'\x58'  # 010110, padded to 01011000
+assert bit_length == 6
+assert tree.left_child.character == 'c'
+
+encoded, bit_length, tree = HuffmanEncoder.encode_packed('')
+assert encoded == b''
+assert bit_length == 0
+assert tree is None
+
+# Long inputs no longer hit the recursion limit, and agree with the string encoding
+long_string = 'The bird is the word. ' * 5000
+encoded, bit_length, tree = HuffmanEncoder.encode_packed(long_string)
+encoded_string, _ = HuffmanEncoder.encode(long_string)
+assert bit_length == len(encoded_string)
+assert encoded == int(encoded_string.ljust(len(encoded) * 8, '0'), 2).to_bytes(len(encoded), 'big')
+
+# ------------------------------
+# Test table decoding
+# ------------------------------
+tree = HuffmanEncoder._build_tree([Node('a', 1), Node('b', 1), Node('c', 2)])
+decoder = HuffmanTableDecoder(tree, bits=2)
+assert decoder.table[0b00] == (('c', 'c'), 2, None)
+assert decoder.table[0b01] == (('c',), 1, None)
+assert decoder.table[0b10] == (('a',), 2, None)
+assert decoder.table[0b11] == (('b',), 2, None)
+
+encoded, bit_length, tree = HuffmanEncoder.encode_packed('cabc')
+for bits in (1, 2, 8, 12):
+    assert HuffmanTableDecoder(tree, bits).decode(encoded, bit_length) == 'cabc'
+
+encoded, bit_length, tree = HuffmanEncoder.encode_packed('AAAAAAAAA')
+assert HuffmanDecoder.decode_packed(encoded, bit_length, tree, bits=8) == 'AAAAAAAAA'
+
+assert HuffmanDecoder.decode_packed(b'', 0, None) == ''
+
+# Codes longer than the table width fall back to walking the tree
+skewed_string = ''.join(chr(ord('a') + i) * (2 ** i) for i in range(12))
+encoded, bit_length, tree = HuffmanEncoder.encode_packed(skewed_string)
+assert HuffmanDecoder.decode_packed(encoded, bit_length, tree, bits=4) == skewed_string
+
+# Long inputs no longer hit the recursion limit
+encoded, bit_length, tree = HuffmanEncoder.encode_packed(long_string)
+assert huffman_decoding_packed(encoded, bit_length, tree) == long_string
+assert HuffmanDecoder.decode(HuffmanEncoder.encode(long_string)[0], tree) == long_string
+
+# ------------------------------
+# Test canonical codes
+# ------------------------------
+for value in (0, 1, 127, 128, 300, 2 ** 40):
+    assert Varint.decode(Varint.encode(value)) == (value, len(Varint.encode(value)))
+assert Varint.encode(300) == b'\xac\x02'
+
+tree = HuffmanEncoder._build_tree([Node('a', 1), Node('b', 1), Node('c', 2)])
+code = CanonicalCode.from_tree(tree)
+assert code.code_lengths == {'a': 2, 'b': 2, 'c': 1}
+assert code.encoding_map == {'c': '0', 'a': '10', 'b': '11'}
+
+code = CanonicalCode({'a': 2, 'b': 1, 'c': 3, 'd': 3})
+assert code.encoding_map == {'b': '0', 'a': '10', 'c': '110', 'd': '111'}
+
+rebuilt = CanonicalCode.deserialize(code.serialize())
+assert rebuilt[0].code_lengths == code.code_lengths
+assert rebuilt[1] == len(code.serialize())
+assert HuffmanEncoder._build_character_encoding_map(code.to_tree()) == code.encoding_map
+
+assert CanonicalCode({}).to_tree() is None
+
+for string in ('cabc', 'AAAAAAAA', '', 'héllo wörld ✓', long_string):
+    assert huffman_decompress(huffman_compress(string)) == string
+
+# The header only adds a couple of bytes per distinct character
+assert len(huffman_compress('cabc')) == 2 + 3 * 2 + 1 + 1
+
+# ------------------------------
+# Test streaming
+# ------------------------------
+compressor = HuffmanStreamCompressor(block_size=4)
+assert list(compressor._blocks('abcdefghij')) == ['abcd', 'efgh', 'ij']
+assert list(compressor._blocks(['ab', 'cdefghi', 'j'])) == ['abcd', 'efgh', 'ij']
+assert list(compressor._blocks(io.StringIO('abcdefghij'))) == ['abcd', 'efgh', 'ij']
+assert list(compressor._blocks('')) == []
+
+frames = list(compressor.compress('cabcAAAA'))
+assert len(frames) == 2
+assert frames[0] == Varint.encode(len(huffman_compress('cabc'))) + huffman_compress('cabc')
+
+decompressor = HuffmanStreamDecompressor(read_size=3)
+assert list(decompressor.decompress(b''.join(frames))) == ['cabc', 'AAAA']
+
+# Frames split across arbitrary chunk boundaries
+joined = b''.join(frames)
+assert ''.join(decompressor.decompress(joined[i:i + 1] for i in range(len(joined)))) == 'cabcAAAA'
+
+compressed = io.BytesIO()
+huffman_compress_stream(io.StringIO(long_string), compressed, block_size=10000)
+compressed.seek(0)
+decompressed = io.StringIO()
+assert huffman_decompress_stream(compressed, decompressed) == len(long_string)
+assert decompressed.getvalue() == long_string
+
+try:
+    list(decompressor.decompress(joined[:-1]))
+    assert False, 'Decompressing a truncated stream should raise a ValueError'
+except ValueError:
+    assert True
+
+# ------------------------------
+# Test parallel compression
+# ------------------------------
+assert HuffmanStreamDecompressor.split(joined) == [huffman_compress('cabc'), huffman_compress('AAAA')]
+assert all(frame.obj is joined for frame in HuffmanStreamDecompressor.split(joined))
+
+# Threads keep the tests cheap; by default the codec uses a process pool
+with ThreadPoolExecutor(4) as executor:
+    codec = HuffmanParallelCodec(block_size=10000, executor=executor)
+    compressed = codec.compress(long_string)
+    assert compressed == b''.join(HuffmanStreamCompressor(10000).compress(long_string))
+    assert codec.decompress(compressed) == long_string
+    assert codec.compress('') == b''
+    assert codec.decompress(b'') == ''
+    assert codec.decompress(b'', Alphabet.BYTES) == b''
+    assert codec.decompress(b'', Alphabet.INTEGERS) == []
+
+# ------------------------------
+# Test adaptive Huffman coding
+# ------------------------------
+def assert_sibling_property(tree):
+    frequencies = [node.frequency for node in tree.nodes]
+    assert frequencies == sorted(frequencies, reverse=True)
+    assert [-f for f in tree.negated_frequencies] == frequencies
+    for index, node in enumerate(tree.nodes):
+        assert node.index == index
+        if not node.is_leaf():
+            assert node.frequency == node.left_child.frequency + node.right_child.frequency
+    for index in range(1, len(tree.nodes), 2):
+        assert tree.nodes[index].parent is tree.nodes[index + 1].parent
+
+
+tree = AdaptiveHuffmanTree(literal_bits=8)
+assert tree.code('a') == '01100001'
+for character in 'abracadabra':
+    tree.update(character)
+    assert_sibling_property(tree)
+assert tree.root.frequency == 11
+assert len(tree.code('a')) == 1
+assert tree.code('z') == tree.nyt_code() + '01111010'
+
+encoder = AdaptiveHuffmanEncoder()
+decoder = AdaptiveHuffmanDecoder()
+decoded = []
+for message in ('The bird', ' is the word', '', '. ✓ ' * 50):
+    decoded.append(decoder.decode(encoder.encode(message)))
+decoded.append(decoder.decode(encoder.flush()))
+assert ''.join(decoded) == 'The bird is the word' + '. ✓ ' * 50
+assert_sibling_property(decoder.tree)
+
+# Each message decodes in full as soon as it arrives, and the stream continues after each sync
+encoder = AdaptiveHuffmanEncoder(literal_bits=8)
+decoder = AdaptiveHuffmanDecoder(literal_bits=8)
+for message in ('a', 'abracadabra', '', 'bird', 'z', 'abracadabra' * 3, 'q'):
+    encoded = encoder.encode(message) + encoder.sync()
+    assert decoder.decode(encoded) == message
+    assert decoder.node is decoder.tree.root and decoder.literal is None
+assert decoder.decode(encoder.encode('ab') + encoder.flush()) == 'ab'
+
+# The sync literal is reserved. A rejected string encodes nothing, so the stream stays decodable.
+encoder = AdaptiveHuffmanEncoder(literal_bits=8)
+decoder = AdaptiveHuffmanDecoder(literal_bits=8)
+encoded = encoder.encode('xy')
+try:
+    encoder.encode('ab' + chr(255))
+    assert False, 'Encoding a character which does not fit in literal_bits should raise a ValueError'
+except ValueError:
+    assert True
+encoded += encoder.encode('hello abc') + encoder.sync()
+assert decoder.decode(encoded) == 'xyhello abc'
+
+# The padding never decodes to a character, whatever the length of the NYT code
+for string in ('a', 'ab', 'abcde', 'aaaaaaa', 'abcdefghijklmnopqrstuvwxyz'):
+    encoder = AdaptiveHuffmanEncoder(literal_bits=8)
+    encoded = encoder.encode(string) + encoder.flush()
+    assert AdaptiveHuffmanDecoder(literal_bits=8).decode(encoded) == string
+
+encoder = AdaptiveHuffmanEncoder()
+encoded = encoder.encode(long_string) + encoder.flush()
+assert len(encoded) < len(long_string)
+assert AdaptiveHuffmanDecoder().decode(encoded) == long_string
+
+# ------------------------------
+# Test escaped table decoding
+# ------------------------------
+tree = CanonicalCode({'': 2, 'a': 1, 'b': 2}).to_tree()  # a=0, ''=10, b=11
+decoder = HuffmanTableDecoder(tree, bits=4, escape='', literal_bits=8)
+assert decoder.table[0b0010][:2] == (('a', 'a'), 4)
+assert decoder.tree.symbols[decoder.table[0b0010][2]] == Alphabet.ESCAPE
+assert decoder.table[0b0111] == (('a', 'b'), 3, None)
+assert decoder.decode(b'\x2c\x3e', 16) == 'aa' + chr(0b11000011) + 'b'  # 0 0 10 11000011 11 10
+assert decoder.decode(b'\x2c', 8) == 'aa'  # The literal is incomplete
+
+# ------------------------------
+# Test HuffmanModel
+# ------------------------------
+model = HuffmanModel.train(['The bird is the word', 'the word is the bird'])
+assert model.code.code_lengths[HuffmanModel.ESCAPE] > 0
+assert 'z' not in model.code.code_lengths
+
+for message in ('', 'the bird', 'The word is heard', 'zebra ✓', 'T', long_string):
+    assert model.decode(model.encode(message)) == message
+
+# Messages are self-delimiting: the padding never decodes to a character
+for length in range(1, 12):
+    assert model.decode(model.encode('b' * length)) == 'b' * length
+
+# Known characters cost a handful of bits; unknown ones cost an escape and a literal
+assert len(model.encode('the bird')) < len('the bird')
+assert len(model.encode('z')) * 8 >= len(model.escape_code) + 21
+
+rebuilt = HuffmanModel.deserialize(model.serialize())
+assert rebuilt.code.encoding_map == model.code.encoding_map
+assert rebuilt.decode(model.encode('The word is heard')) == 'The word is heard'
+
+# A model trained on nothing escapes everything
+model = HuffmanModel.train([], literal_bits=8)
+assert model.decode(model.encode('abc')) == 'abc'
+
+# ------------------------------
+# Test bytes and integer symbols
+# ------------------------------
+# A falsy symbol is still a leaf
+tree = HuffmanEncoder._build_tree([Node(0, 1), Node(1, 1), Node(2, 2)])
+assert HuffmanEncoder._build_character_encoding_map(tree) == {2: '0', 0: '10', 1: '11'}
+assert HuffmanDecoder.decode_character('101', tree) == (0, ['1'])
+
+binary = bytes(range(256)) + b'\x00' * 300 + b'\xff\x00'
+encoded, bit_length, tree = HuffmanEncoder.encode_packed(binary)
+assert HuffmanDecoder.decode_packed(encoded, bit_length, tree, kind=Alphabet.BYTES) == binary
+assert HuffmanDecoder.decode(HuffmanEncoder.encode(binary)[0], tree, Alphabet.BYTES) == binary
+
+tokens = [0, 5, 0, 70000, 0, 5, 2 ** 40]
+encoded, bit_length, tree = HuffmanEncoder.encode_packed(tokens)
+assert HuffmanDecoder.decode_packed(encoded, bit_length, tree, kind=Alphabet.INTEGERS) == tokens
+
+for data in (binary, b'', b'\x00', bytearray(b'abc'), tokens, [], [0]):
+    assert huffman_decompress(huffman_compress(data)) == data
+
+assert type(huffman_decompress(huffman_compress(b''))) is bytes
+assert huffman_decompress(huffman_compress([])) == []
+
+try:
+    huffman_compress([-1, 2])
+    assert False, 'Compressing a negative symbol should raise a ValueError'
+except ValueError:
+    assert True
+
+# Array-backed trees produce the same code lengths as linked Nodes
+frequency_map = HuffmanEncoder._build_frequency_map(long_string)
+array_tree = ArrayHuffmanTree.from_frequencies(frequency_map)
+assert array_tree.code_lengths() == CanonicalCode.from_tree(HuffmanEncoder._build_tree_for(long_string)).code_lengths
+assert len(array_tree.left) == 2 * len(frequency_map) - 1
+assert array_tree.symbols.typecode == 'q'
+assert array_tree.left[array_tree.root] >= 0
+assert ArrayHuffmanTree.from_frequencies({}) is None
+assert ArrayHuffmanTree.from_frequencies({0: 3}, Alphabet.INTEGERS).code_lengths() == {0: 1}
+
+code = CanonicalCode({0: 1, 1: 2, 2: 2}, Alphabet.INTEGERS)
+assert ArrayHuffmanTree.from_node(code.to_tree(), Alphabet.INTEGERS).code_lengths() == code.code_lengths
+assert code.to_array_tree().code_lengths() == code.code_lengths
+
+# Integer symbols must fit the signed 64-bit symbol array
+assert ArrayHuffmanTree.from_frequencies({ArrayHuffmanTree.MAX_SYMBOL: 1, 0: 1}, Alphabet.INTEGERS).code_lengths() == \
+    {ArrayHuffmanTree.MAX_SYMBOL: 1, 0: 1}
+try:
+    ArrayHuffmanTree.from_frequencies({2 ** 63: 1, 0: 1}, Alphabet.INTEGERS)
+    assert False, 'A symbol beyond MAX_SYMBOL should raise a ValueError'
+except ValueError:
+    assert True
+
+assert Alphabet.concatenate([b'ab', b'c']) == b'abc'
+assert Alphabet.concatenate([], Alphabet.BYTES) == b''
+assert Alphabet.concatenate([], Alphabet.INTEGERS) == []
+
+# Streams of bytes
+compressed = io.BytesIO()
+huffman_compress_stream(io.BytesIO(binary), compressed, block_size=100)
+compressed.seek(0)
+decompressed = io.BytesIO()
+assert huffman_decompress_stream(compressed, decompressed) == len(binary)
+assert decompressed.getvalue() == binary
+assert ''.join(HuffmanStreamDecompressor().decompress(b'')) == ''
+
 # =====================================================================
 
 if __name__ == "__main__":
@@ -360,3 +2014,9 @@ if __name__ == "__main__":
 
     print("The size of the decoded data is: {}\n".format(sys.getsizeof(decoded_data)))
     print("The content of the encoded data is: {}\n".format(decoded_data))
+
+    codec = HuffmanParallelCodec(block_size=len(a_great_sentence) * 1000)
+    compressed = codec.compress(a_great_sentence * 10000)
+    assert codec.decompress(compressed) == a_great_sentence * 10000
+
+    print("The size of the data compressed in parallel is: {}\n".format(len(compressed)))
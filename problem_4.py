@@ -1,14 +1,24 @@
+from array import array
+import csv
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+
 class Group(object):
     def __init__(self, _name):
         self.name = _name
         self.groups = []
-        self.users = []
+        self.users = set()
 
     def add_group(self, group):
         self.groups.append(group)
 
     def add_user(self, user):
-        self.users.append(user)
+        self.users.add(user)
 
     def get_groups(self):
         return self.groups
@@ -24,19 +34,559 @@ def is_user_in_group(user, group):
     """
     Return True if user is in the group, False otherwise.
 
+    The hierarchy is walked iteratively, and each group is visited once, so cycles and shared subgroups are safe.
+
     Args:
       user(str): user name/id
       group(class:Group): group to check user membership against
     """
     if not isinstance(group, Group):
         return False
-    if user in group.get_users():
-        return True
-    if not group.get_groups():
+    if isinstance(group, CompactGroup):
+        return group.directory.is_user_in_group(user, group.get_name())
+
+    visited = {group}
+    groups = [group]
+
+    while groups:
+        group = groups.pop()
+        if user in group.get_users():
+            return True
+
+        for subgroup in group.get_groups():
+            if subgroup not in visited:
+                visited.add(subgroup)
+                groups.append(subgroup)
+
+    return False
+
+
+class Directory(object):
+    """
+    A hierarchy of groups, identified by name, indexed for membership queries.
+
+    Each group's users and subgroups are held in sets, along with the reverse indexes: the groups each user directly
+    belongs to, and the parents of each group. A membership query walks upwards from the user's own groups, so it only
+    visits the groups above the user, rather than every group beneath the one queried.
+    """
+
+    def __init__(self):
+        # Users and subgroups, by group
+        self.users = {}
+        self.subgroups = {}
+        # Groups directly containing each user, and parents of each group
+        self.memberships = {}
+        self.parents = {}
+
+    @classmethod
+    def from_group(cls, group):
+        """
+        Build a directory from a hierarchy of Groups. Group names are assumed to be unique.
+
+        Args:
+          group(class:Group): the root of the hierarchy
+        """
+        directory = cls()
+        directory.add_group_name(group.get_name())
+
+        visited = {group}
+        groups = [group]
+        while groups:
+            group = groups.pop()
+            for user in group.get_users():
+                directory.add_user(group.get_name(), user)
+            for subgroup in group.get_groups():
+                directory.add_group(group.get_name(), subgroup.get_name())
+                if subgroup not in visited:
+                    visited.add(subgroup)
+                    groups.append(subgroup)
+
+        return directory
+
+    def add_group_name(self, group):
+        """Add a group, with no users or subgroups"""
+        if group not in self.users:
+            self.users[group] = set()
+            self.subgroups[group] = set()
+            self.parents[group] = set()
+
+    def add_group(self, parent, group):
+        """Add a group to a parent group, adding either if they are new"""
+        self.add_group_name(parent)
+        self.add_group_name(group)
+        self.subgroups[parent].add(group)
+        self.parents[group].add(parent)
+
+    def add_user(self, group, user):
+        """Add a user to a group, adding the group if it is new"""
+        self.add_group_name(group)
+        self.users[group].add(user)
+        self.memberships.setdefault(user, set()).add(group)
+
+    def remove_group(self, parent, group):
+        """Remove a group from a parent group. Both groups remain in the directory."""
+        self.subgroups[parent].discard(group)
+        self.parents[group].discard(parent)
+
+    def remove_user(self, group, user):
+        """Remove a user from a group"""
+        self.users[group].discard(user)
+        groups = self.memberships.get(user)
+        if groups is not None:
+            groups.discard(group)
+            if not groups:
+                del self.memberships[user]
+
+    def is_user_in_group(self, user, group):
+        """
+        Return True if user is in the group, or any of its subgroups, False otherwise.
+
+        Args:
+          user(str): user name/id
+          group(str): name of the group to check user membership against
+        """
+        groups = self.memberships.get(user)
+        if not groups or group not in self.users:
+            return False
+        if group in groups:
+            return True
+
+        visited = set(groups)
+        pending = list(groups)
+        parents = self.parents
+
+        while pending:
+            for parent in parents[pending.pop()]:
+                if parent == group:
+                    return True
+                if parent not in visited:
+                    visited.add(parent)
+                    pending.append(parent)
+
         return False
 
-    for group in group.get_groups():
-        return is_user_in_group(user, group)
+
+class ClosureDirectory(Directory):
+    """
+    A Directory which also maintains the transitive closure of its memberships: every group each user belongs to,
+    directly or through subgroups. A membership query is then a single set lookup.
+
+    The closure is maintained incrementally. Adding a user adds its group's ancestors to the user's closure; adding a
+    subgroup adds the parent's ancestors to every group beneath the subgroup, and to their users. Removals recompute
+    only the affected groups and users.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # All groups containing each group (including itself), and all groups containing each user
+        self.ancestors = {}
+        self.closure = {}
+
+    def add_group_name(self, group):
+        """Add a group, with no users or subgroups"""
+        if group not in self.users:
+            super().add_group_name(group)
+            self.ancestors[group] = {group}
+
+    def _descendants(self, group):
+        """Return the given group, and every group beneath it"""
+        descendants = {group}
+        pending = [group]
+        while pending:
+            for subgroup in self.subgroups[pending.pop()]:
+                if subgroup not in descendants:
+                    descendants.add(subgroup)
+                    pending.append(subgroup)
+        return descendants
+
+    def _users_of(self, groups):
+        """Return every user directly in any of the given groups"""
+        users = set()
+        for group in groups:
+            users.update(self.users[group])
+        return users
+
+    def _recompute_user(self, user):
+        """Recompute the closure of a user from the ancestors of its groups"""
+        groups = self.memberships.get(user)
+        if groups is None:
+            self.closure.pop(user, None)
+            return
+        closure = set()
+        for group in groups:
+            closure.update(self.ancestors[group])
+        self.closure[user] = closure
+
+    def add_group(self, parent, group):
+        """Add a group to a parent group, adding either if they are new"""
+        super().add_group(parent, group)
+
+        # Copied, since the parent is among the descendants if this closes a cycle.
+        added = set(self.ancestors[parent])
+        descendants = self._descendants(group)
+        for descendant in descendants:
+            self.ancestors[descendant].update(added)
+        for user in self._users_of(descendants):
+            self.closure[user].update(added)
+
+    def add_user(self, group, user):
+        """Add a user to a group, adding the group if it is new"""
+        super().add_user(group, user)
+        self.closure.setdefault(user, set()).update(self.ancestors[group])
+
+    def remove_group(self, parent, group):
+        """Remove a group from a parent group. Both groups remain in the directory."""
+        super().remove_group(parent, group)
+
+        descendants = self._descendants(group)
+        for descendant in descendants:
+            ancestors = {descendant}
+            pending = [descendant]
+            while pending:
+                for ancestor in self.parents[pending.pop()]:
+                    if ancestor not in ancestors:
+                        ancestors.add(ancestor)
+                        pending.append(ancestor)
+            self.ancestors[descendant] = ancestors
+        for user in self._users_of(descendants):
+            self._recompute_user(user)
+
+    def remove_user(self, group, user):
+        """Remove a user from a group"""
+        super().remove_user(group, user)
+        self._recompute_user(user)
+
+    def is_user_in_group(self, user, group):
+        """
+        Return True if user is in the group, or any of its subgroups, False otherwise.
+
+        Args:
+          user(str): user name/id
+          group(str): name of the group to check user membership against
+        """
+        closure = self.closure.get(user)
+        return closure is not None and group in closure
+
+    def memory(self):
+        """
+        Report the size of the closure.
+
+        Returns:
+           a dict of the number of (user, group) and (group, ancestor) entries, and the bytes used by their sets
+        """
+        return {
+            'closure_entries': sum(map(len, self.closure.values())),
+            'ancestor_entries': sum(map(len, self.ancestors.values())),
+            'bytes': sum(map(sys.getsizeof, self.closure.values())) + sum(map(sys.getsizeof, self.ancestors.values())),
+        }
+
+
+class CompactGroup(Group):
+    """
+    A read-only view of a group in a CompactDirectory, with the Group API.
+    """
+
+    def __init__(self, directory, group_id):
+        self.directory = directory
+        self.group_id = group_id
+        self.name = directory.group_names[group_id]
+
+    def add_group(self, group):
+        raise TypeError('Groups in a CompactDirectory are read-only')
+
+    def add_user(self, user):
+        raise TypeError('Groups in a CompactDirectory are read-only')
+
+    def get_groups(self):
+        return [CompactGroup(self.directory, group_id) for group_id in self.directory.subgroups_of(self.group_id)]
+
+    def get_users(self):
+        return {self.directory.user_names[user_id] for user_id in self.directory.users_of(self.group_id)}
+
+
+class CompactDirectory(object):
+    """
+    A read-only hierarchy of groups, held in flat arrays.
+
+    User and group names are interned to consecutive integer IDs. Each relation (group to subgroups, group to parents,
+    group to users, and user to groups) is held in compressed sparse row (CSR) form: the targets of every ID's edges
+    are stored contiguously in one array, and an array of offsets gives where each ID's edges begin and end. That
+    takes 4 bytes per edge and 8 per ID, rather than a set per group and user.
+    """
+
+    def __init__(self, group_edges=(), user_edges=()):
+        """
+        Args:
+          group_edges(iterable): (parent, subgroup) pairs of group names
+          user_edges(iterable): (group, user) pairs of group and user names
+        """
+        self.group_ids = {}
+        self.group_names = []
+        self.user_ids = {}
+        self.user_names = []
+
+        parents, subgroups = array('i'), array('i')
+        for parent, group in group_edges:
+            parents.append(self._intern(self.group_ids, self.group_names, parent))
+            subgroups.append(self._intern(self.group_ids, self.group_names, group))
+
+        groups, users = array('i'), array('i')
+        for group, user in user_edges:
+            groups.append(self._intern(self.group_ids, self.group_names, group))
+            users.append(self._intern(self.user_ids, self.user_names, user))
+
+        group_count, user_count = len(self.group_names), len(self.user_names)
+        self.subgroup_offsets, self.subgroup_targets = self._compress(group_count, parents, subgroups)
+        self.parent_offsets, self.parent_targets = self._compress(group_count, subgroups, parents)
+        self.user_offsets, self.user_targets = self._compress(group_count, groups, users)
+        self.membership_offsets, self.membership_targets = self._compress(user_count, users, groups)
+
+    @staticmethod
+    def _intern(ids, names, name):
+        """Return the ID of a name, assigning the next ID if it is new"""
+        identifier = ids.get(name)
+        if identifier is None:
+            identifier = ids[name] = len(names)
+            names.append(name)
+        return identifier
+
+    @staticmethod
+    def _compress(count, sources, targets):
+        """
+        Build the CSR form of a relation, by counting sort.
+
+        Args:
+          count(int): the number of source IDs
+          sources(array): the source ID of each edge
+          targets(array): the target ID of each edge
+
+        Returns:
+           the offsets (of length count + 1), and the targets ordered by source
+        """
+        offsets = array('q', bytes(8 * (count + 1)))
+        for source in sources:
+            offsets[source + 1] += 1
+        for index in range(count):
+            offsets[index + 1] += offsets[index]
+
+        positions = offsets[:-1]
+        ordered = array('i', bytes(4 * len(targets)))
+        for source, target in zip(sources, targets):
+            ordered[positions[source]] = target
+            positions[source] += 1
+
+        return offsets, ordered
+
+    @classmethod
+    def from_csv(cls, path):
+        """
+        Load a directory from a CSV edge list, with a header row of: group, member, kind.
+
+        Each row adds a member to a group, where kind is 'group' if the member is a subgroup, or 'user' if it is a
+        user. Any other kind raises a ValueError.
+
+        Args:
+          path(str): path of the CSV file
+        """
+        group_edges, user_edges = [], []
+        with open(path, newline='') as file:
+            for row in csv.DictReader(file):
+                if row['kind'] == 'group':
+                    group_edges.append((row['group'], row['member']))
+                elif row['kind'] == 'user':
+                    user_edges.append((row['group'], row['member']))
+                else:
+                    raise ValueError('Unknown kind of member {!r} in {}'.format(row['kind'], path))
+        return cls(group_edges, user_edges)
+
+    @classmethod
+    def from_json(cls, path):
+        """
+        Load a directory from a JSON edge list: an object of "groups", a list of [parent, subgroup] pairs, and
+        "users", a list of [group, user] pairs.
+
+        Args:
+          path(str): path of the JSON file
+        """
+        with open(path) as file:
+            edges = json.load(file)
+        return cls(edges.get('groups', ()), edges.get('users', ()))
+
+    def subgroups_of(self, group_id):
+        """Return the IDs of a group's subgroups"""
+        return self.subgroup_targets[self.subgroup_offsets[group_id]:self.subgroup_offsets[group_id + 1]]
+
+    def users_of(self, group_id):
+        """Return the IDs of a group's users"""
+        return self.user_targets[self.user_offsets[group_id]:self.user_offsets[group_id + 1]]
+
+    def group(self, name):
+        """Return a Group view of the named group, or None if there is no such group"""
+        group_id = self.group_ids.get(name)
+        return None if group_id is None else CompactGroup(self, group_id)
+
+    def _mark_ancestors(self, user_id, marks, stamp):
+        """Set the mark of every group containing a user, directly or through subgroups, to the stamp"""
+        parent_offsets, parent_targets = self.parent_offsets, self.parent_targets
+        pending = list(self.membership_targets[self.membership_offsets[user_id]:self.membership_offsets[user_id + 1]])
+        for group_id in pending:
+            marks[group_id] = stamp
+
+        while pending:
+            group_id = pending.pop()
+            for parent_id in parent_targets[parent_offsets[group_id]:parent_offsets[group_id + 1]]:
+                if marks[parent_id] != stamp:
+                    marks[parent_id] = stamp
+                    pending.append(parent_id)
+
+    def is_user_in_group(self, user, group):
+        """
+        Return True if user is in the group, or any of its subgroups, False otherwise.
+
+        Args:
+          user(str): user name/id
+          group(str): name of the group to check user membership against
+        """
+        user_id, target_id = self.user_ids.get(user), self.group_ids.get(group)
+        if user_id is None or target_id is None:
+            return False
+
+        parent_offsets, parent_targets = self.parent_offsets, self.parent_targets
+        pending = list(self.membership_targets[self.membership_offsets[user_id]:self.membership_offsets[user_id + 1]])
+        visited = set(pending)
+        if target_id in visited:
+            return True
+
+        while pending:
+            group_id = pending.pop()
+            for parent_id in parent_targets[parent_offsets[group_id]:parent_offsets[group_id + 1]]:
+                if parent_id == target_id:
+                    return True
+                if parent_id not in visited:
+                    visited.add(parent_id)
+                    pending.append(parent_id)
+
+        return False
+
+    def users_in_groups(self, pairs):
+        """
+        Answer many membership queries in one pass.
+
+        Queries are grouped by user, and the groups containing each distinct user are marked once, by walking
+        upwards; every query for that user is then a single array lookup.
+
+        Args:
+          pairs(iterable): (user, group) pairs
+
+        Returns:
+           a list of booleans, one for each pair, in order
+        """
+        pairs = list(pairs)
+        results = [False] * len(pairs)
+
+        queries = {}
+        for index, (user, _) in enumerate(pairs):
+            queries.setdefault(user, []).append(index)
+
+        # The stamp of the last user whose ancestors marked each group. Stamps start at 1, so no group starts marked.
+        marks = array('q', bytes(8 * len(self.group_names)))
+        group_ids = self.group_ids
+
+        for stamp, (user, indexes) in enumerate(queries.items(), 1):
+            user_id = self.user_ids.get(user)
+            if user_id is None:
+                continue
+            self._mark_ancestors(user_id, marks, stamp)
+            for index in indexes:
+                group_id = group_ids.get(pairs[index][1])
+                results[index] = group_id is not None and marks[group_id] == stamp
+
+        return results
+
+    def memory(self):
+        """
+        Report the size of the arrays.
+
+        Returns:
+           a dict of the number of groups, users, and edges, and the bytes used by the arrays
+        """
+        arrays = (self.subgroup_offsets, self.subgroup_targets, self.parent_offsets, self.parent_targets,
+                  self.user_offsets, self.user_targets, self.membership_offsets, self.membership_targets)
+        return {
+            'groups': len(self.group_names),
+            'users': len(self.user_names),
+            'edges': len(self.subgroup_targets) + len(self.user_targets),
+            'bytes': sum(map(sys.getsizeof, arrays)),
+        }
+
+
+def generate_directory(group_count, membership_count, user_count, fanout=8, seed=0, directory_class=Directory):
+    """
+    Generate a random hierarchy of groups for benchmarks.
+
+    Groups are numbered; each group after the first has a random parent among the groups before it, and a fanout
+    limits the number of children of each group, so the hierarchy is a tree of roughly log(group_count, fanout) levels.
+
+    Args:
+      group_count(int): the number of groups
+      membership_count(int): the number of (user, group) memberships
+      user_count(int): the number of distinct users
+      fanout(int): the maximum number of subgroups per group
+      seed(int): the random seed
+      directory_class(type): Directory, or a subclass of it
+
+    Returns:
+       a Directory
+    """
+    generator = random.Random(seed)
+    directory = directory_class()
+    directory.add_group_name(0)
+
+    for group in range(1, group_count):
+        directory.add_group((group - 1) // fanout, group)
+    for _ in range(membership_count):
+        directory.add_user(generator.randrange(group_count), generator.randrange(user_count))
+
+    return directory
+
+
+def generate_queries(user_count, group_count, queries, seed=0):
+    """
+    Generate random membership queries for benchmarks, against a directory from generate_directory.
+
+    Args:
+      user_count(int): the number of distinct users
+      group_count(int): the number of groups
+      queries(int): the number of queries
+      seed(int): the random seed
+
+    Returns:
+       a list of (user, group) pairs
+    """
+    generator = random.Random(seed)
+    return [(generator.randrange(user_count), generator.randrange(group_count)) for _ in range(queries)]
+
+
+def benchmark(directory, pairs, batch=False):
+    """
+    Time membership queries.
+
+    Args:
+      directory(class:Directory): the directory to query
+      pairs(list): (user, group) pairs
+      batch(bool): whether to answer the queries with a single call to users_in_groups
+
+    Returns:
+       a dict of the queries per second, and the proportion of queries answered True
+    """
+    start = time.perf_counter()
+    if batch:
+        found = sum(directory.users_in_groups(pairs))
+    else:
+        found = sum(directory.is_user_in_group(user, group) for user, group in pairs)
+    elapsed = time.perf_counter() - start
+
+    return {'queries_per_second': len(pairs) / elapsed, 'found': found / len(pairs)}
 
 
 parent = Group("parent")
@@ -66,3 +616,159 @@ assert not is_user_in_group('jane', company)
 
 # Non-existent group
 assert not is_user_in_group('john', None)
+
+# Users in a group's later subgroups are found too
+sales = Group('sales')
+sales.add_user('jane')
+company.add_group(sales)
+assert is_user_in_group('jane', company)
+assert is_user_in_group(sub_child_user, parent)
+
+# Cycles and shared subgroups are safe
+sales.add_group(company)
+department.add_group(sales)
+assert is_user_in_group('jane', sales)
+assert not is_user_in_group('nobody', company)
+
+# A directory answers the same queries
+directory = Directory.from_group(company)
+assert directory.is_user_in_group('john', 'root')
+assert directory.is_user_in_group('jane', 'root')
+assert directory.is_user_in_group('john', 'sales')
+assert not directory.is_user_in_group('nobody', 'root')
+assert not directory.is_user_in_group('john', 'nope')
+
+directory = Directory.from_group(parent)
+assert directory.is_user_in_group(sub_child_user, 'parent')
+assert directory.is_user_in_group(sub_child_user, 'subchild')
+assert not directory.is_user_in_group(sub_child_user, 'nope')
+assert directory.memberships == {sub_child_user: {'subchild'}}
+assert directory.parents['subchild'] == {'child'}
+
+# A generated directory agrees with a walk down from each group
+directory = generate_directory(200, 1000, 50, fanout=3)
+for user in range(50):
+    for group in range(0, 200, 7):
+        beneath = {group}
+        pending = [group]
+        while pending:
+            for subgroup in directory.subgroups[pending.pop()]:
+                beneath.add(subgroup)
+                pending.append(subgroup)
+        expected = any(user in directory.users[member] for member in beneath)
+        assert directory.is_user_in_group(user, group) == expected
+assert 0 < benchmark(directory, generate_queries(50, 200, 100))['found'] < 1
+
+
+# A closure directory answers queries with a single lookup, and agrees with a walk through the hierarchy as groups and
+# users are added and removed, including cycles
+generator = random.Random(1)
+walked = Directory()
+closure = ClosureDirectory()
+for step in range(2000):
+    group, other, user = generator.randrange(30), generator.randrange(30), generator.randrange(20)
+    operation = generator.choice(('add_group', 'add_user', 'add_user', 'remove_group', 'remove_user'))
+    if operation == 'add_group' and group != other:
+        walked.add_group(group, other)
+        closure.add_group(group, other)
+    elif operation == 'add_user':
+        walked.add_user(group, user)
+        closure.add_user(group, user)
+    elif operation == 'remove_group' and group in closure.users and other in closure.users:
+        walked.remove_group(group, other)
+        closure.remove_group(group, other)
+    elif operation == 'remove_user' and group in closure.users:
+        walked.remove_user(group, user)
+        closure.remove_user(group, user)
+    if step % 50 == 0:
+        for user in range(20):
+            for group in range(30):
+                assert closure.is_user_in_group(user, group) == walked.is_user_in_group(user, group)
+
+closure = ClosureDirectory.from_group(company)
+assert closure.is_user_in_group('john', 'root')
+assert closure.is_user_in_group('jane', 'marketing')
+assert not closure.is_user_in_group('nobody', 'root')
+assert closure.closure['john'] == {'root', 'marketing', 'sales'}
+assert closure.memory()['closure_entries'] == 6
+
+# A compact directory answers the same queries as the Directory it was built from, one at a time or in a batch
+directory = generate_directory(300, 2000, 100, fanout=4, seed=2)
+directory.add_group(250, 3)  # A cycle
+compact = CompactDirectory(((parent, group) for parent, groups in directory.subgroups.items() for group in groups),
+                           ((group, user) for group, users in directory.users.items() for user in users))
+pairs = [(user, group) for user in range(0, 110, 3) for group in range(0, 310, 7)]
+expected = [directory.is_user_in_group(user, group) for user, group in pairs]
+assert compact.users_in_groups(pairs) == expected
+assert [compact.is_user_in_group(user, group) for user, group in pairs] == expected
+assert any(expected) and not all(expected)
+assert compact.memory()['groups'] == 300
+
+# Edge lists are loaded from CSV and JSON files
+edges_directory = tempfile.mkdtemp()
+csv_path = os.path.join(edges_directory, 'edges.csv')
+with open(csv_path, 'w', newline='') as file:
+    file.write('group,member,kind\nroot,marketing,group\nmarketing,john,user\nroot,jane,user\n')
+json_path = os.path.join(edges_directory, 'edges.json')
+with open(json_path, 'w') as file:
+    json.dump({'groups': [['root', 'marketing']], 'users': [['marketing', 'john'], ['root', 'jane']]}, file)
+
+for compact in (CompactDirectory.from_csv(csv_path), CompactDirectory.from_json(json_path)):
+    assert compact.users_in_groups([('john', 'root'), ('jane', 'marketing'), ('jane', 'root'), ('x', 'root'),
+                                    ('john', 'nope')]) == [True, False, True, False, False]
+
+    # The Group API is a facade over the arrays
+    root = compact.group('root')
+    assert isinstance(root, Group)
+    assert root.get_users() == {'jane'}
+    assert [group.get_name() for group in root.get_groups()] == ['marketing']
+    assert is_user_in_group('john', root)
+    assert not is_user_in_group('john', compact.group('nope'))
+    try:
+        root.add_user('x')
+        assert False, 'A CompactGroup should be read-only'
+    except TypeError:
+        assert True
+
+# A row of an unknown kind is rejected, rather than taken as a user
+with open(csv_path, 'w', newline='') as file:
+    file.write('group,member,kind\nroot,marketing,grop\n')
+try:
+    CompactDirectory.from_csv(csv_path)
+    assert False, 'A row of an unknown kind should raise a ValueError'
+except ValueError:
+    assert True
+
+os.remove(csv_path)
+os.remove(json_path)
+os.rmdir(edges_directory)
+
+if __name__ == "__main__":
+    group_count, membership_count = (int(argument) for argument in sys.argv[1:3]) if len(sys.argv) > 2 \
+        else (100000, 1000000)
+    pairs = generate_queries(membership_count // 10, group_count, 100000)
+
+    for directory_class in (Directory, ClosureDirectory):
+        start = time.perf_counter()
+        directory = generate_directory(group_count, membership_count, membership_count // 10,
+                                       directory_class=directory_class)
+        print('{}: generated {} groups and {} memberships in {:.1f}s'.format(
+            directory_class.__name__, group_count, membership_count, time.perf_counter() - start))
+        print(benchmark(directory, pairs))
+        if isinstance(directory, ClosureDirectory):
+            print(directory.memory())
+            continue
+
+        compact = CompactDirectory(
+            ((parent, group) for parent, groups in directory.subgroups.items() for group in groups),
+            ((group, user) for group, users in directory.users.items() for user in users))
+        del directory
+        print('CompactDirectory:', compact.memory())
+        print(benchmark(compact, pairs))
+        print('Batch:', benchmark(compact, pairs, batch=True))
+
+        # Batches pay off when many queries share a user: 10,000 queries about only 1,000 users.
+        repeated_pairs = generate_queries(1000, group_count, 10000)
+        print('Repeated users:', benchmark(compact, repeated_pairs))
+        print('Repeated users, batch:', benchmark(compact, repeated_pairs, batch=True))
+        del compact
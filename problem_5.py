@@ -1,4 +1,12 @@
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import hashlib
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
 import time
 
 
@@ -9,19 +17,46 @@ class Node(object):
 
 
 class Blockchain(object):
-    def __init__(self):
+    """
+    A linked list of blocks, indexed by hash, by height, and by timestamp.
+
+    The indexes are maintained by `append`: a dict maps each hash to its node, and lists of the blocks and of their
+    timestamps are ordered by height. Timestamps never decrease along the chain, so the timestamp list is sorted, and
+    can be searched by bisection.
+    """
+
+    def __init__(self, clock=time.time):
+        """
+        :param clock: A function which returns the current time, as a timestamp.
+        """
         self.head = None
         self.tail = None
+        self.clock = clock
+
+        self.nodes_by_hash = {}
+        self.blocks = []
+        self.timestamps = []
+
+        # The number of blocks, from the first, known to be valid
+        self.verified_height = 0
+
+    def __len__(self):
+        return len(self.blocks)
 
     def append(self, block_data):
         """
         Add a new block containing the given data to the blockchain.
 
+        The block's timestamp is the current time, or the previous block's timestamp if the clock has gone backwards.
+
         :param block_data: The block data.
         :return: None
         """
         previous_hash = None if self.tail is None else self.tail.block.hash
-        node = Node(Block(time.time(), block_data, previous_hash))
+        timestamp = self.clock()
+        if self.timestamps and timestamp < self.timestamps[-1]:
+            timestamp = self.timestamps[-1]
+        node = Node(Block(timestamp, block_data, previous_hash))
 
         if self.tail is None:
             self.head = node
@@ -30,6 +65,10 @@ class Blockchain(object):
             self.tail.next = node
             self.tail = self.tail.next
 
+        self.nodes_by_hash[node.block.hash] = node
+        self.blocks.append(node.block)
+        self.timestamps.append(timestamp)
+
     def search(self, target_hash):
         """
         Search the blockchain for a block identifed by the given hash.
@@ -37,14 +76,45 @@ class Blockchain(object):
         :param target_hash: The hash we're searching for.
         :return: The block data, or None if no matching block is found.
         """
-        def recurse(current_node):
-            if current_node is None:
-                return None
-            if current_node.block.hash == target_hash:
-                return current_node.block.data
-            return recurse(current_node.next)
+        node = self.nodes_by_hash.get(target_hash)
+        return None if node is None else node.block.data
+
+    def block_at(self, height):
+        """
+        Return the block at the given height: 0 for the first block, or negative to count back from the last.
+
+        :param height: The height.
+        :return: The Block, or None if there is no block at that height.
+        """
+        try:
+            return self.blocks[height]
+        except IndexError:
+            return None
+
+    def blocks_between(self, start, end):
+        """
+        Return the blocks with timestamps between start and end, inclusive.
+
+        :param start: The earliest timestamp.
+        :param end: The latest timestamp.
+        :return: A list of Blocks, in order.
+        """
+        return self.blocks[bisect_left(self.timestamps, start):bisect_right(self.timestamps, end)]
+
+    def verify(self, verifier=None, incremental=False):
+        """
+        Verify that every block's hash is right, and links to the hash of its predecessor.
+
+        :param verifier: A ChainVerifier. Defaults to one with a new process pool.
+        :param incremental: Whether to verify only the blocks appended since the last verification.
+        :return: The height of the first invalid block, or None if every block is valid.
+        """
+        start = self.verified_height if incremental else 0
+        previous_hash = None if start == 0 else self.blocks[start - 1].hash
 
-        return recurse(self.head)
+        failure = (verifier or ChainVerifier()).verify(self.blocks[start:], start, previous_hash)
+        self.verified_height = len(self.blocks) if failure is None else failure
+        return failure
 
 
 class Block(object):
@@ -54,6 +124,20 @@ class Block(object):
         self.previous_hash = previous_hash
         self.hash = self._calculate_hash()
 
+    @classmethod
+    def restore(cls, timestamp, data, previous_hash, block_hash):
+        """
+        Recreate a stored block, without recalculating its hash.
+
+        :return: Block
+        """
+        block = cls.__new__(cls)
+        block.timestamp = timestamp
+        block.data = data
+        block.previous_hash = previous_hash
+        block.hash = block_hash
+        return block
+
     def _calculate_hash(self):
         """
         Calculate the hash of this Block instance.
@@ -67,6 +151,494 @@ class Block(object):
         return sha.hexdigest()
 
 
+class BlockStore(object):
+    """
+    An append-only, on-disk blockchain.
+
+    Blocks are stored in a segment file, each as a fixed header (height, timestamp, and the binary SHA-256 digests of
+    the previous block and of the block itself) followed by its UTF-8 data, prefixed by its length. Two sidecar files
+    index the segment:
+
+    * `<path>.offsets`: the offset of each block in the segment, by height, as 8 bytes each.
+    * `<path>.index`: an open-addressing hash table (linear probing), from the first 8 bytes of each block's digest to
+      its offset. Its capacity is a power of two, which doubles whenever the table becomes half full.
+
+    Every file is read through mmap, so opening a store reads nothing but the sidecars' sizes and the index header, and
+    each lookup reads only the records it needs. Appends are written straight to the files, without buffering, so they
+    are immediately visible through the maps; `sync` makes them durable. A block interrupted part-way through being
+    appended is truncated, or indexed, when the store is next opened.
+    """
+
+    MAGIC = b'BLKSEG01'
+    INDEX_MAGIC = b'BLKIDX01'
+
+    # Height, timestamp, previous digest, digest, data length
+    RECORD = struct.Struct('<Qd32s32sI')
+    # Magic, capacity, count
+    INDEX_HEADER = struct.Struct('<8sQQ')
+    # Digest tag, offset + 1 (so that 0 marks an empty slot)
+    SLOT = struct.Struct('<QQ')
+    OFFSET = struct.Struct('<Q')
+    # The number of blocks known to be valid, and the digest of the last of them
+    CHECKPOINT = struct.Struct('<Q32s')
+
+    # The digest stored for the first block's missing predecessor.
+    NO_DIGEST = bytes(32)
+
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, path, clock=time.time):
+        """
+        :param path: The path of the segment file, which is created if it does not exist.
+        :param clock: A function which returns the current time, as a timestamp.
+        """
+        self.path = path
+        self.clock = clock
+
+        if not os.path.exists(path):
+            with open(path, 'wb') as file:
+                file.write(self.MAGIC)
+        self.segment = open(path, 'r+b', buffering=0)
+        if self.segment.read(len(self.MAGIC)) != self.MAGIC:
+            self.segment.close()
+            raise ValueError('{} is not a block store'.format(path))
+        self.size = os.path.getsize(path)
+        self.segment_map = None
+
+        self.offsets = open(path + '.offsets', 'a+b', buffering=0)
+        self.count = os.path.getsize(path + '.offsets') // self.OFFSET.size
+        self.offsets.truncate(self.count * self.OFFSET.size)
+        self.offsets_map = None
+
+        self.index = None
+        self.index_map = None
+        self._open_index()
+        self._recover()
+
+        # The last block, whose hash and timestamp each append needs.
+        self.last = self.block_at(-1)
+
+    # Files and maps
+
+    def _map(self, file, current):
+        """Return a read-only map of the whole of a file, replacing the current map if the file has grown"""
+        size = os.fstat(file.fileno()).st_size
+        if current is not None:
+            if len(current) == size:
+                return current
+            current.close()
+        return mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ) if size else None
+
+    def _segment(self, end):
+        """Return a map of the segment which extends to at least the given offset"""
+        if self.segment_map is None or len(self.segment_map) < end:
+            self.segment_map = self._map(self.segment, self.segment_map)
+        return self.segment_map
+
+    def _offset(self, height):
+        """Return the offset of the block at the given height"""
+        end = (height + 1) * self.OFFSET.size
+        if self.offsets_map is None or len(self.offsets_map) < end:
+            self.offsets_map = self._map(self.offsets, self.offsets_map)
+        return self.OFFSET.unpack_from(self.offsets_map, height * self.OFFSET.size)[0]
+
+    def _record(self, offset):
+        """Return the header fields of the record at the given offset"""
+        return self.RECORD.unpack_from(self._segment(offset + self.RECORD.size), offset)
+
+    @classmethod
+    def _decode(cls, segment, offset):
+        """Read the block at the given offset of a segment map"""
+        _, timestamp, previous_digest, digest, length = cls.RECORD.unpack_from(segment, offset)
+        start = offset + cls.RECORD.size
+        data = segment[start:start + length].decode()
+        previous_hash = None if previous_digest == cls.NO_DIGEST else previous_digest.hex()
+        return Block.restore(timestamp, data, previous_hash, digest.hex())
+
+    def _block(self, offset):
+        """Read the block at the given offset"""
+        length = self._record(offset)[4]
+        return self._decode(self._segment(offset + self.RECORD.size + length), offset)
+
+    # Hash index
+
+    def _open_index(self):
+        """Open the hash index, rebuilding it if it is missing, truncated, or does not match the segment"""
+        index_path = self.path + '.index'
+        if os.path.exists(index_path):
+            self.index = open(index_path, 'r+b', buffering=0)
+            size = os.fstat(self.index.fileno()).st_size
+            if size >= self.INDEX_HEADER.size:
+                self.index_map = mmap.mmap(self.index.fileno(), 0)
+                magic, self.capacity, count = self.INDEX_HEADER.unpack_from(self.index_map)
+                if magic == self.INDEX_MAGIC and count == self.count and \
+                        size == self.INDEX_HEADER.size + self.capacity * self.SLOT.size:
+                    return
+                self.index_map.close()
+                self.index_map = None
+            self.index.close()
+            self.index = None
+        self._rebuild_index(max(self.INITIAL_CAPACITY, 1 << (4 * self.count).bit_length()))
+
+    def _rebuild_index(self, capacity):
+        """Write a new hash index of the given capacity, and replace the current one with it"""
+        old_map = self.index_map
+        index_path = self.path + '.index'
+        with open(index_path + '.tmp', 'wb') as file:
+            file.write(self.INDEX_HEADER.pack(self.INDEX_MAGIC, capacity, 0))
+            file.truncate(self.INDEX_HEADER.size + capacity * self.SLOT.size)
+
+        if self.index is not None:
+            self.index.close()
+        self.index = open(index_path + '.tmp', 'r+b', buffering=0)
+        self.index_map = mmap.mmap(self.index.fileno(), 0)
+        self.capacity = capacity
+        if old_map is not None and self.INDEX_HEADER.unpack_from(old_map)[2] == self.count:
+            # Move the entries of the old index, without reading the segment.
+            for slot in range(self.INDEX_HEADER.size, len(old_map), self.SLOT.size):
+                tag, offset = self.SLOT.unpack_from(old_map, slot)
+                if offset:
+                    self._insert(tag, offset - 1)
+        else:
+            for height in range(self.count):
+                offset = self._offset(height)
+                self._insert(self._tag(self._record(offset)[3]), offset)
+        self.INDEX_HEADER.pack_into(self.index_map, 0, self.INDEX_MAGIC, capacity, self.count)
+
+        if old_map is not None:
+            old_map.close()
+        os.replace(index_path + '.tmp', index_path)
+
+    @staticmethod
+    def _tag(digest):
+        """Return the tag of a digest: its first 8 bytes, as an integer"""
+        return int.from_bytes(digest[:8], 'little')
+
+    def _insert(self, tag, offset):
+        """Add a digest's tag and its block's offset to the hash index"""
+        mask = self.capacity - 1
+        bucket = tag & mask
+        while self.SLOT.unpack_from(self.index_map, self.INDEX_HEADER.size + bucket * self.SLOT.size)[1]:
+            bucket = (bucket + 1) & mask
+        self.SLOT.pack_into(self.index_map, self.INDEX_HEADER.size + bucket * self.SLOT.size, tag, offset + 1)
+
+    def _find(self, digest):
+        """Return the offset of the block with the given digest, or None"""
+        tag = self._tag(digest)
+        mask = self.capacity - 1
+        bucket = tag & mask
+        while True:
+            slot_tag, offset = self.SLOT.unpack_from(self.index_map, self.INDEX_HEADER.size + bucket * self.SLOT.size)
+            if not offset:
+                return None
+            if slot_tag == tag and self._record(offset - 1)[3] == digest:
+                return offset - 1
+            bucket = (bucket + 1) & mask
+
+    # Appending
+
+    def _index_block(self, offset, digest):
+        """Record a block, already written to the segment, in the offsets and the hash index"""
+        self.offsets.write(self.OFFSET.pack(offset))
+        self.count += 1
+        if 2 * self.count > self.capacity:
+            self.count -= 1  # The old index does not hold the new block yet.
+            self._rebuild_index(2 * self.capacity)
+            self.count += 1
+        self._insert(self._tag(digest), offset)
+        self.INDEX_HEADER.pack_into(self.index_map, 0, self.INDEX_MAGIC, self.capacity, self.count)
+
+    def _recover(self):
+        """Index any complete blocks beyond the last indexed one, and truncate an incomplete block"""
+        offset = len(self.MAGIC)
+        if self.count:
+            last = self._offset(self.count - 1)
+            offset = last + self.RECORD.size + self._record(last)[4]
+
+        while offset + self.RECORD.size <= self.size:
+            _, _, _, digest, length = self._record(offset)
+            if offset + self.RECORD.size + length > self.size:
+                break
+            self._index_block(offset, digest)
+            offset += self.RECORD.size + length
+
+        if offset < self.size:
+            self.segment.truncate(offset)
+            self.size = offset
+            if self.segment_map is not None:
+                self.segment_map.close()
+                self.segment_map = None
+
+    def append(self, block_data):
+        """
+        Add a new block containing the given data to the store.
+
+        The block's timestamp is the current time, or the previous block's timestamp if the clock has gone backwards.
+
+        :param block_data: The block data.
+        :return: The new Block.
+        """
+        last = self.last
+        timestamp = self.clock()
+        if last is not None and timestamp < last.timestamp:
+            timestamp = last.timestamp
+
+        block = Block(timestamp, block_data, None if last is None else last.hash)
+        digest = bytes.fromhex(block.hash)
+        data = block_data.encode()
+        previous_digest = self.NO_DIGEST if last is None else bytes.fromhex(last.hash)
+
+        offset = self.size
+        self.segment.seek(offset)
+        self.segment.write(self.RECORD.pack(self.count, timestamp, previous_digest, digest, len(data)) + data)
+        self.size += self.RECORD.size + len(data)
+        self._index_block(offset, digest)
+
+        self.last = block
+        return block
+
+    def sync(self):
+        """Flush the store to disk"""
+        self.index_map.flush()
+        for file in (self.segment, self.offsets, self.index):
+            os.fsync(file.fileno())
+
+    def close(self):
+        """Close the store's files"""
+        for mapped in (self.segment_map, self.offsets_map, self.index_map):
+            if mapped is not None:
+                mapped.close()
+        for file in (self.segment, self.offsets, self.index):
+            file.close()
+
+    # Reading
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        """Iterate over the blocks, in order"""
+        for height in range(self.count):
+            yield self._block(self._offset(height))
+
+    def block_at(self, height):
+        """
+        Return the block at the given height: 0 for the first block, or negative to count back from the last.
+
+        :param height: The height.
+        :return: The Block, or None if there is no block at that height.
+        """
+        if height < 0:
+            height += self.count
+        if not 0 <= height < self.count:
+            return None
+        return self._block(self._offset(height))
+
+    def get(self, target_hash):
+        """
+        Return the block identified by the given hash.
+
+        :param target_hash: The hash, as a hex string, or a 32-byte digest.
+        :return: The Block, or None if no matching block is found.
+        """
+        if isinstance(target_hash, str):
+            try:
+                target_hash = bytes.fromhex(target_hash)
+            except ValueError:
+                return None
+        if len(target_hash) != 32:
+            return None
+        offset = self._find(target_hash)
+        return None if offset is None else self._block(offset)
+
+    def search(self, target_hash):
+        """
+        Search the store for a block identifed by the given hash.
+
+        :param target_hash: The hash we're searching for.
+        :return: The block data, or None if no matching block is found.
+        """
+        block = self.get(target_hash)
+        return None if block is None else block.data
+
+    # Verification
+
+    @property
+    def verified_height(self):
+        """
+        The number of blocks, from the first, known to be valid, according to the checkpoint file.
+
+        The checkpoint is ignored if the block it names no longer has the digest it recorded.
+        """
+        try:
+            with open(self.path + '.checkpoint', 'rb') as file:
+                height, digest = self.CHECKPOINT.unpack(file.read(self.CHECKPOINT.size))
+        except (OSError, struct.error):
+            return 0
+
+        last = self.block_at(height - 1) if height else None
+        if height > self.count or (last is not None and bytes.fromhex(last.hash) != digest):
+            return 0
+        return height
+
+    def _checkpoint(self, height):
+        """Record the number of blocks known to be valid"""
+        last = self.block_at(height - 1) if height else None
+        digest = self.NO_DIGEST if last is None else bytes.fromhex(last.hash)
+        with open(self.path + '.checkpoint.tmp', 'wb') as file:
+            file.write(self.CHECKPOINT.pack(height, digest))
+        os.replace(self.path + '.checkpoint.tmp', self.path + '.checkpoint')
+
+    def verify(self, verifier=None, incremental=False):
+        """
+        Verify that every block's hash is right, and links to the hash of its predecessor.
+
+        The number of blocks verified is recorded in a checkpoint file, `<path>.checkpoint`.
+
+        :param verifier: A ChainVerifier. Defaults to one with a new process pool.
+        :param incremental: Whether to verify only the blocks appended since the last checkpoint.
+        :return: The height of the first invalid block, or None if every block is valid.
+        """
+        start = self.verified_height if incremental else 0
+        failure = (verifier or ChainVerifier()).verify_store(self.path, start, self.count)
+        self._checkpoint(self.count if failure is None else failure)
+        return failure
+
+    @staticmethod
+    def verify_range(task):
+        """
+        Verify a run of stored blocks, reading them through new read-only maps of the store's files.
+
+        Blocks are read one at a time, so only a single block is held in memory, whatever the length of the run.
+
+        :param task: The path of the store, the height of the first block, and the height after the last block.
+        :return: The height of the first invalid block, or None if every block is valid.
+        """
+        path, start, stop = task
+        with open(path, 'rb') as segment_file, open(path + '.offsets', 'rb') as offsets_file:
+            with mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ) as segment, \
+                    mmap.mmap(offsets_file.fileno(), 0, access=mmap.ACCESS_READ) as offsets:
+
+                def offset_at(height):
+                    return BlockStore.OFFSET.unpack_from(offsets, height * BlockStore.OFFSET.size)[0]
+
+                # The previous block's stored hash is all that is needed of it, so its data is not decoded
+                previous_hash = None if start == 0 else \
+                    BlockStore.RECORD.unpack_from(segment, offset_at(start - 1))[3].hex()
+                for height in range(start, stop):
+                    try:
+                        block = BlockStore._decode(segment, offset_at(height))
+                    except UnicodeDecodeError:
+                        # Data that is not valid UTF-8 cannot be what was hashed
+                        return height
+                    if block.previous_hash != previous_hash or \
+                            Block(block.timestamp, block.data, block.previous_hash).hash != block.hash:
+                        return height
+                    previous_hash = block.hash
+        return None
+
+
+def verify_hashes(chunk):
+    """
+    Recalculate the hashes of a run of blocks.
+
+    :param chunk: The height of the first block, and a list of (timestamp, data, previous hash, hash) tuples.
+    :return: The height of the first block whose hash is wrong, or None if every hash is right.
+    """
+    start, records = chunk
+    for height, (timestamp, data, previous_hash, block_hash) in enumerate(records, start):
+        if Block(timestamp, data, previous_hash).hash != block_hash:
+            return height
+    return None
+
+
+class ChainVerifier(object):
+    """
+    Verifies a run of blocks: that each block's hash is right, and that each links to the hash of its predecessor.
+
+    Hashes are recalculated in chunks, in parallel, across a pool of worker processes. Links are checked in this
+    process, since each is a single comparison.
+    """
+
+    CHUNK_SIZE = 4096
+
+    def __init__(self, chunk_size=CHUNK_SIZE, max_workers=None, executor=None):
+        """
+        :param chunk_size: The number of blocks verified by each task.
+        :param max_workers: The number of worker processes. Defaults to the number of CPUs.
+        :param executor: An existing `concurrent.futures.Executor` to use, instead of a new process pool.
+        """
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.executor = executor
+
+    def _map(self, function, items, count):
+        """
+        Apply the function to every item, across the worker pool.
+
+        :param function: A picklable function.
+        :param items: An iterable of arguments.
+        :param count: The number of items.
+        :return: A list of results, in the same order as the items.
+        """
+        if self.executor is not None:
+            return list(self.executor.map(function, items))
+        if count == 1:
+            # Not worth starting a pool for.
+            return list(map(function, items))
+
+        with ProcessPoolExecutor(self.max_workers) as executor:
+            return list(executor.map(function, items))
+
+    def _chunks(self, start, stop):
+        """Return the (start, stop) heights of each chunk of a run of blocks"""
+        return [(height, min(height + self.chunk_size, stop)) for height in range(start, stop, self.chunk_size)]
+
+    def verify(self, blocks, start=0, previous_hash=None):
+        """
+        Verify a run of blocks.
+
+        :param blocks: A list of Blocks.
+        :param start: The height of the first block.
+        :param previous_hash: The hash the first block should link to: that of its predecessor, or None if it is the
+                              first block of the chain.
+        :return: The height of the first invalid block, or None if every block is valid.
+        """
+        failures = []
+
+        for height, block in enumerate(blocks, start):
+            if block.previous_hash != previous_hash:
+                failures.append(height)
+                break
+            previous_hash = block.hash
+
+        # Each chunk's records are only built as the pool takes it.
+        ranges = self._chunks(0, len(blocks))
+        chunks = ((start + first, [(block.timestamp, block.data, block.previous_hash, block.hash)
+                                   for block in blocks[first:last]])
+                  for first, last in ranges)
+        failures.extend(failure for failure in self._map(verify_hashes, chunks, len(ranges)) if failure is not None)
+
+        return min(failures, default=None)
+
+    def verify_store(self, path, start, stop):
+        """
+        Verify a run of the blocks in a BlockStore.
+
+        Each task is a range of heights, and its worker reads those blocks from the store's files itself, so no blocks
+        are sent to the workers, and no process holds more than one block at a time.
+
+        :param path: The path of the store.
+        :param start: The height of the first block.
+        :param stop: The height after the last block.
+        :return: The height of the first invalid block, or None if every block is valid.
+        """
+        ranges = self._chunks(start, stop)
+        tasks = ((path, first, last) for first, last in ranges)
+        return min((failure for failure in self._map(BlockStore.verify_range, tasks, len(ranges))
+                    if failure is not None), default=None)
+
+
 chain = Blockchain()
 chain.append('The first block')
 chain.append('The second block')
@@ -81,3 +653,187 @@ assert chain.head.next.block.previous_hash == chain.head.block.hash
 
 assert chain.search(chain.tail.block.hash) == 'The second block'
 assert chain.search('nope') is None
+
+# Blocks are found by height and by timestamp
+now = [100.0]
+chain = Blockchain(clock=lambda: now[0])
+for number in range(5000):
+    now[0] += 1
+    chain.append('Block {}'.format(number))
+assert len(chain) == 5000
+assert chain.block_at(0).data == 'Block 0'
+assert chain.block_at(-1) is chain.tail.block
+assert chain.block_at(5000) is None
+assert [block.data for block in chain.blocks_between(110, 112.5)] == ['Block 9', 'Block 10', 'Block 11']
+assert chain.blocks_between(0, 50) == []
+
+# Searching a chain longer than the recursion limit
+assert chain.search(chain.block_at(4321).hash) == 'Block 4321'
+
+# Timestamps never go backwards, even if the clock does
+now[0] = 0
+chain.append('Late block')
+assert chain.tail.block.timestamp == 5100
+assert chain.blocks_between(5100, 5100)[-1].data == 'Late block'
+
+# A block store keeps the chain on disk
+store_directory = tempfile.mkdtemp()
+store_path = os.path.join(store_directory, 'chain')
+now = [100.0]
+store = BlockStore(store_path, clock=lambda: now[0])
+for number in range(3000):
+    now[0] += 0.5
+    store.append('Block {}'.format(number))
+assert len(store) == 3000
+assert store.capacity >= 2 * len(store)
+
+first, last = store.block_at(0), store.block_at(-1)
+assert first.data == 'Block 0' and first.previous_hash is None
+assert last.data == 'Block 2999'
+assert store.block_at(3000) is None
+assert store.search(store.block_at(1234).hash) == 'Block 1234'
+assert store.get(bytes.fromhex(last.hash)).data == 'Block 2999'
+assert store.search('nope') is None
+assert store.search('00' * 32) is None
+
+# Stored blocks have the hashes the in-memory Blockchain would give them
+blocks = list(store)
+assert all(block.hash == Block(block.timestamp, block.data, block.previous_hash).hash for block in blocks)
+assert all(block.previous_hash == previous.hash for previous, block in zip(blocks, blocks[1:]))
+store.sync()
+store.close()
+
+# Reopening the store needs no rebuild, and appends carry on from the last block
+store = BlockStore(store_path, clock=lambda: now[0])
+assert len(store) == 3000
+assert store.search(last.hash) == 'Block 2999'
+assert store.append('Block 3000').previous_hash == last.hash
+store.close()
+
+# An incomplete block at the end of the segment is truncated
+with open(store_path, 'ab') as file:
+    file.write(b'partial')
+store = BlockStore(store_path)
+assert len(store) == 3001
+assert store.block_at(-1).data == 'Block 3000'
+store.close()
+
+# Blocks missing from the sidecar files are indexed again
+with open(store_path + '.offsets', 'r+b') as file:
+    file.truncate(2999 * BlockStore.OFFSET.size)
+os.remove(store_path + '.index')
+store = BlockStore(store_path)
+assert len(store) == 3001
+assert store.search(last.hash) == 'Block 2999'
+store.close()
+
+# An empty or truncated index is rebuilt
+for size in (0, BlockStore.INDEX_HEADER.size + BlockStore.SLOT.size):
+    with open(store_path + '.index', 'r+b') as file:
+        file.truncate(size)
+    store = BlockStore(store_path)
+    assert store.search(last.hash) == 'Block 2999'
+    store.close()
+
+# An intact chain verifies, in chunks across a pool
+verifier = ChainVerifier(chunk_size=100, executor=ThreadPoolExecutor(4))
+chain = Blockchain()
+for number in range(1000):
+    chain.append('Block {}'.format(number))
+assert chain.verify(verifier) is None
+assert chain.verified_height == 1000
+assert ChainVerifier().verify(chain.blocks[:10]) is None
+
+# A block whose data has changed no longer matches its hash
+chain.block_at(250).data = 'Tampered'
+assert chain.verify(verifier) == 250
+assert chain.verified_height == 250
+
+# Incremental verification only covers blocks appended since the last verification
+chain.block_at(250).data = 'Block 250'
+assert chain.verify(verifier) is None
+chain.block_at(500).data = 'Tampered'
+chain.append('Block 1000')
+assert chain.verify(verifier, incremental=True) is None
+assert chain.verified_height == 1001
+assert chain.verify(verifier) == 500
+
+# A block which does not link to its predecessor is invalid, even if its own hash is right
+chain = Blockchain()
+for number in range(300):
+    chain.append('Block {}'.format(number))
+chain.blocks[150] = Block(chain.block_at(150).timestamp, 'Block 150', chain.block_at(148).hash)
+assert chain.verify(verifier) == 150
+
+# A block store checkpoints the blocks it has verified
+store = BlockStore(store_path)
+assert store.verified_height == 0
+assert store.verify(verifier) is None
+assert store.verified_height == 3001
+store.append('Block 3001')
+assert store.verify(verifier, incremental=True) is None
+assert BlockStore(store_path).verified_height == 3002
+
+# Corrupt data in the segment is found
+offset = store._offset(2000) + BlockStore.RECORD.size
+store.close()
+with open(store_path, 'r+b') as file:
+    file.seek(offset)
+    file.write(b'X')
+store = BlockStore(store_path)
+assert store.verify(verifier, incremental=True) is None
+assert store.verify(verifier) == 2000
+assert store.verified_height == 2000
+
+# Corrupt data which is not valid UTF-8 is found too
+store.close()
+with open(store_path, 'r+b') as file:
+    file.seek(offset)
+    file.write(b'\xff')
+store = BlockStore(store_path)
+assert store.verify(verifier) == 2000
+store.close()
+with open(store_path, 'r+b') as file:
+    file.seek(offset)
+    file.write(b'X')
+store = BlockStore(store_path)
+
+# Each worker process reads its own range of blocks from the store. Workers import this module to unpickle their
+# tasks, which would deadlock while it is still being imported, so the pool only runs when this is run as a script.
+if __name__ == "__main__":
+    assert store.verify(ChainVerifier(chunk_size=700, max_workers=2)) == 2000
+    with open(store_path, 'r+b') as file:
+        file.seek(offset)
+        file.write(b'B')
+    assert store.verify(ChainVerifier(chunk_size=700, max_workers=2)) is None
+    assert store.verified_height == 3002
+store.close()
+verifier.executor.shutdown()
+shutil.rmtree(store_directory)
+
+if __name__ == "__main__":
+    length = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+    chain = Blockchain()
+    for number in range(length):
+        chain.append('Block {} '.format(number) * 8)
+
+    for name, verifier in (('Serial', ChainVerifier(chunk_size=length)), ('Parallel', ChainVerifier())):
+        start = time.perf_counter()
+        assert chain.verify(verifier) is None
+        print('{}: {:.0f} blocks per second'.format(name, length / (time.perf_counter() - start)))
+
+    chain.append('New block')
+    start = time.perf_counter()
+    assert chain.verify(ChainVerifier(), incremental=True) is None
+    print('Incremental: {:.4f}s'.format(time.perf_counter() - start))
+
+    store_directory = tempfile.mkdtemp()
+    store = BlockStore(os.path.join(store_directory, 'chain'))
+    for number in range(length):
+        store.append('Block {} '.format(number) * 8)
+    start = time.perf_counter()
+    assert store.verify(ChainVerifier()) is None
+    print('Store: {:.0f} blocks per second'.format(length / (time.perf_counter() - start)))
+    store.close()
+    shutil.rmtree(store_directory)